@@ -47,7 +47,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     
     # Middleware de base
-    'django.middleware.gzip.GZipMiddleware',  # Doit être avant CommonMiddleware
+    'exams.middleware.RangeSafeGZipMiddleware',  # GZip sauf fichiers servis par plages ; avant CommonMiddleware
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -61,9 +61,14 @@ MIDDLEWARE = [
     'core.middleware.AutoLogoutMiddleware',
     
     # Middleware de performance (doivent être en dernier)
+    # 304 sur If-None-Match, y compris pour les réponses servies par FetchFromCacheMiddleware
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.cache.UpdateCacheMiddleware',
     'django.middleware.common.CommonMiddleware',  # Doit être présent après UpdateCacheMiddleware
     'django.middleware.cache.FetchFromCacheMiddleware',
+    # Badges panier / notifications : coût (Server-Timing) et pages privées ;
+    # placé après le cache pour agir avant UpdateCacheMiddleware
+    'exams.middleware.ContextCostMiddleware',
     'django_prometheus.middleware.PrometheusBeforeMiddleware',
     'django_prometheus.middleware.PrometheusAfterMiddleware',
 ]
@@ -181,6 +186,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER', 'SIMULATOR')
 DOWNLOAD_TOKEN_TTL_HOURS = int(os.getenv('DOWNLOAD_TOKEN_TTL_HOURS', '48'))
 DOWNLOAD_MAX_TIMES = int(os.getenv('DOWNLOAD_MAX_TIMES', '3'))
+# Reprise d'un téléchargement interrompu (Range) sans le décompter, pendant ce délai
+DOWNLOAD_RESUME_HOURS = int(os.getenv('DOWNLOAD_RESUME_HOURS', '24'))
+DOWNLOAD_MAX_RESUMES = int(os.getenv('DOWNLOAD_MAX_RESUMES', '5'))  # reprises gratuites par téléchargement décompté
+# Registre des téléchargements (exams.download_ledger) : écriture par lots hors requête
+DOWNLOAD_LEDGER_BATCH = int(os.getenv('DOWNLOAD_LEDGER_BATCH', '500'))  # lignes par INSERT, écriture anticipée au-delà
+DOWNLOAD_LEDGER_FLUSH_SECONDS = float(os.getenv('DOWNLOAD_LEDGER_FLUSH_SECONDS', '5'))
+DOWNLOAD_LEDGER_MAX_PENDING = int(os.getenv('DOWNLOAD_LEDGER_MAX_PENDING', '10000'))  # lignes en mémoire par processus
+# Commandes groupées (établissements) : places par commande, validité des liens
+BULK_ORDER_MAX_SEATS = int(os.getenv('BULK_ORDER_MAX_SEATS', '5000'))
+BULK_TOKEN_TTL_DAYS = int(os.getenv('BULK_TOKEN_TTL_DAYS', '90'))
 
 SITE_ID = 1
 
@@ -188,6 +203,15 @@ SITE_ID = 1
 PROTECTED_MEDIA_ROOT = BASE_DIR / 'protected_media'
 os.makedirs(PROTECTED_MEDIA_ROOT, exist_ok=True)  # s'assure que le dossier existe au démarrage
 
+# Envoi des téléchargements délégué au proxy frontal (exams.file_delivery) :
+# '' = par Django, 'accel' = X-Accel-Redirect (nginx), 'sendfile' = X-Sendfile (Apache, lighttpd)
+FILE_OFFLOAD = os.getenv('FILE_OFFLOAD', '')
+# racine -> emplacement interne du proxy (nginx : location <url> { internal; alias <racine>/; })
+FILE_OFFLOAD_LOCATIONS = {
+    str(PROTECTED_MEDIA_ROOT): os.getenv('FILE_OFFLOAD_PROTECTED_URL', '/_protected/'),
+    str(MEDIA_ROOT): os.getenv('FILE_OFFLOAD_MEDIA_URL', '/_media/'),
+}
+
 # Configuration des canaux (Channels)
 ASGI_APPLICATION = 'examhub.asgi.application'
 
@@ -287,9 +311,21 @@ CACHE_MIDDLEWARE_KEY_PREFIX = 'examhub'
 CACHE_MIDDLEWARE_SECONDS = 60 * 15  # 15 minutes
 CACHE_MIDDLEWARE_KEY_PREFIX = 'examhub'
 
+# Durée de cache (navigateur + UpdateCacheMiddleware) du fragment AJAX des cartes d'examens.
+# Les pages complètes sont en "private, no-cache" et revalidées par ETag (exams.http_cache).
+CATALOG_FRAGMENT_MAX_AGE = int(os.getenv('CATALOG_FRAGMENT_MAX_AGE', '30'))
+
+# Server-Timing du coût des context processors (exams.middleware.ContextCostMiddleware)
+CONTEXT_COST_TIMING = os.getenv('CONTEXT_COST_TIMING', str(DEBUG)).lower() in ('1', 'true', 'yes')
+
 # Configuration pour les requêtes lourdes
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# Au-delà, fichier temporaire dont le SHA-256 est calculé à la réception (ZIP dédupliqués, exams.blobs)
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'exams.blobs.HashingUploadHandler',
+]
 
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
@@ -318,6 +354,26 @@ STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 CINETPAY_API_KEY = config("CINETPAY_API_KEY")
 CINETPAY_SITE_ID = config("CINETPAY_SITE_ID")
 CINETPAY_BASE_URL = config("CINETPAY_BASE_URL", default="https://api-checkout.cinetpay.com/v2/payment")
+CINETPAY_CHECK_URL = config("CINETPAY_CHECK_URL", default=CINETPAY_BASE_URL.rstrip("/") + "/check")
+# Vide = API Stripe officielle ; ex. http://127.0.0.1:8765 pour le prestataire local (payment_standin)
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")
+
+# Initialisation des paiements en arrière-plan (exams.payments)
+PAYMENT_INIT_CONCURRENCY = int(os.getenv("PAYMENT_INIT_CONCURRENCY", "8"))  # appels simultanés au prestataire
+PAYMENT_INIT_QUEUE = int(os.getenv("PAYMENT_INIT_QUEUE", "64"))  # initialisations en attente au-delà
+PAYMENT_INIT_TIMEOUT = float(os.getenv("PAYMENT_INIT_TIMEOUT", "15"))  # s, échéance de l'initialisation, essais compris
+
+# Réconciliation des commandes en attente (exams.reconciliation, commande reconcile_orders)
+RECONCILE_MIN_AGE = int(os.getenv("RECONCILE_MIN_AGE", "600"))  # s laissées au webhook avant d'interroger
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "4"))  # appels simultanés au prestataire
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_BASE_DELAY = int(os.getenv("RECONCILE_BASE_DELAY", "300"))  # s avant de réinterroger, doublé à chaque fois
+RECONCILE_MAX_DELAY = int(os.getenv("RECONCILE_MAX_DELAY", str(6 * 3600)))
+
+# Accès à /metrics : jeton du collecteur (Authorization: Bearer …) et/ou réseaux autorisés.
+# Derrière un proxy local, REMOTE_ADDR vaut 127.0.0.1 pour tout le monde : préférer le jeton.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_ALLOWED_IPS = [n.strip() for n in os.getenv("METRICS_ALLOWED_IPS", "").split(",") if n.strip()]
 
 # Déconnexion automatique après inactivité
 INACTIVITY_TIMEOUT = int(os.getenv("INACTIVITY_TIMEOUT", "1800"))  # 30 minutes
@@ -328,6 +384,11 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 # --- OpenAI (utilisé pour le chatbot) ---
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+CHATBOT_DEADLINE = float(os.getenv("CHATBOT_DEADLINE", "45"))  # s, essais compris
+
+# Appels sortants (exams.outbound) : surcharge par prestataire des valeurs par défaut
+# {"cinetpay"|"stripe"|"openai": {"timeout", "pool_size", "max_tries", "failure_threshold", "reset_timeout"}}
+OUTBOUND_PROVIDERS = {}
 
 # Autoriser l'affichage en iframe sur la même origine (nécessaire pour prévisualiser les PDF dans le forum)
 X_FRAME_OPTIONS = 'SAMEORIGIN'
@@ -2,6 +2,10 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.decorators.cache import never_cache
+from django_prometheus.exports import ExportToDjangoView
+
+from exams.metrics import protected
 
 # Personnalisation légère de l'admin (titres)
 admin.site.site_header = "Examhub — Backoffice"
@@ -21,6 +25,10 @@ urlpatterns = [
     
     # Authentification (allauth)
     path('accounts/', include('allauth.urls')),
+
+    # Métriques Prometheus (django_prometheus + exams.metrics), hors cache de pages,
+    # réservées au collecteur (exams.metrics.protected)
+    path('metrics', never_cache(protected(ExportToDjangoView)), name='prometheus-django-metrics'),
 ]
 
 if settings.DEBUG:
@@ -4,13 +4,12 @@ from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.utils.html import format_html
-from django.core.files.base import ContentFile
 
-from .forms_admin import ImportZipForm
+from .forms_admin import BulkOrderForm, ImportZipForm
+from . import bulk_orders, notifications
 
-from .models import Exam, Subject, Pack, Order, OrderItem, Payment, DownloadToken, Profile, FreeSample, Notification
+from .models import Exam, Subject, Pack, PriceRule, Order, OrderItem, Payment, DownloadToken, DownloadLog, Profile, FreeSample, Notification, WebhookEvent, PurchaseSummary, PackBlob
 import os
-import uuid
 
 User = get_user_model()
 
@@ -32,13 +31,20 @@ class SubjectAdmin(admin.ModelAdmin):
     list_display = ("name", "code", "active")
 
 
+@admin.register(PriceRule)
+class PriceRuleAdmin(admin.ModelAdmin):
+    list_display = ("level", "is_long_model", "pack_type", "subject_code", "exam", "price", "active")
+    list_filter = ("level", "pack_type", "active")
+    list_editable = ("price", "active")
+
+
 @admin.register(Pack)
 class PackAdmin(admin.ModelAdmin):
     list_display = ("exam", "pack_type", "subject", "years_range", "price", "is_active", "file_link")
     list_filter = ("exam", "pack_type", "is_active")
     search_fields = ("exam__name", "subject__name")
     fields = ("exam", "pack_type", "subject", "years_range", "price", "is_active", "file")
-    actions = ["clear_zip", "import_zip"]
+    actions = ["clear_zip", "import_zip", "bulk_order"]
 
     # --- Lien de téléchargement dans la colonne FICHIER ZIP ---
     @admin.display(description="Fichier ZIP")
@@ -80,27 +86,19 @@ class PackAdmin(admin.ModelAdmin):
             form = ImportZipForm(request.POST, request.FILES)
             if form.is_valid():
                 uploaded = form.cleaned_data["zip_file"]
-                data = uploaded.read()
 
                 updated = 0
                 for pack in queryset:
-                    # supprime l'éventuel ancien fichier
+                    # supprime l'éventuel ancien fichier propre au pack ; un blob
+                    # partagé est seulement libéré à l'enregistrement (exams.blobs)
                     if pack.file:
                         try:
-                            old_storage = pack.file.storage
-                            old_path = pack.file.name
                             pack.file.delete(save=False)
-                            if old_storage.exists(old_path):
-                                old_storage.delete(old_path)
                         except Exception:
                             pass
 
-                    # nom unique
-                    base = os.path.splitext(os.path.basename(uploaded.name))[0]
-                    unique_name = f"{base}-{uuid.uuid4().hex[:8]}.zip"
-
-                    # sauvegarde dans le stockage protégé
-                    pack.file.save(f"packs/{unique_name}", ContentFile(data), save=False)
+                    # stockage par contenu : un ZIP déjà connu n'est ni relu ni recopié
+                    pack.file.save(os.path.basename(uploaded.name), uploaded, save=False)
                     pack.save(update_fields=["file"])
                     updated += 1
 
@@ -119,11 +117,69 @@ class PackAdmin(admin.ModelAdmin):
         })
 
 
+    @admin.action(description="Commande groupée (établissement)")
+    def bulk_order(self, request, queryset):
+        if "apply" in request.POST:
+            form = BulkOrderForm(request.POST)
+            if form.is_valid():
+                seats = form.cleaned_data["seats"]
+                try:
+                    order = bulk_orders.create_bulk_order(
+                        form.cleaned_data["buyer"], [(pack, seats) for pack in queryset],
+                        phone=form.cleaned_data["phone"],
+                    )
+                except bulk_orders.BulkOrderError as e:
+                    form.add_error(None, str(e))
+                else:
+                    self.message_user(request, format_html(
+                        "Commande #{} créée : {} lien(s). <a href='{}'>Exporter les liens (CSV)</a>",
+                        order.pk, seats * len(queryset), reverse("exams:bulk_order_links", args=[order.pk]),
+                    ))
+                    from django.http import HttpResponseRedirect
+                    return HttpResponseRedirect(reverse("admin:exams_order_change", args=[order.pk]))
+        else:
+            form = BulkOrderForm()
+
+        return render(request, "admin/bulk_order.html", {
+            "packs": queryset,
+            "form": form,
+            "action": "bulk_order",
+            "title": "Commande groupée pour les packs sélectionnés",
+        })
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "email", "phone", "status", "total_amount", "created_at")
-    list_filter = ("status",)
-    search_fields = ("user__username", "email", "phone")
+    list_display = ("id", "user", "email", "phone", "status", "total_amount", "created_at", "links_csv")
+    list_filter = ("status", "bulk")
+    search_fields = ("user__username", "email", "phone", "transaction_id", "stripe_session_id")
+
+    @admin.display(description="Liens")
+    def links_csv(self, obj):
+        if obj.bulk and obj.status == "PAID":
+            return format_html("<a href='{}'>CSV</a>", reverse("exams:bulk_order_links", args=[obj.pk]))
+        return "—"
+
+
+@admin.register(PurchaseSummary)
+class PurchaseSummaryAdmin(admin.ModelAdmin):
+    list_display = ("user", "orders_count", "total_spent", "owned_packs", "last_order_at")
+    search_fields = ("user__username", "user__email")
+    readonly_fields = ("user", "orders_count", "total_spent", "owned_packs", "last_order_at", "updated_at")
+
+
+@admin.register(PackBlob)
+class PackBlobAdmin(admin.ModelAdmin):
+    """ZIP dédupliqués : consultation seule, supprimés par exams.blobs."""
+    list_display = ("sha256", "size", "refcount", "created_at", "name")
+    search_fields = ("sha256", "name")
+    readonly_fields = ("name", "sha256", "size", "refcount", "created_at")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(OrderItem)
@@ -138,7 +194,28 @@ class PaymentAdmin(admin.ModelAdmin):
 
 @admin.register(DownloadToken)
 class DownloadTokenAdmin(admin.ModelAdmin):
-    list_display = ("item", "token", "expires_at", "remaining_downloads")
+    list_display = ("item", "seat", "token", "expires_at", "remaining_downloads")
+
+
+@admin.register(DownloadLog)
+class DownloadLogAdmin(admin.ModelAdmin):
+    """Registre en ajout seul : consultation uniquement."""
+    list_display = ("started_at", "token_value", "user", "outcome", "status_code", "bytes_sent", "duration_ms", "completed", "ip")
+    list_filter = ("outcome", "completed", "started_at")
+    search_fields = ("token__token", "user__username", "ip")
+    list_select_related = ("token", "user")
+    raw_id_fields = ("token", "user")
+    date_hierarchy = "started_at"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="Jeton", ordering="token__token")
+    def token_value(self, obj):
+        return obj.token.token if obj.token_id else "—"
 
 
 # --- Inline Profile dans la fiche User ---
@@ -224,3 +301,28 @@ class NotificationAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'read', 'created_at')
     list_filter = ('read', 'created_at')
     search_fields = ('user__username', 'message')
+
+    # pas de receiver post_delete sur Notification (exams.notifications) : compteur oublié ici
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        notifications.forget_unread(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for user_id in user_ids:
+            notifications.forget_unread(user_id)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "provider", "reference", "state", "attempts", "received_at", "processed_at")
+    list_filter = ("provider", "state")
+    search_fields = ("reference",)
+    readonly_fields = ("provider", "reference", "payload", "received_at", "processed_at", "attempts", "next_attempt_at", "error")
+    actions = ["replay"]
+
+    @admin.action(description="Rejouer (remettre dans la file)")
+    def replay(self, request, queryset):
+        updated = queryset.exclude(state="RECEIVED").update(state="RECEIVED", error="", next_attempt_at=None)
+        self.message_user(request, f"{updated} webhook(s) remis dans la file. Lancez process_webhooks.")
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 class ExamsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'exams'
+
+    def ready(self):
+        from . import blobs, cart_summary, catalog, notifications, price_rules
+        blobs.connect_signals()
+        catalog.connect_signals()
+        price_rules.connect_signals()
+        cart_summary.connect_signals()
+        notifications.connect_signals()
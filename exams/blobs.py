@@ -0,0 +1,277 @@
+"""
+Stockage dédupliqué des ZIP des packs (exams.storages.BlobStorage).
+
+Chaque contenu distinct est stocké une seule fois, sous son SHA-256 :
+    blobs/<2 premiers caractères>/<sha256>.zip
+Importer un ZIP déjà connu ne copie rien : le pack pointe sur le blob existant.
+
+Le SHA-256 est calculé pendant la réception de l'envoi
+(``HashingUploadHandler``, dans FILE_UPLOAD_HANDLERS). Le stockage connaît
+donc l'empreinte sans relire le fichier ; un nouveau contenu est déplacé
+(rename) du fichier temporaire vers son blob. Les petits envois, gardés en
+mémoire, et les fichiers venus d'ailleurs (commandes) sont hachés à
+l'enregistrement.
+
+Références : une ligne PackBlob par blob, dont ``refcount`` compte les packs
+qui le désignent (Pack.file). Elle est tenue à jour par les signaux de Pack
+(création, changement de fichier, suppression), en UPDATE atomiques
+(F()). Quand le compteur tombe à zéro, la ligne est supprimée après le
+commit ; le fichier, lui, reste en place et sa date est remise à l'instant.
+Un envoi du même contenu, dont la transaction n'est pas encore validée, peut
+en effet déjà le désigner sans que cette transaction-là le voie. Le fichier
+est supprimé par ``gc_pack_blobs`` une fois le délai de grâce écoulé (date du
+fichier, remise à jour aussi quand un envoi réutilise le blob), s'il n'est
+toujours désigné par aucun pack.
+
+Un UPDATE en masse de Pack.file contourne les signaux. Un envoi interrompu
+avant l'enregistrement du pack laisse un fichier sans ligne. Dans tous ces
+cas, ``python manage.py gc_pack_blobs`` (à lancer régulièrement, cron)
+recompte les références à partir des packs et supprime les fichiers
+orphelins. Avec ``--adopt``, il convertit aussi les anciens fichiers (un par
+pack).
+"""
+import hashlib
+import logging
+import os
+import time
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from . import zip_manifest
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = 'blobs'
+CHUNK_SIZE = 1024 * 1024
+_UNCHANGED = object()
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    TemporaryFileUploadHandler qui calcule le SHA-256 au fil de la réception :
+    le fichier reçu porte ``sha256``.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+# --- Noms et empreintes --------------------------------------------------------------
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_DIR + '/')
+
+
+def blob_name(digest, ext='.zip'):
+    return f"{BLOB_DIR}/{digest[:2]}/{digest}{(ext or '').lower()}"
+
+
+def _digest_of(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def content_digest(content):
+    """SHA-256 du contenu : celui calculé à la réception s'il existe, sinon lu par blocs."""
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks(CHUNK_SIZE):
+        sha256.update(chunk)
+    digest = sha256.hexdigest()
+    try:
+        content.sha256 = digest  # même envoi enregistré pour plusieurs packs : haché une fois
+    except AttributeError:
+        pass
+    return digest
+
+
+def _storage():
+    from .models import Pack
+    return Pack._meta.get_field('file').storage
+
+
+# --- Références -------------------------------------------------------------------
+
+def acquire(name):
+    """Une référence de plus sur le blob ``name`` (ligne créée au besoin)."""
+    from .models import PackBlob
+
+    if PackBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        return
+    storage = _storage()
+    size = storage.size(name) if storage.exists(name) else 0
+    _, created = PackBlob.objects.get_or_create(
+        name=name, defaults={'sha256': _digest_of(name), 'size': size, 'refcount': 1},
+    )
+    if not created:
+        PackBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def touch(name):
+    """Remet la date du fichier à l'instant : le délai de grâce de sweep() repart."""
+    try:
+        os.utime(_storage().path(name))
+    except OSError:
+        pass
+
+
+def release(name):
+    """Une référence de moins ; ligne supprimée après le commit s'il n'en reste aucune."""
+    from .models import PackBlob
+
+    PackBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    """
+    Supprime la ligne du blob s'il n'est plus référencé. True si supprimée.
+    Le fichier est laissé à sweep() (délai de grâce) : un envoi en cours du
+    même contenu peut le désigner sans être encore visible ici.
+    """
+    from .models import Pack, PackBlob
+
+    if Pack.objects.filter(file=name).exists():
+        return False  # compteur faussé (UPDATE en masse) : gc_pack_blobs le corrige
+    deleted, _ = PackBlob.objects.filter(name=name, refcount=0).delete()
+    if not deleted:
+        return False
+    touch(name)
+    logger.info("Blob sans référence, fichier supprimé après le délai de grâce : %s", name)
+    return True
+
+
+# --- Signaux de Pack ---------------------------------------------------------------
+
+def _remember_file(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'file' not in update_fields:
+        return
+    previous = ''
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first() or ''
+    instance._blob_previous = previous
+
+
+def _track_file(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_blob_previous', _UNCHANGED)
+    current = instance.file.name or ''
+    if previous is _UNCHANGED or previous == current:
+        return
+    if is_blob(current):
+        acquire(current)
+    if is_blob(previous):
+        release(previous)
+
+
+def _forget_file(sender, instance, **kwargs):
+    if is_blob(instance.file.name):
+        release(instance.file.name)
+
+
+def connect_signals():
+    from .models import Pack
+
+    pre_save.connect(_remember_file, sender=Pack, dispatch_uid='blobs-pack-pre-save')
+    post_save.connect(_track_file, sender=Pack, dispatch_uid='blobs-pack-save')
+    post_delete.connect(_forget_file, sender=Pack, dispatch_uid='blobs-pack-delete')
+
+
+# --- Maintenance (commande gc_pack_blobs) -----------------------------------------------
+
+def adopt_legacy(dry_run=False):
+    """Convertit les anciens fichiers des packs en blobs ; renvoie le nombre de packs convertis."""
+    from .models import Pack
+
+    storage = _storage()
+    adopted = 0
+    for pack in Pack.objects.exclude(file='').exclude(file__isnull=True).exclude(file__startswith=BLOB_DIR + '/'):
+        old = pack.file.name
+        if not storage.exists(old):
+            logger.warning("Pack %s : fichier absent, non converti (%s)", pack.pk, old)
+            continue
+        adopted += 1
+        if dry_run:
+            continue
+        with storage.open(old, 'rb') as f:
+            pack.file.save(os.path.basename(old), f, save=False)
+        pack.save(update_fields=['file'])
+        if not Pack.objects.filter(file=old).exists():
+            storage.delete(old)
+    return adopted
+
+
+def recount(dry_run=False):
+    """Recalcule les compteurs depuis Pack.file ; renvoie le nombre de lignes corrigées."""
+    from .models import Pack, PackBlob
+
+    counts = dict(
+        Pack.objects.filter(file__startswith=BLOB_DIR + '/')
+        .values('file').annotate(n=Count('pk')).values_list('file', 'n')
+    )
+    fixed = 0
+    for blob in PackBlob.objects.all().iterator():
+        actual = counts.pop(blob.name, 0)
+        if blob.refcount != actual:
+            fixed += 1
+            if not dry_run:
+                PackBlob.objects.filter(pk=blob.pk).update(refcount=actual)
+    for name, n in counts.items():  # blobs référencés sans ligne
+        fixed += 1
+        if not dry_run:
+            acquire(name)
+            PackBlob.objects.filter(name=name).update(refcount=n)
+    return fixed
+
+
+def sweep(grace_seconds=3600, dry_run=False):
+    """
+    Supprime les lignes sans référence, puis les fichiers de blobs/ qu'aucune
+    ligne ni aucun pack ne désigne, inchangés depuis ``grace_seconds`` (envoi
+    en cours, blob tout juste libéré ou réutilisé). Renvoie (fichiers, octets).
+    """
+    from .models import Pack, PackBlob
+
+    storage = _storage()
+    removed, freed = 0, 0
+    if not dry_run:
+        for name in PackBlob.objects.filter(refcount=0).values_list('name', flat=True):
+            collect(name)
+
+    rows = PackBlob.objects.all() if not dry_run else PackBlob.objects.filter(refcount__gt=0)
+    known = set(rows.values_list('name', flat=True))
+    known.update(Pack.objects.filter(file__startswith=BLOB_DIR + '/').values_list('file', flat=True))
+    cutoff = time.time() - grace_seconds
+    root = storage.path(BLOB_DIR)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+            if zip_manifest.is_sidecar(name):
+                # manifeste d'un blob (exams.zip_manifest) : suit son fichier
+                name = name[:-len(zip_manifest.SUFFIX)]
+                if name in known or storage.exists(name):
+                    continue
+                if not dry_run:
+                    zip_manifest.discard(storage, name)
+                continue
+            if name in known or os.path.getmtime(path) > cutoff:
+                continue
+            removed += 1
+            freed += os.path.getsize(path)
+            if not dry_run:
+                storage.purge(name)
+    return removed, freed
@@ -0,0 +1,87 @@
+"""
+Commandes groupées des établissements : un pack pour N élèves.
+
+Une commande groupée est une commande ordinaire (Order.bulk) dont chaque
+article porte N places (OrderItem.quantity). Réglée hors ligne (facture),
+elle est créée payée puis livrée par exams.fulfillment, qui émet un jeton
+par place en INSERT groupés : quelques milliers de places se livrent en
+quelques requêtes.
+
+Les liens se distribuent aux élèves : un élève connecté peut utiliser
+n'importe quel lien de la commande (exams.views.download_file). Ils
+s'exportent en CSV, lus par curseur serveur (``iterator``) et écrits au fil
+de l'eau, sans charger toute la commande en mémoire.
+"""
+import csv
+
+from django.conf import settings
+from django.db import transaction
+
+from . import fulfillment
+
+CSV_HEADER = ['commande', 'pack', 'place', 'lien', 'expire_le', 'telechargements_restants']
+CSV_CHUNK_SIZE = 2000
+
+
+class BulkOrderError(ValueError):
+    """Commande groupée invalide (pack inconnu, nombre de places…)."""
+
+
+def create_bulk_order(buyer, lines, email='', phone=''):
+    """
+    Crée, paie et livre une commande groupée.
+    ``lines`` : [(pack, places), ...]. Renvoie la commande.
+    """
+    from .models import Order, OrderItem
+
+    lines = [(pack, int(seats)) for pack, seats in lines]
+    if not lines:
+        raise BulkOrderError("Aucun pack sélectionné.")
+    if any(seats < 1 for _, seats in lines):
+        raise BulkOrderError("Le nombre de places doit être positif.")
+    total_seats = sum(seats for _, seats in lines)
+    if total_seats > settings.BULK_ORDER_MAX_SEATS:
+        raise BulkOrderError(f"{total_seats} places demandées, maximum {settings.BULK_ORDER_MAX_SEATS} par commande.")
+    if len({pack.pk for pack, _ in lines}) != len(lines):
+        raise BulkOrderError("Chaque pack ne peut figurer qu'une fois.")
+
+    with transaction.atomic():
+        order = Order.objects.create(
+            user=buyer, email=email or buyer.email, phone=phone,
+            status='PAID', payment_method='INVOICE', bulk=True,
+            total_amount=sum(int(pack.price) * seats for pack, seats in lines),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, pack=pack, unit_price=pack.price, quantity=seats)
+            for pack, seats in lines
+        ])
+        fulfillment.fulfill_order(order)
+    return order
+
+
+class _Echo:
+    """Pseudo-fichier pour csv.writer : renvoie la ligne au lieu de l'écrire."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(order, link_prefix):
+    """
+    Lignes CSV (chaînes) des liens de la commande, place par place.
+    ``link_prefix`` : URL absolue de download_file sans le jeton.
+    """
+    from .models import DownloadToken
+
+    items = {item.pk: str(item.pack) for item in order.items.select_related('pack__exam', 'pack__subject')}
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    rows = (
+        DownloadToken.objects.filter(item_id__in=list(items)).order_by('item_id', 'seat')
+        .values_list('item_id', 'seat', 'token', 'expires_at', 'remaining_downloads')
+    )
+    for item_id, seat, token, expires_at, remaining in rows.iterator(chunk_size=CSV_CHUNK_SIZE):
+        yield writer.writerow([
+            order.pk, items[item_id], seat + 1, f"{link_prefix}{token}/",
+            expires_at.strftime('%Y-%m-%d %H:%M'), remaining,
+        ])
@@ -0,0 +1,167 @@
+"""
+Résumé dénormalisé du panier : nombre d'articles et total.
+
+Les colonnes Cart.item_count / Cart.total sont maintenues en base :
+- ajout d'un article : incrément atomique (F()) ;
+- retrait, changement de quantité, changement de prix d'un pack : recalcul en
+  une seule requête UPDATE (sous-requêtes COUNT / SUM), donc sans course entre
+  lecture et écriture.
+
+Devant ces colonnes, une entrée de cache par utilisateur ({count, total}) est
+lue par le badge de base.html ; elle est supprimée après commit à chaque
+modification et reconstruite par une simple lecture par clé primaire.
+
+Chaque changement est poussé au consumer WebSocket de l'utilisateur (exams.push).
+
+Pour les opérations groupées (bulk_create, delete d'un queryset), ``deferred()``
+regroupe les paniers touchés et ne les recalcule qu'une fois en sortie.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+
+from . import push
+
+CACHE_KEY = 'cart:summary:{user_id}'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+EMPTY = {'count': 0, 'total': 0}
+
+_local = threading.local()
+
+
+def _cache_key(user_id):
+    return CACHE_KEY.format(user_id=user_id)
+
+
+def _forget(user_ids):
+    keys = [_cache_key(uid) for uid in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+    for user_id in user_ids:
+        push.cart_changed(user_id)
+
+
+def forget(user_id):
+    """Invalide l'entrée de cache d'un utilisateur (après commit)."""
+    _forget([user_id])
+
+
+def get_summary(user):
+    """{count, total} du panier de l'utilisateur (cache, sinon lecture des colonnes)."""
+    if not getattr(user, 'is_authenticated', False):
+        return EMPTY
+    key = _cache_key(user.pk)
+    summary = cache.get(key)
+    if summary is None:
+        from .models import Cart
+
+        row = Cart.objects.filter(user_id=user.pk).values_list('item_count', 'total').first()
+        summary = {'count': row[0], 'total': row[1]} if row else EMPTY
+        cache.set(key, summary, CACHE_TIMEOUT)
+    return summary
+
+
+def recompute(cart_ids):
+    """
+    Recalcule item_count / total des paniers donnés en un UPDATE, puis relit
+    les valeurs (1 SELECT). Renvoie {cart_id: {count, total}}.
+    """
+    from .models import Cart, CartItem
+
+    cart_ids = list(cart_ids)
+    if not cart_ids:
+        return {}
+
+    items = CartItem.objects.filter(cart_id=OuterRef('pk')).order_by().values('cart_id')
+    count_sq = items.annotate(c=Count('id')).values('c')
+    total_sq = items.annotate(t=Sum(F('pack__price') * F('quantity'))).values('t')
+    Cart.objects.filter(pk__in=cart_ids).update(
+        item_count=Coalesce(Subquery(count_sq, output_field=IntegerField()), 0),
+        total=Coalesce(Subquery(total_sq, output_field=IntegerField()), 0),
+    )
+
+    rows = Cart.objects.filter(pk__in=cart_ids).values_list('pk', 'user_id', 'item_count', 'total')
+    result, user_ids = {}, []
+    for pk, user_id, count, total in rows:
+        result[pk] = {'count': count, 'total': total}
+        user_ids.append(user_id)
+    _forget(user_ids)
+    return result
+
+
+def recompute_for_packs(pack_ids):
+    """Recalcule les paniers contenant l'un des packs (changement de prix)."""
+    from .models import CartItem
+
+    cart_ids = set(
+        CartItem.objects.filter(pack_id__in=list(pack_ids)).values_list('cart_id', flat=True)
+    )
+    return recompute(cart_ids)
+
+
+def _mark_dirty(cart_id):
+    """Recalcule tout de suite, ou plus tard si un bloc deferred() est ouvert."""
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.add(cart_id)
+    else:
+        recompute([cart_id])
+
+
+@contextmanager
+def deferred():
+    """
+    Regroupe les recalculs du bloc en un seul en sortie. Le set produit
+    permet d'y ajouter des paniers modifiés sans signal (bulk_create).
+    """
+    outer = getattr(_local, 'pending', None)
+    if outer is not None:
+        # bloc imbriqué : c'est le bloc englobant qui recalculera
+        yield outer
+        return
+    _local.pending = pending = set()
+    try:
+        yield pending
+    finally:
+        _local.pending = None
+    recompute(pending)
+
+
+# --- Signaux ---------------------------------------------------------------------
+
+def _item_saved(sender, instance, created, **kwargs):
+    if created and getattr(_local, 'pending', None) is None:
+        from .models import Cart
+
+        # ajout simple : incrément atomique, sans relire tout le panier
+        subtotal = instance.pack.price * instance.quantity
+        Cart.objects.filter(pk=instance.cart_id).update(
+            item_count=F('item_count') + 1,
+            total=F('total') + subtotal,
+        )
+        _forget([instance.cart.user_id])
+        return
+    _mark_dirty(instance.cart_id)
+
+
+def _item_deleted(sender, instance, **kwargs):
+    _mark_dirty(instance.cart_id)
+
+
+def _pack_saved(sender, instance, created, **kwargs):
+    if not created:
+        recompute_for_packs([instance.pk])
+
+
+def connect_signals():
+    from .models import CartItem, Pack
+
+    post_save.connect(_item_saved, sender=CartItem, dispatch_uid='cart-summary-item-save')
+    post_delete.connect(_item_deleted, sender=CartItem, dispatch_uid='cart-summary-item-delete')
+    post_save.connect(_pack_saved, sender=Pack, dispatch_uid='cart-summary-pack-save')
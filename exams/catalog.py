@@ -0,0 +1,238 @@
+"""
+Instantané (snapshot) du catalogue : examens actifs, packs, prix, matières et
+extrait gratuit courant.
+
+Le catalogue change très rarement (saisie admin) mais est lu des milliers de
+fois par minute en période d'examens. On précalcule donc une structure unique,
+versionnée, stockée dans le cache :
+
+- ``catalog:version`` : compteur incrémenté à chaque modification d'un Exam,
+  Subject, Pack ou FreeSample (signaux post_save / post_delete, après commit).
+  Il sert aussi de base aux ETag des pages catalogue (voir ``exams.http_cache``).
+- ``catalog:changed-at`` : horodatage de la dernière modification (Last-Modified).
+- ``catalog:snapshot`` : la structure elle-même, qui embarque la version avec
+  laquelle elle a été construite.
+- ``catalog:rebuild-lock`` : verrou court (cache.add) pour qu'un seul worker
+  reconstruise ; les autres continuent de servir l'ancienne version.
+
+Chaque processus garde en plus une copie locale de la dernière version lue,
+ce qui évite de désérialiser le snapshot à chaque requête : un hit sur la
+version suffit.
+"""
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:version'
+SNAPSHOT_KEY = 'catalog:snapshot'
+CHANGED_AT_KEY = 'catalog:changed-at'
+LOCK_KEY = 'catalog:rebuild-lock'
+
+LOCK_TIMEOUT = 30            # secondes : durée max d'une reconstruction
+COLD_WAIT_SECONDS = 2.0      # attente max quand aucun snapshot n'existe encore
+COLD_WAIT_STEP = 0.05
+
+_local = {'snapshot': None}
+
+
+# --- Version -----------------------------------------------------------------
+
+def get_version():
+    """Version courante du catalogue (crée le compteur si absent)."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY) or 1
+    return version
+
+
+def bump_version():
+    """Incrémente la version : le prochain lecteur déclenchera une reconstruction."""
+    cache.set(CHANGED_AT_KEY, timezone.now(), timeout=None)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # Compteur absent (cache vidé) : on repart au-dessus de toute valeur locale
+        local = _local['snapshot']
+        version = (local['version'] if local else 0) + 1
+        cache.set(VERSION_KEY, version, timeout=None)
+        return version
+
+
+def get_last_modified():
+    """Date de dernière modification du catalogue (initialisée au premier appel)."""
+    changed_at = cache.get(CHANGED_AT_KEY)
+    if changed_at is None:
+        cache.add(CHANGED_AT_KEY, timezone.now().replace(microsecond=0), timeout=None)
+        changed_at = cache.get(CHANGED_AT_KEY) or timezone.now()
+    return changed_at
+
+
+# --- Construction --------------------------------------------------------------
+
+def _serialize_subject(subject):
+    if subject is None:
+        return None
+    return {'id': subject.id, 'name': subject.name, 'code': subject.code}
+
+
+def build_snapshot(version):
+    """
+    Construit le snapshot depuis la base (4 requêtes, quel que soit le volume).
+    Les clés reprennent les attributs des modèles pour rester compatibles avec
+    les templates existants (e.slug, p.subject.name, p.get_pack_type_display...).
+    """
+    from .models import Exam, FreeSample, Pack, Subject
+
+    pack_type_labels = dict(Pack.TYPE_CHOICES)
+
+    exams = []
+    by_id = {}
+    for exam in Exam.objects.filter(active=True).order_by('name'):
+        data = {
+            'id': exam.id,
+            'name': exam.name,
+            'slug': exam.slug,
+            'level': exam.level,
+            'is_long_model': exam.is_long_model,
+            'packs': [],
+        }
+        exams.append(data)
+        by_id[exam.id] = data
+
+    packs = (
+        Pack.objects.filter(is_active=True, exam_id__in=list(by_id))
+        .select_related('subject')
+        .order_by('id')
+    )
+    for pack in packs:
+        exam = by_id[pack.exam_id]
+        label = f"{exam['name']} {pack_type_labels.get(pack.pack_type, pack.pack_type)}"
+        if pack.pack_type == 'SINGLE' and pack.subject:
+            label += f" — {pack.subject.name}"
+        exam['packs'].append({
+            'id': pack.id,
+            'exam': {'id': exam['id'], 'name': exam['name'], 'slug': exam['slug']},
+            'pack_type': pack.pack_type,
+            'get_pack_type_display': pack_type_labels.get(pack.pack_type, pack.pack_type),
+            'subject': _serialize_subject(pack.subject),
+            'years_range': pack.years_range,
+            'price': pack.price,
+            'label': label,
+        })
+
+    subjects = [
+        _serialize_subject(s)
+        for s in Subject.objects.filter(active=True).order_by('name')
+    ]
+
+    # Extrait gratuit : le plus récent actif (cf. free_sample_page)
+    sample = FreeSample.objects.filter(is_active=True).order_by('-uploaded_at').first()
+    free_sample = None
+    if sample is not None:
+        free_sample = {'pk': sample.pk, 'title': sample.title, 'file': sample.file.name or ''}
+
+    return {
+        'version': version,
+        'built_at': timezone.now().isoformat(),
+        'exams': exams,
+        'subjects': subjects,
+        'free_sample': free_sample,
+        'slugs': {e['slug']: i for i, e in enumerate(exams)},
+    }
+
+
+def _rebuild(version):
+    snapshot = build_snapshot(version)
+    cache.set(SNAPSHOT_KEY, snapshot, timeout=None)
+    return snapshot
+
+
+def _remember(snapshot):
+    _local['snapshot'] = snapshot
+    return snapshot
+
+
+# --- Lecture -------------------------------------------------------------------
+
+def get_snapshot():
+    """
+    Renvoie le snapshot courant.
+
+    - Version locale à jour : aucun accès cache/base hormis la lecture de version.
+    - Snapshot périmé : un seul worker obtient le verrou et reconstruit ; les
+      autres servent l'ancienne version en attendant.
+    - Démarrage à froid (aucun snapshot) : on attend brièvement le worker qui
+      reconstruit, puis on construit localement en dernier recours.
+    """
+    version = get_version()
+    local = _local['snapshot']
+    if local is not None and local['version'] == version:
+        return local
+
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and snapshot.get('version') == version:
+        return _remember(snapshot)
+
+    if cache.add(LOCK_KEY, 1, timeout=LOCK_TIMEOUT):
+        try:
+            return _remember(_rebuild(version))
+        except Exception:
+            logger.exception("Reconstruction du catalogue impossible")
+            if snapshot is None:
+                raise
+        finally:
+            cache.delete(LOCK_KEY)
+
+    # Un autre worker reconstruit : on sert l'ancienne version si on en a une
+    stale = snapshot or local
+    if stale is not None:
+        return stale
+
+    waited = 0.0
+    while waited < COLD_WAIT_SECONDS:
+        time.sleep(COLD_WAIT_STEP)
+        waited += COLD_WAIT_STEP
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return _remember(snapshot)
+    return build_snapshot(version)
+
+
+def free_sample():
+    return get_snapshot()['free_sample']
+
+
+def active_exams():
+    return get_snapshot()['exams']
+
+
+def get_exam(slug):
+    """Examen actif (avec ses packs) par slug, ou None."""
+    snapshot = get_snapshot()
+    idx = snapshot['slugs'].get(slug)
+    if idx is None:
+        return None
+    return snapshot['exams'][idx]
+
+
+# --- Invalidation --------------------------------------------------------------
+
+def invalidate_catalog(**kwargs):
+    """Receiver post_save/post_delete : incrémente la version après commit."""
+    transaction.on_commit(bump_version)
+
+
+def connect_signals():
+    from .models import Exam, FreeSample, Pack, Subject
+
+    for model in (Exam, Subject, Pack, FreeSample):
+        uid = f'catalog-invalidate-{model.__name__}'
+        post_save.connect(invalidate_catalog, sender=model, dispatch_uid=f'{uid}-save')
+        post_delete.connect(invalidate_catalog, sender=model, dispatch_uid=f'{uid}-delete')
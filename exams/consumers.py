@@ -0,0 +1,80 @@
+import json
+import logging
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from . import cart_summary, notifications
+from .push import group_name
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Canal personnel de l'utilisateur connecté : nouvelles notifications,
+    compteur de non lues et nombre d'articles du panier, poussés par
+    exams.push dès qu'ils changent (paiement, webhooks, panier...).
+
+    Messages envoyés au client :
+      {"type": "state", "unread": n, "cart_count": n}      à la connexion
+      {"type": "notification", "notification": {...}}
+      {"type": "unread", "unread": n, "delta": d|null}
+      {"type": "cart", "cart_count": n}
+      {"type": "checkout", "order_id": n, "state": "ready"|"failed", "redirect_url": ..., "error": ...}
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        if self.user.is_anonymous:
+            await self.close()
+            return
+
+        self.group = group_name(self.user.pk)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        await self._send_state()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group'):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Seul message accepté : {"type": "sync"} pour resynchroniser les compteurs
+        try:
+            data = json.loads(text_data or '{}')
+        except ValueError:
+            return
+        if data.get('type') == 'sync':
+            await self._send_state()
+
+    @database_sync_to_async
+    def _state(self):
+        return notifications.unread_count(self.user), cart_summary.get_summary(self.user)['count']
+
+    async def _send_state(self):
+        unread, cart_count = await self._state()
+        await self._send_json({'type': 'state', 'unread': unread, 'cart_count': cart_count})
+
+    async def _send_json(self, data):
+        await self.send(text_data=json.dumps(data))
+
+    # --- Événements de groupe (exams.push) ----------------------------------
+
+    async def notification_created(self, event):
+        await self._send_json({'type': 'notification', 'notification': event['notification']})
+
+    async def unread_count(self, event):
+        await self._send_json({'type': 'unread', 'unread': event['unread'], 'delta': event.get('delta')})
+
+    async def cart_count(self, event):
+        await self._send_json({'type': 'cart', 'cart_count': event['count']})
+
+    async def checkout_update(self, event):
+        await self._send_json({
+            'type': 'checkout',
+            'order_id': event['order_id'],
+            'state': event['state'],
+            'redirect_url': event.get('redirect_url'),
+            'error': event.get('error'),
+        })
@@ -1,23 +1,47 @@
-from .models import Cart, Notification
+import time
+
+from . import cart_summary, notifications
+
+
+class LazyBadge:
+    """
+    Valeur de contexte calculée à la première lecture par un template
+    (le moteur de templates appelle les callables), puis mémorisée.
+    Une page qui n'affiche pas le badge (fragment AJAX, page d'erreur) ne
+    paie donc rien. Le temps passé est cumulé dans request.context_costs
+    (voir exams.middleware.ContextCostMiddleware).
+    """
+
+    def __init__(self, request, name, compute):
+        self.request = request
+        self.name = name
+        self.compute = compute
+        self._value = None
+        self._done = False
+
+    def __call__(self):
+        if not self._done:
+            start = time.perf_counter()
+            self._value = self.compute(self.request.user)
+            costs = getattr(self.request, 'context_costs', None)
+            if costs is None:
+                costs = self.request.context_costs = {}
+            costs[self.name] = (time.perf_counter() - start) * 1000
+            self._done = True
+        return self._value
+
+    def __str__(self):
+        return str(self())
+
 
 def cart_context(request):
     """
-    Ajoute cart_count au contexte global.
+    Ajoute cart_count au contexte global (paresseux, voir exams.cart_summary).
     """
-    count = 0
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            count = cart.items.count()
-        except Cart.DoesNotExist:
-            count = 0
-    return {'cart_count': count}
+    return {'cart_count': LazyBadge(request, 'cart', lambda user: cart_summary.get_summary(user)['count'])}
 
 def notifications_context(request):
     """
-    Ajoute notifications_count au contexte global.
+    Ajoute notifications_count au contexte global (paresseux, voir exams.notifications).
     """
-    count = 0
-    if request.user.is_authenticated:
-        count = Notification.objects.filter(user=request.user, read=False).count()
-    return {'notifications_count': count}
\ No newline at end of file
+    return {'notifications_count': LazyBadge(request, 'notifications', notifications.unread_count)}
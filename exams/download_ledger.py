@@ -0,0 +1,252 @@
+"""
+Registre des téléchargements (modèle DownloadLog), écrit hors de la requête.
+
+exams.views.download_file appelle ``track()`` sur chaque tentative : la ligne
+est complétée quand l'envoi se termine (octets envoyés, durée, envoi complet
+ou interrompu), puis mise dans un tampon en mémoire. Un thread de fond par
+processus l'écrit par lots (``bulk_create``) toutes les
+DOWNLOAD_LEDGER_FLUSH_SECONDS, ou dès DOWNLOAD_LEDGER_BATCH lignes : la
+requête ne touche jamais la table.
+
+Le tampon est borné (DOWNLOAD_LEDGER_MAX_PENDING) : base indisponible, les
+lignes en trop sont abandonnées (métrique examhub_download_ledger_dropped_total)
+plutôt que de faire grossir le processus. Les lignes en tampon sont écrites à
+l'arrêt normal du processus ; un arrêt brutal peut perdre les dernières
+secondes, ce qui convient à des statistiques (planification, abus) mais pas à
+la comptabilité : le compteur du jeton, lui, est mis à jour dans la requête.
+
+Point de reprise : un envoi décompté ou repris qui n'est pas allé au bout
+avance DownloadToken.resume_offset (octet de départ + octets envoyés), en un
+UPDATE à la fin de l'envoi, hors tampon. Une reprise gratuite ne peut pas
+commencer au-delà (DownloadToken.resume).
+
+Fichier envoyé par le proxy (FILE_OFFLOAD) : octets et fin d'envoi sont
+inconnus de Django (champs vides) ; le journal d'accès du proxy les donne.
+Le point de reprise n'avance pas : une reprise y est décomptée.
+
+Sous ASGI (Daphne), le contenu est lu bloc par bloc dans un thread et compté
+au fil de l'envoi (sans itérateur asynchrone, Django lirait tout le fichier en
+mémoire avant d'envoyer quoi que ce soit, et le compte serait toujours
+complet). Django 4.2 ne surveille pas la déconnexion du client pendant un
+flux : un envoi mené jusqu'au bout a ``completed`` vide (réception inconnue),
+``bytes_sent`` compte les octets remis au serveur.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_pending = []
+_state = {'thread': None}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# --- Écriture par lots ---------------------------------------------------------------
+
+def _insert(rows):
+    from .models import DownloadLog
+
+    DownloadLog.objects.bulk_create(
+        [DownloadLog(**row) for row in rows], batch_size=_setting('DOWNLOAD_LEDGER_BATCH', 500),
+    )
+
+
+def _detach_deleted(rows):
+    """Lignes dont le jeton ou le compte n'existe plus : gardées, sans la référence."""
+    from django.contrib.auth import get_user_model
+    from .models import DownloadToken
+
+    tokens = set(DownloadToken.objects.filter(pk__in={r['token_id'] for r in rows}).values_list('pk', flat=True))
+    users = set(get_user_model().objects.filter(
+        pk__in={r['user_id'] for r in rows if r['user_id']}).values_list('pk', flat=True))
+    for row in rows:
+        if row['token_id'] not in tokens:
+            row['token_id'] = None
+        if row['user_id'] not in users:
+            row['user_id'] = None
+    return rows
+
+
+def flush():
+    """Écrit les lignes en attente ; renvoie leur nombre (0 si l'écriture échoue)."""
+    with _lock:
+        rows = _pending[:]
+        del _pending[:]
+    if not rows:
+        return 0
+    try:
+        try:
+            _insert(rows)
+        except IntegrityError:
+            # jeton ou compte supprimé depuis la tentative (commande effacée…)
+            _insert(_detach_deleted(rows))
+    except Exception:
+        logger.exception("Registre des téléchargements : %d ligne(s) non écrite(s), remises en attente", len(rows))
+        _enqueue(rows)
+        return 0
+    return len(rows)
+
+
+def _run():
+    interval = float(_setting('DOWNLOAD_LEDGER_FLUSH_SECONDS', 5))
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        close_old_connections()
+        try:
+            flush()
+        finally:
+            close_old_connections()
+
+
+def _ensure_writer():
+    if _state['thread'] is None:
+        with _lock:
+            if _state['thread'] is None:
+                _state['thread'] = threading.Thread(target=_run, name='download-ledger', daemon=True)
+                _state['thread'].start()
+                atexit.register(flush)
+
+
+def _enqueue(rows):
+    limit = int(_setting('DOWNLOAD_LEDGER_MAX_PENDING', 10000))
+    with _lock:
+        room = max(limit - len(_pending), 0)
+        _pending.extend(rows[:room])
+        size = len(_pending)
+    if len(rows) > room:
+        metrics.DOWNLOAD_LEDGER_DROPPED.inc(len(rows) - room)
+        logger.warning("Registre des téléchargements plein : %d ligne(s) abandonnée(s)", len(rows) - room)
+    if size >= int(_setting('DOWNLOAD_LEDGER_BATCH', 500)):
+        _wakeup.set()
+
+
+def _record(row):
+    metrics.DOWNLOADS.labels(row['outcome']).inc()
+    if row.get('bytes_sent'):
+        metrics.DOWNLOAD_BYTES.inc(row['bytes_sent'])
+    _enqueue([row])
+    _ensure_writer()
+
+
+def _advance_resume(token_id, reached):
+    from django.db.models.functions import Greatest
+    from .models import DownloadToken
+
+    try:
+        DownloadToken.objects.filter(pk=token_id).update(resume_offset=Greatest('resume_offset', reached))
+    except Exception:
+        logger.exception("Point de reprise du jeton %s non enregistré", token_id)
+
+
+# --- Suivi des réponses --------------------------------------------------------------
+
+class _Metered:
+    """
+    Contenu d'une réponse en flux, compté au passage. ``close()`` est appelé
+    par le serveur à la fin de l'envoi, complet ou non (client parti).
+    """
+
+    def __init__(self, content, row, expected, started, offset=None):
+        self.content = content
+        self.row = row
+        self.expected = expected
+        self.started = started
+        self.offset = offset
+        self.sent = 0
+        self.done = False
+
+    def __iter__(self):
+        for chunk in self.content:
+            self.sent += len(chunk)
+            yield chunk
+
+    def _completed(self):
+        return self.expected is None or self.sent >= self.expected
+
+    def close(self):
+        if self.done:
+            return
+        self.done = True
+        close = getattr(self.content, 'close', None)
+        if close is not None:
+            close()
+        self.row.update(
+            duration_ms=int((time.monotonic() - self.started) * 1000),
+            bytes_sent=self.sent,
+            completed=self._completed(),
+        )
+        if self.offset is not None and self.row['completed'] is not True:
+            _advance_resume(self.row['token_id'], self.offset + self.sent)
+        _record(self.row)
+
+
+class _AsyncMetered(_Metered):
+    """
+    Variante ASGI : lecture bloc par bloc dans un thread (``__aiter__``).
+    Envoi arrêté avant la fin : incomplet ; mené jusqu'au bout : inconnu.
+    """
+
+    __iter__ = None  # sinon Django le prend pour un itérateur synchrone
+
+    async def __aiter__(self):
+        chunks = iter(self.content)
+        read = sync_to_async(next, thread_sensitive=False)
+        while True:
+            chunk = await read(chunks, None)
+            if chunk is None:
+                return
+            self.sent += len(chunk)
+            yield chunk
+
+    def _completed(self):
+        return None if super()._completed() else False
+
+
+def _offloaded(response):
+    return 'X-Accel-Redirect' in response or 'X-Sendfile' in response
+
+
+def track(request, response, token, outcome, started, offset=None):
+    """
+    Inscrit la tentative au registre et renvoie la réponse (à renvoyer telle
+    quelle). ``started`` : time.monotonic() au début de la vue ; ``offset`` :
+    octet de départ d'un envoi dont on suit le point de reprise.
+    """
+    row = {
+        'token_id': token.pk,
+        'user_id': request.user.pk if request.user.is_authenticated else None,
+        'outcome': outcome,
+        'status_code': response.status_code,
+        'ip': request.META.get('REMOTE_ADDR') or None,
+        'started_at': timezone.now(),
+    }
+    if response.streaming and request.method != 'HEAD':
+        length = response.get('Content-Length')
+        metered = _AsyncMetered if isinstance(request, ASGIRequest) else _Metered
+        meter = metered(response.streaming_content, row, int(length) if length else None, started, offset)
+        # FileResponse : le contenu passe par le compteur (pas par wsgi.file_wrapper)
+        response.streaming_content = meter
+        return response
+
+    row['duration_ms'] = int((time.monotonic() - started) * 1000)
+    if not _offloaded(response):
+        row['bytes_sent'] = 0 if request.method == 'HEAD' or response.streaming else len(response.content)
+        row['completed'] = True
+    _record(row)
+    return response
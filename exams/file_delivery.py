@@ -0,0 +1,268 @@
+"""
+Envoi des fichiers téléchargés (packs, extraits, pièces jointes du forum).
+
+La vue vérifie jeton, propriétaire et compteur, puis appelle ``serve()``.
+
+Envoi par Django : reprise et lecture partielle (vidéos) selon HTTP :
+- ETag fort et Last-Modified tirés du fichier (taille, date), au même format
+  que nginx, pour que ``If-Range`` reste valable d'un mode d'envoi à l'autre ;
+- ``If-None-Match`` / ``If-Modified-Since`` -> 304, ``If-Match`` -> 412 ;
+- ``Range`` -> 206 (une plage) ou multipart/byteranges (plusieurs, fusionnées,
+  au plus MAX_RANGES) ; plage hors du fichier -> 416 ; ``If-Range`` périmé ->
+  fichier complet ;
+- ``Accept-Ranges: bytes`` sur toutes les réponses.
+``plan()`` donne, avant tout envoi, la réponse que recevra la requête (le
+proxy répond de même, avec les mêmes validateurs) : exams.views.download_file
+ne décompte que les réponses qui envoient le fichier. ``resume_point()`` dit
+si c'est la reprise d'un envoi de ce fichier (une plage après le premier
+octet, If-Range portant l'ETag fort actuel) ; la vue vérifie le reste
+(DownloadToken.resume).
+
+Selon FILE_OFFLOAD, l'envoi peut être délégué au proxy frontal, qui gère
+alors lui-même plages et validateurs :
+- ''         : envoi par Django (par défaut) ;
+- 'accel'    : en-tête X-Accel-Redirect vers un emplacement interne de nginx
+               (FILE_OFFLOAD_LOCATIONS) : le worker est libéré dès la réponse ;
+- 'sendfile' : en-tête X-Sendfile avec le chemin absolu (Apache mod_xsendfile,
+               lighttpd).
+Un fichier hors des racines déclarées est toujours envoyé par Django.
+
+Configuration nginx correspondante (racines de settings.py) :
+
+    location /_protected/ { internal; alias /chemin/vers/protected_media/; }
+    location /_media/     { internal; alias /chemin/vers/media/; }
+"""
+import logging
+import os
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import add_never_cache_headers, get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+logger = logging.getLogger(__name__)
+
+ACCEL, SENDFILE = 'accel', 'sendfile'
+CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16
+
+
+# --- Validateurs et plages -----------------------------------------------------------
+
+def _etag(stat):
+    # même forme que nginx : "<date de modification en hexa>-<taille en hexa>"
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+def _if_range_matches(request, stat):
+    """If-Range absent, ou encore valable (ETag fort identique, ou date exacte)."""
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith('"'):
+        return value == _etag(stat)
+    if value.startswith('W/'):
+        return False  # un ETag faible ne vaut pas pour une plage
+    return parse_http_date_safe(value) == int(stat.st_mtime)
+
+
+def _parse_range(header, size):
+    """
+    ``bytes=0-99,200-,-500`` -> [(début, fin)] inclus, triés et fusionnés.
+    None : en-tête à ignorer (syntaxe, trop de plages) ; [] : aucune plage satisfaisable.
+    """
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:
+                length = int(last)  # suffixe : les N derniers octets
+                if length > 0 and size:
+                    ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _requested_ranges(request, stat):
+    """Plages à servir, None pour le fichier complet."""
+    header = request.headers.get('Range')
+    if not header or request.method not in ('GET', 'HEAD') or not _if_range_matches(request, stat):
+        return None
+    return _parse_range(header, stat.st_size)
+
+
+def plan(request, file_path):
+    """
+    Réponse prévue pour ``file_path`` : (statut, plages). Statut 304 / 412
+    (requête conditionnelle), 416 (aucune plage satisfaisable), 206 (plages
+    triées, la première donne l'octet de départ) ou 200 (plages None).
+    """
+    stat = os.stat(os.path.realpath(file_path))
+    conditional = get_conditional_response(request, etag=_etag(stat), last_modified=int(stat.st_mtime))
+    if conditional is not None:
+        return conditional.status_code, None
+    ranges = _requested_ranges(request, stat)
+    if ranges == []:
+        return 416, ranges
+    return (206, ranges) if ranges else (200, None)
+
+
+def resume_point(request, status, ranges):
+    """
+    Octet de reprise si la requête reprend un envoi de ce fichier, sinon None :
+    206 sur une seule plage après le premier octet, avec If-Range à ETag fort
+    (``plan()`` l'a déjà comparé à l'ETag actuel).
+    """
+    if status != 206 or len(ranges) != 1 or ranges[0][0] == 0:
+        return None
+    if not request.headers.get('If-Range', '').startswith('"'):
+        return None
+    return ranges[0][0]
+
+
+# --- Réponses ------------------------------------------------------------------------
+
+def _read(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _multipart(path, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        yield from _read(path, start, end)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def _partial(path, ranges, size, content_type):
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(_read(path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        return response
+
+    boundary = uuid.uuid4().hex
+    length = len(f"--{boundary}--\r\n")
+    for start, end in ranges:
+        length += len(
+            f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ) + (end - start + 1) + 2
+    response = StreamingHttpResponse(
+        _multipart(path, ranges, size, content_type, boundary), status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = length
+    return response
+
+
+def _internal_url(path):
+    """URL interne du proxy pour ``path``, None s'il n'est sous aucune racine déclarée."""
+    for root, prefix in getattr(settings, 'FILE_OFFLOAD_LOCATIONS', {}).items():
+        root = os.path.realpath(root)
+        if os.path.commonpath([root, path]) == root:
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            return prefix.rstrip('/') + '/' + quote(relative)
+    return None
+
+
+def _offloaded(path, mode):
+    if mode == ACCEL:
+        url = _internal_url(path)
+        if url is None:
+            logger.warning("Fichier hors des emplacements du proxy, envoyé par Django : %s", path)
+            return None
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = url
+        return response
+    if mode == SENDFILE:
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+        return response
+    return None
+
+
+def _served(request, path, stat, content_type, as_attachment, filename):
+    """Réponse de Django : 304/412, 416, 206 ou fichier complet."""
+    etag = _etag(stat)
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if conditional is not None:
+        conditional['ETag'] = etag
+        return conditional
+
+    ranges = _requested_ranges(request, stat)
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+    elif ranges:
+        response = _partial(path, ranges, stat.st_size, content_type)
+    else:
+        response = FileResponse(open(path, 'rb'), as_attachment=as_attachment, filename=filename)
+        response['Content-Length'] = stat.st_size
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
+
+
+def serve(request, file_path, filename=None, content_type='application/zip', as_attachment=True, private=False):
+    """
+    Réponse de téléchargement de ``file_path`` (existence vérifiée par l'appelant),
+    déléguée au proxy si FILE_OFFLOAD le demande.
+
+    Par défaut jamais mise en cache (cache de pages du site compris) : chaque
+    envoi repasse par les contrôles de la vue. ``private=True`` autorise le
+    cache du navigateur seul (médias du forum).
+    """
+    path = os.path.realpath(file_path)
+    filename = filename or os.path.basename(path)
+    response = _offloaded(path, getattr(settings, 'FILE_OFFLOAD', ''))
+    if response is None:
+        response = _served(request, path, os.stat(path), content_type, as_attachment, filename)
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+        if response.status_code == 200 or 'Content-Range' in response:
+            response['Content-Type'] = content_type  # multipart/byteranges garde le sien
+    response['X-Content-Type-Options'] = 'nosniff'
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        add_never_cache_headers(response)
+    return response
@@ -1,4 +1,7 @@
 from django import forms
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
 from .models import validate_zip
 
 class ImportZipForm(forms.Form):
@@ -7,3 +10,24 @@ class ImportZipForm(forms.Form):
         validators=[validate_zip],
         help_text="Choisissez un fichier .zip contenant les épreuves et corrigés.",
     )
+
+
+class BulkOrderForm(forms.Form):
+    buyer = forms.CharField(
+        label="Compte acheteur",
+        help_text="Identifiant ou e-mail du compte de l'établissement.",
+    )
+    seats = forms.IntegerField(
+        label="Places par pack",
+        min_value=1,
+        max_value=settings.BULK_ORDER_MAX_SEATS,
+        help_text="Un lien de téléchargement par élève et par pack.",
+    )
+    phone = forms.CharField(label="Téléphone", required=False)
+
+    def clean_buyer(self):
+        ref = self.cleaned_data["buyer"].strip()
+        user = get_user_model().objects.filter(Q(username=ref) | Q(email__iexact=ref)).first()
+        if user is None:
+            raise forms.ValidationError("Compte introuvable.")
+        return user
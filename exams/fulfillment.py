@@ -0,0 +1,129 @@
+"""
+Livraison des commandes payées, commune à tous les chemins de paiement
+(payment_success, order_confirm, webhooks, simulateur).
+
+Pour un lot de commandes, en une transaction et un nombre fixe de requêtes
+quel que soit le nombre d'articles :
+  1. articles (+ packs, examens, matières)     — 1 SELECT
+  2. jetons existants                          — 1 SELECT (colonnes seulement)
+  3. jetons manquants                          — INSERT par lots de TOKEN_BATCH_SIZE + 1 SELECT de relecture
+  4. possession (PurchasedPack)                — 1 INSERT (bulk, ignore_conflicts)
+  5. notification « paiement effectué »        — 1 SELECT + 1 INSERT (bulk) + 1 SELECT
+  6. résumé d'achats (exams.purchase_summary)  — à la première livraison seulement
+
+Idempotent : relancer la livraison (rechargement de payment_success, webhook
+rejoué) ne crée ni jeton, ni possession, ni notification en double — la
+notification porte la clé unique "order-paid:<id>".
+
+Un article donne un jeton par unité achetée (OrderItem.quantity, « places »
+d'une commande groupée, exams.bulk_orders) ; le lien renvoyé et notifié est
+celui de la place 0, les autres s'exportent en CSV.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import notifications, purchase_summary
+
+NOTIFICATION_KEY = 'order-paid:{order_id}'
+TOKEN_BATCH_SIZE = 1000
+
+
+def _notification_message(total):
+    return (
+        f"Paiement de la somme de {total} F effectué avec succès. "
+        "Pour obtenir les packs que vous venez d’acheter sur votre appareil, "
+        "cliquez sur le bouton « Télécharger ZIP » présent sur chacun de ces packs."
+    )
+
+
+def _token_ttl(order):
+    if order.bulk:
+        return timedelta(days=settings.BULK_TOKEN_TTL_DAYS)
+    return timedelta(hours=settings.DOWNLOAD_TOKEN_TTL_HOURS)
+
+
+def fulfill_orders(order_ids, notify=True):
+    """
+    Livre les commandes données (supposées payées).
+    Renvoie {order_id: [{'name', 'download_url'}, ...]} dans l'ordre des articles.
+    """
+    from .models import DownloadToken, Notification, OrderItem, PurchasedPack
+
+    order_ids = list(order_ids)
+    if not order_ids:
+        return {}
+
+    with transaction.atomic():
+        items = list(
+            OrderItem.objects.filter(order_id__in=order_ids)
+            .select_related('order', 'pack__exam', 'pack__subject')
+            .order_by('order_id', 'id')
+        )
+        item_ids = [item.pk for item in items]
+        seats, tokens = set(), {}
+        for item_id, seat, token in DownloadToken.objects.filter(item_id__in=item_ids).values_list('item_id', 'seat', 'token'):
+            seats.add((item_id, seat))
+            if seat == 0:
+                tokens[item_id] = token
+
+        missing = [
+            (item, seat) for item in items for seat in range(max(item.quantity, 1))
+            if (item.pk, seat) not in seats
+        ]
+        if missing:
+            now = timezone.now()
+            DownloadToken.objects.bulk_create([
+                DownloadToken(
+                    item=item, seat=seat, token=uuid.uuid4().hex, expires_at=now + _token_ttl(item.order),
+                    remaining_downloads=settings.DOWNLOAD_MAX_TIMES,
+                )
+                for item, seat in missing
+            ], batch_size=TOKEN_BATCH_SIZE, ignore_conflicts=True)
+            # relecture : en cas de livraison concurrente, c'est le jeton en base qui compte
+            tokens = dict(DownloadToken.objects.filter(item_id__in=item_ids, seat=0).values_list('item_id', 'token'))
+
+        PurchasedPack.objects.bulk_create([
+            PurchasedPack(user_id=item.order.user_id, pack_id=item.pack_id)
+            for item in items if item.order.user_id
+        ], ignore_conflicts=True)
+
+        delivered, orders = {}, {}
+        for item in items:
+            orders[item.order_id] = item.order
+            delivered.setdefault(item.order_id, []).append({
+                'name': str(item.pack),
+                'download_url': reverse('exams:download_file', args=[tokens[item.pk]]),
+            })
+
+        purchase_summary.record_fulfilled(orders.values())
+
+        if notify:
+            keys = {NOTIFICATION_KEY.format(order_id=oid): oid for oid, order in orders.items() if order.user_id}
+            existing = set(Notification.objects.filter(key__in=list(keys)).values_list('key', flat=True))
+            created = [
+                Notification(
+                    user_id=orders[oid].user_id,
+                    key=key,
+                    message=_notification_message(int(orders[oid].total_amount or 0)),
+                    payload={'total': int(orders[oid].total_amount or 0), 'packs': delivered[oid]},
+                )
+                for key, oid in keys.items() if key not in existing
+            ]
+            if created:
+                Notification.objects.bulk_create(created, ignore_conflicts=True)
+                # bulk_create n'émet pas post_save : compteur de non lues + push,
+                # après relecture pour disposer des ids
+                for notification in Notification.objects.filter(key__in=[n.key for n in created]):
+                    notifications.notify_created(notification)
+
+    return delivered
+
+
+def fulfill_order(order, notify=True):
+    """Livre une commande ; renvoie la liste des packs livrés (nom + lien)."""
+    return fulfill_orders([order.pk], notify=notify).get(order.pk, [])
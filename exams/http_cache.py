@@ -0,0 +1,84 @@
+"""
+Réponses conditionnelles (ETag / Last-Modified) pour les pages du catalogue.
+
+L'ETag est dérivé de la version du catalogue (voir ``exams.catalog``) : tant
+qu'aucun Exam/Subject/Pack/FreeSample n'a changé, un client qui renvoie
+``If-None-Match`` reçoit un 304 sans qu'aucun template ne soit rendu
+(décorateur ``condition`` de Django, évalué avant la vue).
+
+Politique Cache-Control, compatible avec UpdateCacheMiddleware /
+FetchFromCacheMiddleware :
+- pages complètes : ``private, no-cache`` — elles contiennent des données
+  propres à l'utilisateur (badges, messages, jeton CSRF) ; le cache serveur
+  partagé les ignore et le navigateur revalide à chaque fois (304 bon marché).
+- fragment AJAX des cartes : identique pour tous, ``max-age`` court
+  (CATALOG_FRAGMENT_MAX_AGE) que le cache serveur peut réutiliser.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import cart_summary, catalog, notifications
+
+
+def is_fragment_request(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def _has_pending_messages(request):
+    try:
+        return len(get_messages(request)) > 0
+    except Exception:
+        return False
+
+
+def catalog_etag(request, *args, **kwargs):
+    """
+    ETag fort : version du catalogue + URL (q) + type de réponse, et pour les
+    pages complètes l'utilisateur et ses badges. Pas d'ETag quand des messages
+    flash attendent d'être affichés (la page doit alors être rendue).
+    """
+    parts = [catalog.get_version(), request.get_full_path()]
+    if is_fragment_request(request):
+        parts.append('fragment')
+    else:
+        if _has_pending_messages(request):
+            return None
+        parts += [
+            getattr(request.user, 'pk', None) or 0,
+            cart_summary.get_summary(request.user)['count'],
+            notifications.unread_count(request.user),
+        ]
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    """Last-Modified uniquement pour le fragment (indépendant de l'utilisateur)."""
+    if is_fragment_request(request):
+        return catalog.get_last_modified()
+    return None
+
+
+def catalog_conditional(view_func):
+    """304 avant rendu si l'ETag correspond, puis en-têtes de cache adaptés."""
+    conditional_view = condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)(view_func)
+
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        if response.status_code not in (200, 304):
+            return response
+        if is_fragment_request(request):
+            max_age = getattr(settings, 'CATALOG_FRAGMENT_MAX_AGE', 30)
+            patch_cache_control(response, public=True, max_age=max_age)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        # Même URL, deux représentations (page / fragment)
+        patch_vary_headers(response, ['X-Requested-With'])
+        return response
+
+    return _wrapped
@@ -0,0 +1,429 @@
+"""
+Test de charge du parcours d'achat complet, en processus, contre la base configurée :
+
+  add_to_cart -> checkout -> webhook (jusqu'à la commande PAID) -> payment_success -> download
+
+Chaque utilisateur virtuel (comptes "loadtest-NNNN", créés au besoin) déroule le
+parcours ; ``--concurrency`` parcours tournent en parallèle, chacun avec sa
+connexion à la base. Un thread applique l'inbox des webhooks en continu, comme
+``process_webhooks --loop``.
+
+Rapport : p50/p95/p99 par étape, taux d'erreur, et pour la base le temps passé,
+les erreurs de verrou ("database is locked", deadlock…) et les écritures ayant
+attendu plus de ``--lock-threshold`` ms (sous SQLite, c'est l'attente du verrou
+d'écriture). Écrit aussi en JSON (``--report``) pour comparer les campagnes.
+
+À lancer sur une base de développement : les commandes créées restent en base
+(``--cleanup`` supprime les comptes de test et tout ce qui en dépend).
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from cachalot.api import cachalot_disabled
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from exams import webhook_inbox
+from exams.models import CartItem, DownloadToken, Order, Pack
+from exams.payment_standin import cinetpay_notification, make_server, stripe_event
+
+STEPS = ('add_to_cart', 'checkout', 'webhook', 'payment_success', 'download')
+USERNAME = 'loadtest-{:04d}'
+
+
+def percentile(values, p):
+    """Percentile au rang le plus proche (valeurs triées)."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class StepFailed(Exception):
+    pass
+
+
+class DbProbe:
+    """execute_wrapper : temps SQL, erreurs et attentes de verrou, par étape courante."""
+
+    def __init__(self, stats, lock_threshold):
+        self.stats = stats
+        self.lock_threshold = lock_threshold
+        self.step = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            if 'lock' in str(e).lower():
+                self.stats.db(self.step, lock_error=True)
+            raise
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            is_write = sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE')
+            self.stats.db(self.step, elapsed=elapsed, waited=is_write and elapsed > self.lock_threshold)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.samples = []
+        self.db_stats = {step: {'queries': 0, 'time_ms': 0.0, 'lock_errors': 0, 'lock_waits': 0} for step in STEPS}
+        self.flows_ok = 0
+        self.flows_failed = 0
+        self.drain_errors = 0
+
+    def timing(self, step, ms):
+        with self.lock:
+            self.timings[step].append(ms)
+
+    def error(self, step, message):
+        with self.lock:
+            self.errors[step] += 1
+            if len(self.samples) < 20:
+                self.samples.append(f"{step}: {message}")
+
+    def db(self, step, elapsed=0.0, waited=False, lock_error=False):
+        if step is None:
+            return
+        with self.lock:
+            bucket = self.db_stats[step]
+            if lock_error:
+                bucket['lock_errors'] += 1
+                return
+            bucket['queries'] += 1
+            bucket['time_ms'] += elapsed
+            bucket['lock_waits'] += int(waited)
+
+    def drain_error(self, exc):
+        with self.lock:
+            self.drain_errors += 1
+            if len(self.samples) < 20:
+                self.samples.append(f"drain: {exc}")
+
+    def flow(self, ok):
+        with self.lock:
+            if ok:
+                self.flows_ok += 1
+            else:
+                self.flows_failed += 1
+
+    def summary(self):
+        steps = {}
+        for step in STEPS:
+            values = sorted(self.timings[step])
+            count = len(values) + self.errors[step]
+            db = self.db_stats[step]
+            steps[step] = {
+                'count': count,
+                'errors': self.errors[step],
+                'error_rate': round(self.errors[step] / count, 4) if count else 0.0,
+                'p50_ms': _round(percentile(values, 50)),
+                'p95_ms': _round(percentile(values, 95)),
+                'p99_ms': _round(percentile(values, 99)),
+                'max_ms': _round(values[-1] if values else None),
+                'mean_ms': _round(sum(values) / len(values) if values else None),
+                'db': {**db, 'time_ms': round(db['time_ms'], 1)},
+            }
+        return steps
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Test de charge du parcours panier -> paiement -> webhook -> succès -> téléchargement "
+        "(utilisateurs de test, en parallèle). Rapport p50/p95/p99, erreurs, verrous, JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Nombre d'utilisateurs virtuels")
+        parser.add_argument('--flows', type=int, default=1, help="Parcours d'achat par utilisateur")
+        parser.add_argument('--concurrency', type=int, default=8, help="Parcours simultanés")
+        parser.add_argument('--packs-per-cart', type=int, default=2)
+        parser.add_argument('--method', choices=['MOMO', 'STRIPE'], default='MOMO')
+        parser.add_argument('--standin', action='store_true',
+                            help="Démarre le prestataire local et y envoie l'initialisation des paiements")
+        parser.add_argument('--standin-port', type=int, default=8766)
+        parser.add_argument('--standin-latency', type=float, default=0.3)
+        parser.add_argument('--webhook-timeout', type=float, default=30.0,
+                            help="Attente max. de la commande PAID après le webhook (s)")
+        parser.add_argument('--lock-threshold', type=float, default=50.0,
+                            help="Écriture comptée comme attente de verrou au-delà de (ms)")
+        parser.add_argument('--report', default=None,
+                            help="Fichier JSON du rapport (défaut : loadtest-AAAAMMJJ-HHMMSS.json)")
+        parser.add_argument('--cleanup', action='store_true', help="Supprime les comptes de test à la fin")
+
+    def handle(self, *args, **options):
+        packs = [
+            pack.pk for pack in Pack.objects.filter(is_active=True).exclude(file='')
+            if pack.file.storage.exists(pack.file.name)
+        ]
+        with_files = bool(packs)
+        if not packs:
+            packs = list(Pack.objects.filter(is_active=True).values_list('pk', flat=True))
+        if not packs:
+            raise CommandError("Aucun pack actif : rien à acheter.")
+        if not with_files:
+            self.stderr.write("Aucun pack avec fichier : l'étape download sera ignorée.")
+        if options['method'] == 'STRIPE' and not getattr(settings, 'STRIPE_SECRET_KEY', None):
+            raise CommandError("STRIPE_SECRET_KEY manquant pour --method STRIPE.")
+        if options['method'] == 'STRIPE' and not options['standin'] and not getattr(settings, 'STRIPE_WEBHOOK_SECRET', None):
+            raise CommandError("STRIPE_WEBHOOK_SECRET manquant pour --method STRIPE (webhooks signés).")
+        if options['method'] == 'MOMO' and not options['standin']:
+            # le statut annoncé est relu chez CinetPay, qui ne connaît pas les paiements du test
+            raise CommandError("--method MOMO nécessite --standin (notifications vérifiées auprès du prestataire).")
+
+        users = self._seed_users(options['users'])
+        self.options = options
+        self.packs = packs
+        self.with_files = with_files
+        self.stats = Stats()
+        self.stop = threading.Event()
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        self.client_kwargs = {'SERVER_NAME': host, 'secure': getattr(settings, 'SECURE_SSL_REDIRECT', False)}
+
+        overrides, server = {}, None
+        if options['standin']:
+            server = make_server('127.0.0.1', options['standin_port'], latency=options['standin_latency'],
+                                 jitter=0.0, webhooks=False, webhook_delay=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base = f"http://127.0.0.1:{options['standin_port']}"
+            overrides = {
+                'CINETPAY_BASE_URL': f"{base}/v2/payment", 'CINETPAY_CHECK_URL': f"{base}/v2/payment/check",
+                'STRIPE_API_BASE': base,
+            }
+            if not getattr(settings, 'STRIPE_WEBHOOK_SECRET', None):
+                # webhooks Stripe non signés refusés : secret propre au test
+                overrides['STRIPE_WEBHOOK_SECRET'] = 'whsec_loadtest'
+
+        jobs = [user for user in users for _ in range(options['flows'])]
+        random.shuffle(jobs)
+        job_lock = threading.Lock()
+
+        # Un client par thread, middlewares chargés ici une fois pour toutes
+        # (leur chargement concurrent réenregistrerait les métriques Prometheus)
+        clients = []
+        for _ in range(options['concurrency']):
+            client = Client(**self.client_kwargs)
+            client.handler.load_middleware()
+            clients.append(client)
+
+        def worker(client):
+            try:
+                while True:
+                    with job_lock:
+                        if not jobs:
+                            return
+                        user = jobs.pop()
+                    self._flow(client, user)
+            finally:
+                connection.close()
+
+        drainer = threading.Thread(target=self._drain_loop, daemon=True)
+        started = datetime.now()
+        start = time.perf_counter()
+        with override_settings(**overrides):
+            drainer.start()
+            threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.stop.set()
+            drainer.join()
+        duration = time.perf_counter() - start
+        if server:
+            server.shutdown()
+            server.server_close()
+
+        report = {
+            'started_at': started.isoformat(timespec='seconds'),
+            'duration_s': round(duration, 2),
+            'database': connection.vendor,
+            'config': {k: options[k] for k in (
+                'users', 'flows', 'concurrency', 'packs_per_cart', 'method', 'standin',
+                'standin_latency', 'lock_threshold',
+            )},
+            'flows_ok': self.stats.flows_ok,
+            'flows_failed': self.stats.flows_failed,
+            'throughput_flows_per_s': round(self.stats.flows_ok / duration, 2) if duration else None,
+            'steps': self.stats.summary(),
+            'drain_errors': self.stats.drain_errors,
+            'error_samples': self.stats.samples,
+        }
+        path = options['report'] or f"loadtest-{started:%Y%m%d-%H%M%S}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+        self._print(report)
+        self.stdout.write(self.style.SUCCESS(f"Rapport : {os.path.abspath(path)}"))
+
+        if options['cleanup']:
+            deleted, _ = User.objects.filter(username__startswith='loadtest-').delete()
+            self.stdout.write(f"Nettoyage : {deleted} ligne(s) supprimée(s).")
+
+    # --- Préparation -----------------------------------------------------------------
+
+    def _seed_users(self, count):
+        names = [USERNAME.format(i) for i in range(count)]
+        User.objects.bulk_create(
+            [User(username=name, password='!') for name in names],  # mot de passe inutilisable
+            ignore_conflicts=True,
+        )
+        users = list(User.objects.filter(username__in=names))
+        CartItem.objects.filter(cart__user__in=users).delete()  # paniers repartis de zéro
+        return users
+
+    # --- Parcours --------------------------------------------------------------------
+
+    def _drain_loop(self):
+        """Équivalent de process_webhooks --loop ; une erreur de verrou n'arrête pas le worker."""
+        try:
+            while not self.stop.is_set():
+                try:
+                    stats = webhook_inbox.drain()
+                except OperationalError as e:
+                    self.stats.drain_error(e)
+                    stats = {'processed': 0, 'ignored': 0}
+                if not stats['processed'] and not stats['ignored']:
+                    time.sleep(0.05)
+        finally:
+            connection.close()
+
+    def _flow(self, client, user):
+        client.force_login(user)
+        probe = DbProbe(self.stats, self.options['lock_threshold'])
+        close_old_connections()
+        try:
+            with connection.execute_wrapper(probe):
+                pack_ids = random.sample(self.packs, min(self.options['packs_per_cart'], len(self.packs)))
+                self._step(probe, 'add_to_cart', self._add_to_cart, client, pack_ids)
+                order_id = self._step(probe, 'checkout', self._checkout, client)
+                self._step(probe, 'webhook', self._webhook, client, order_id)
+                self._step(probe, 'payment_success', self._payment_success, client)
+                if self.with_files:
+                    self._step(probe, 'download', self._download, client, order_id)
+        except StepFailed:
+            self.stats.flow(False)
+        else:
+            self.stats.flow(True)
+
+    def _step(self, probe, name, func, *args):
+        probe.step = name
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.stats.error(name, str(e)[:200] or e.__class__.__name__)
+            raise StepFailed from e
+        finally:
+            probe.step = None
+        self.stats.timing(name, (time.perf_counter() - start) * 1000)
+        return result
+
+    def _add_to_cart(self, client, pack_ids):
+        response = client.post(reverse('exams:cart_batch'), {'add': pack_ids}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        if response.status_code != 200:
+            raise StepFailed(f"HTTP {response.status_code}")
+
+    def _checkout(self, client):
+        response = client.post(
+            reverse('exams:cart_checkout'), {'payment_method': self.options['method']},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        if response.status_code != 202:
+            raise StepFailed(f"HTTP {response.status_code} {response.content[:100]!r}")
+        return response.json()['order_id']
+
+    def _webhook(self, client, order_id):
+        """Notification du prestataire, puis attente de son application (commande PAID)."""
+        if self.options['method'] == 'STRIPE':
+            body, headers = stripe_event(
+                f"cs_loadtest_{uuid.uuid4().hex}", {'order_id': str(order_id)},
+                secret=getattr(settings, 'STRIPE_WEBHOOK_SECRET', None) or '',
+            )
+            url = reverse('exams:stripe_webhook')
+        else:
+            # notification de la transaction réellement créée (statut relu chez le prestataire)
+            body, headers = cinetpay_notification({
+                'transaction_id': self._transaction_id(order_id),
+                'metadata': json.dumps({'order_id': str(order_id)}),
+            })
+            url = reverse('exams:momo_webhook')
+        extra = {f"HTTP_{k.upper().replace('-', '_')}": v for k, v in headers.items() if k != 'Content-Type'}
+        response = client.post(url, body, content_type=headers['Content-Type'], **extra)
+        if response.status_code != 200:
+            raise StepFailed(f"HTTP {response.status_code}")
+
+        deadline = time.monotonic() + self.options['webhook_timeout']
+        while not Order.objects.filter(pk=order_id, status='PAID').exists():
+            if time.monotonic() > deadline:
+                raise StepFailed("commande non payée dans le délai")
+            time.sleep(0.02)
+
+    def _transaction_id(self, order_id):
+        """Attend l'initialisation du paiement (en arrière-plan) et renvoie sa transaction."""
+        deadline = time.monotonic() + self.options['webhook_timeout']
+        while True:
+            # lecture directe : écrite par le thread d'initialisation, pas de résultat mis en cache (cachalot)
+            with cachalot_disabled():
+                transaction_id = Order.objects.filter(pk=order_id).values_list('transaction_id', flat=True).first()
+            if transaction_id:
+                return transaction_id
+            if time.monotonic() > deadline:
+                raise StepFailed("paiement non initialisé dans le délai")
+            time.sleep(0.02)
+
+    def _payment_success(self, client):
+        response = client.get(reverse('exams:payment_success'))
+        if response.status_code != 200:
+            raise StepFailed(f"HTTP {response.status_code}")
+
+    def _download(self, client, order_id):
+        tokens = DownloadToken.objects.filter(item__order_id=order_id).values_list('token', flat=True)
+        if not tokens:
+            raise StepFailed("aucun jeton")
+        for token in tokens:
+            response = client.get(reverse('exams:download_file', args=[token]))
+            if response.status_code != 200:
+                raise StepFailed(f"HTTP {response.status_code}")
+            for _ in response.streaming_content if response.streaming else ():
+                pass
+            response.close()
+
+    # --- Affichage -------------------------------------------------------------------
+
+    def _print(self, report):
+        self.stdout.write(
+            f"{report['flows_ok']} parcours réussis, {report['flows_failed']} en échec "
+            f"en {report['duration_s']} s ({report['throughput_flows_per_s']} parcours/s, "
+            f"base {report['database']})"
+        )
+        self.stdout.write(
+            f"{'étape':<16}{'n':>6}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+            f"{'req. SQL':>10}{'SQL ms':>10}{'verrous':>9}"
+        )
+        for step, data in report['steps'].items():
+            db = data['db']
+            self.stdout.write(
+                f"{step:<16}{data['count']:>6}{data['error_rate'] * 100:>6.1f}%"
+                + ''.join(f"{'-' if data[k] is None else data[k]:>9}" for k in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+                + f"{db['queries']:>10}{db['time_ms']:>10}{db['lock_waits'] + db['lock_errors']:>9}"
+            )
+        for sample in report['error_samples']:
+            self.stderr.write(f"  {sample}")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from exams import blobs
+
+
+class Command(BaseCommand):
+    help = (
+        "ZIP dédupliqués des packs : recompte les références depuis les packs, supprime "
+        "les fichiers que plus aucun pack ne désigne (après --grace). À lancer régulièrement. --adopt convertit d'abord les anciens fichiers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--adopt', action='store_true',
+                            help="Convertit les anciens fichiers (packs/) en blobs dédupliqués")
+        parser.add_argument('--grace', type=int, default=3600,
+                            help="Âge minimal (s) d'un fichier sans référence avant suppression (envoi en cours, blob libéré)")
+        parser.add_argument('--dry-run', action='store_true', help="Affiche sans rien modifier")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if options['adopt']:
+            adopted = blobs.adopt_legacy(dry_run=dry_run)
+            self.stdout.write(f"{adopted} pack(s) converti(s) en blobs.")
+        fixed = blobs.recount(dry_run=dry_run)
+        removed, freed = blobs.sweep(grace_seconds=options['grace'], dry_run=dry_run)
+        self.stdout.write(
+            f"{fixed} compteur(s) corrigé(s) ; {removed} fichier(s) supprimé(s), "
+            f"{freed / (1024 * 1024):.1f} Mo libérés{' (simulation)' if dry_run else ''}."
+        )
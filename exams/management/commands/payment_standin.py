@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from exams.payment_standin import make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Lance un prestataire de paiement local (CinetPay / Stripe) qui rappelle les "
+        "webhooks d'Examhub, pour tester hors ligne. Pointez CINETPAY_BASE_URL sur "
+        "http://HOST:PORT/v2/payment et STRIPE_API_BASE sur http://HOST:PORT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.3, help="Latence fixe par appel (s)")
+        parser.add_argument('--jitter', type=float, default=0.2, help="Latence aléatoire ajoutée (s)")
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help="Proportion de créations de paiement en échec (0-1)")
+        parser.add_argument('--no-webhooks', action='store_true', help="Ne rappelle aucun webhook")
+        parser.add_argument('--webhook-delay', type=float, default=0.5,
+                            help="Délai entre la création et le webhook (s)")
+        parser.add_argument('--webhook-failure-rate', type=float, default=0.0,
+                            help="Proportion de paiements refusés / expirés (0-1)")
+        parser.add_argument('--retry-storm', type=int, default=0,
+                            help="Nombre de renvois identiques de chaque webhook")
+        parser.add_argument('--retry-interval', type=float, default=0.2, help="Écart entre deux renvois (s)")
+        parser.add_argument('--notify-url', default='',
+                            help="Remplace le notify_url CinetPay reçu dans la charge utile")
+        parser.add_argument('--stripe-webhook-url', default='http://127.0.0.1:8000/examens/webhooks/stripe/')
+        parser.add_argument('--stripe-webhook-secret', default='',
+                            help="Signe les événements Stripe (comme STRIPE_WEBHOOK_SECRET)")
+        parser.add_argument('--payment-webhook-url', default='http://127.0.0.1:8000/examens/payments/webhook/')
+
+    def handle(self, *args, **options):
+        server = make_server(
+            options['host'], options['port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            failure_rate=options['failure_rate'],
+            webhooks=not options['no_webhooks'],
+            webhook_delay=options['webhook_delay'],
+            webhook_failure_rate=options['webhook_failure_rate'],
+            retry_storm=options['retry_storm'],
+            retry_interval=options['retry_interval'],
+            notify_url_override=options['notify_url'],
+            stripe_webhook_url=options['stripe_webhook_url'],
+            stripe_webhook_secret=options['stripe_webhook_secret'],
+            payment_webhook_url=options['payment_webhook_url'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Prestataire local sur http://{options['host']}:{options['port']} "
+            f"(latence {options['latency']}s + {options['jitter']}s, échecs {options['failure_rate']:.0%}, "
+            f"webhooks {'non' if options['no_webhooks'] else 'oui'}, renvois x{options['retry_storm']}). "
+            "Ctrl+C pour arrêter."
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
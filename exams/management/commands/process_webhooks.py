@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from exams import webhook_inbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Traite par lots les webhooks de paiement enregistrés dans l'inbox "
+        "(transitions de commande idempotentes). --loop pour tourner en continu."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=webhook_inbox.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Tourne en continu (worker)")
+        parser.add_argument('--interval', type=float, default=1.0, help="Pause entre deux passes à vide (s)")
+
+    def handle(self, *args, **options):
+        while True:
+            stats = webhook_inbox.drain(batch_size=options['batch_size'])
+            if stats['processed'] or stats['ignored'] or stats['failed'] or not options['loop']:
+                self.stdout.write(
+                    f"{stats['processed']} traité(s), {stats['ignored']} ignoré(s), {stats['failed']} en échec "
+                    f"— {stats['paid']} commande(s) payée(s), {stats['cancelled']} annulée(s)."
+                )
+            if not options['loop']:
+                break
+            if not stats['processed'] and not stats['ignored']:
+                time.sleep(options['interval'])
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from exams import metrics, reconciliation
+
+
+class Command(BaseCommand):
+    help = (
+        "Interroge le prestataire pour les commandes restées en attente (webhook perdu) "
+        "et livre celles qui sont payées. --loop pour tourner en continu."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--concurrency', type=int, default=None, help="Appels simultanés au prestataire")
+        parser.add_argument('--loop', action='store_true', help="Tourne en continu (worker)")
+        parser.add_argument('--interval', type=float, default=60.0, help="Pause entre deux passes (s)")
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help="Expose les métriques Prometheus (retard, résultats) sur ce port")
+
+    def handle(self, *args, **options):
+        if options['metrics_port'] and metrics.serve(options['metrics_port']):
+            self.stdout.write(f"Métriques sur http://0.0.0.0:{options['metrics_port']}/metrics")
+
+        while True:
+            stats = reconciliation.reconcile(
+                batch_size=options['batch_size'], concurrency=options['concurrency'],
+            )
+            backlog = reconciliation.backlog()
+            if stats['checked'] or not options['loop']:
+                self.stdout.write(
+                    f"{stats['checked']} interrogée(s) — {stats['paid']} payée(s), {stats['cancelled']} annulée(s), "
+                    f"{stats['pending']} toujours en attente, {stats['errors']} en erreur."
+                )
+            self.stdout.write(
+                f"Retard : {backlog['due']} à interroger, {backlog['waiting']} en attente d'échéance, "
+                f"{backlog['unreferenced']} sans référence ; plus ancienne : {backlog['lag_seconds']} s."
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from exams import cart_summary, catalog
+from exams.models import Pack
+from exams.price_rules import compile_rules, price_for_pack
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule le prix de tous les packs à partir des règles de tarification "
+        "(bulk_update en une transaction) et affiche les différences."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Affiche le diff sans rien enregistrer")
+
+    def handle(self, *args, **options):
+        table = compile_rules()
+        packs = Pack.objects.select_related('exam', 'subject').order_by('exam__name', 'pack_type', 'id')
+
+        changed = []
+        unpriced = 0
+        for pack in packs:
+            computed = price_for_pack(pack, table=table)
+            if not computed:
+                # Aucune règle : on garde le prix saisi, comme Pack.save
+                unpriced += 1
+                continue
+            if computed != pack.price:
+                self.stdout.write(f"{pack} : {pack.price} F -> {computed} F")
+                pack.price = computed
+                changed.append(pack)
+
+        if changed and not options['dry_run']:
+            with transaction.atomic():
+                Pack.objects.bulk_update(changed, ['price'], batch_size=500)
+                cart_summary.recompute_for_packs([p.pk for p in changed])
+                # bulk_update n'émet pas post_save : on invalide le catalogue une seule fois
+                transaction.on_commit(catalog.bump_version)
+
+        verb = "à modifier" if options['dry_run'] else "modifié(s)"
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(changed)} pack(s) {verb}, {unpriced} sans règle applicable."
+        ))
@@ -0,0 +1,126 @@
+"""
+Métriques Prometheus maison (appels sortants, réconciliation des paiements, téléchargements…).
+
+Elles vont dans le registre par défaut, celui de django_prometheus : le site
+les expose sur /metrics (``protected()`` : jeton METRICS_TOKEN, réseaux de
+METRICS_ALLOWED_IPS ou compte staff), les workers (commandes de gestion) avec
+``serve(port)``. Sans prometheus_client, les métriques sont des objets
+inertes : le code appelant n'a pas à le vérifier.
+"""
+import ipaddress
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, start_http_server
+except ImportError:  # métriques désactivées
+    Counter = Gauge = Histogram = start_http_server = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Noop:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+
+def _metric(cls, *args, **kwargs):
+    return cls(*args, **kwargs) if cls else _Noop()
+
+
+OUTBOUND_LATENCY = _metric(
+    Histogram, 'examhub_outbound_latency_seconds', "Durée des appels aux prestataires externes",
+    ['provider', 'outcome'],  # ok, error (réponse 4xx…), failure (transitoire)
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+OUTBOUND_CALLS = _metric(
+    Counter, 'examhub_outbound_calls_total', "Appels aux prestataires externes",
+    ['provider', 'outcome'],  # + short_circuited (disjoncteur ouvert), deadline (échéance dépassée)
+)
+OUTBOUND_BREAKER_STATE = _metric(
+    Gauge, 'examhub_outbound_breaker_state', "État du disjoncteur : 0 fermé, 1 essai, 2 ouvert",
+    ['provider'],
+)
+OUTBOUND_BREAKER_OPENED = _metric(
+    Counter, 'examhub_outbound_breaker_opened_total', "Ouvertures du disjoncteur", ['provider'],
+)
+
+RECONCILE_BACKLOG = _metric(
+    Gauge, 'examhub_reconcile_backlog', "Commandes en attente, par état de réconciliation",
+    ['state'],  # due : à interroger ; waiting : en délai de grâce ou d'attente ; unreferenced : sans référence prestataire
+)
+RECONCILE_LAG = _metric(
+    Gauge, 'examhub_reconcile_lag_seconds', "Âge de la plus ancienne commande en attente réconciliable",
+)
+RECONCILE_RESULTS = _metric(
+    Counter, 'examhub_reconcile_results_total', "Résultats des interrogations du prestataire",
+    ['result'],  # paid, cancelled, pending, error
+)
+RECONCILE_LAST_RUN = _metric(
+    Gauge, 'examhub_reconcile_last_run_timestamp_seconds', "Fin de la dernière passe de réconciliation",
+)
+
+DOWNLOADS = _metric(
+    Counter, 'examhub_downloads_total', "Tentatives de téléchargement par jeton",
+    ['outcome'],  # COUNTED, RESUMED, HEAD, UNSENT, REFUSED, FORBIDDEN, MISSING (DownloadLog.OUTCOME_CHOICES)
+)
+DOWNLOAD_BYTES = _metric(
+    Counter, 'examhub_download_bytes_total', "Octets envoyés par Django pour les téléchargements par jeton",
+)
+DOWNLOAD_LEDGER_DROPPED = _metric(
+    Counter, 'examhub_download_ledger_dropped_total', "Lignes du registre des téléchargements abandonnées (tampon plein)",
+)
+
+
+def serve(port):
+    """Expose /metrics sur ``port`` (thread de fond) ; False si prometheus_client manque."""
+    if start_http_server is None:
+        logger.warning("prometheus_client absent : métriques non exposées")
+        return False
+    start_http_server(port)
+    return True
+
+
+def _allowed_ip(request):
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR') or '')
+    except ValueError:
+        return False
+    for network in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        try:
+            if address in ipaddress.ip_network(network, strict=False):
+                return True
+        except ValueError:
+            logger.warning("METRICS_ALLOWED_IPS : réseau invalide ignoré (%s)", network)
+    return False
+
+
+def _authorized(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_staff) or _allowed_ip(request)
+
+
+def protected(view):
+    """Vue /metrics réservée au collecteur (Authorization: Bearer METRICS_TOKEN), aux réseaux autorisés et au staff."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _authorized(request):
+            return HttpResponseForbidden("Accès aux métriques refusé.")
+        return view(request, *args, **kwargs)
+    return wrapper
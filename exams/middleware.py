@@ -0,0 +1,53 @@
+import logging
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_cache_control
+
+logger = logging.getLogger(__name__)
+
+
+class ContextCostMiddleware:
+    """
+    Suit les context processors paresseux (exams.context_processors) :
+    - une page qui a affiché les badges d'un utilisateur connecté est marquée
+      ``private`` : UpdateCacheMiddleware ne la met pas en cache, sans quoi le
+      badge resterait figé malgré l'invalidation des compteurs ;
+    - leur coût est exposé dans l'en-tête Server-Timing (onglet réseau du
+      navigateur) et loggé en DEBUG si CONTEXT_COST_TIMING (par défaut : DEBUG).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'CONTEXT_COST_TIMING', settings.DEBUG)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        costs = getattr(request, 'context_costs', None) or {}
+        if costs and request.user.is_authenticated:
+            patch_cache_control(response, private=True)
+        if not self.enabled:
+            return response
+
+        entries = [f'ctx-{name};dur={ms:.2f}' for name, ms in costs.items()]
+        if not costs:
+            # aucun badge lu par le template : coût nul
+            entries.append('ctx;dur=0')
+        existing = response.get('Server-Timing')
+        response['Server-Timing'] = ', '.join(([existing] if existing else []) + entries)
+        logger.debug("context processors %s : %s", request.path, costs or 'non évalués')
+        return response
+
+
+class RangeSafeGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware qui laisse intacts les fichiers servis par plages
+    (exams.file_delivery, ``Accept-Ranges: bytes``) : compresser une réponse
+    206 fausserait Content-Range et Content-Length, et affaiblirait l'ETag
+    dont dépend la reprise (If-Range). ZIP et vidéos sont déjà compressés.
+    """
+
+    def process_response(self, request, response):
+        if response.get('Accept-Ranges') == 'bytes' or response.status_code == 206:
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,92 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0011_freesample_alter_pack_file"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PriceRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "level",
+                    models.CharField(
+                        choices=[
+                            ("BAC", "BAC"),
+                            ("DTI/STI", "DTI/STI"),
+                            ("CAP/CB", "CAP/CB"),
+                            ("BEPC", "BEPC"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("is_long_model", models.BooleanField(default=False)),
+                (
+                    "pack_type",
+                    models.CharField(
+                        choices=[
+                            ("SINGLE", "Matière seule"),
+                            ("DOUBLE", "Deux matières (Math + PCT)"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "subject_code",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        help_text="Vide = toutes les matières",
+                        max_length=20,
+                    ),
+                ),
+                ("price", models.PositiveIntegerField()),
+                ("active", models.BooleanField(default=True)),
+                (
+                    "exam",
+                    models.ForeignKey(
+                        blank=True,
+                        help_text="Optionnel : règle spécifique à cet examen",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="price_rules",
+                        to="exams.exam",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["level", "is_long_model", "pack_type", "subject_code"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="pricerule",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("exam__isnull", True)),
+                fields=("level", "is_long_model", "pack_type", "subject_code"),
+                name="uniq_pricerule_level",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="pricerule",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("exam__isnull", False)),
+                fields=("exam", "pack_type", "subject_code"),
+                name="uniq_pricerule_exam",
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations
+
+# Grille reprise de l'ancien compute_price codé en dur.
+LEVEL_RULES = [
+    # (niveau, modèle long, type de pack, prix)
+    ("BAC", False, "SINGLE", 1500),
+    ("BAC", False, "DOUBLE", 2500),
+    ("DTI/STI", False, "SINGLE", 1500),
+    ("DTI/STI", False, "DOUBLE", 2500),
+    ("CAP/CB", False, "SINGLE", 1000),
+    ("CAP/CB", False, "DOUBLE", 1500),
+    ("BEPC", False, "SINGLE", 1000),
+    ("BEPC", False, "DOUBLE", 1500),
+    ("BEPC", True, "SINGLE", 1000),
+]
+
+# Séries BAC à un seul pack (Math uniquement) : tarif propre, différent du niveau BAC.
+SINGLE_PACK_EXAMS = ["BAC A1", "BAC A2", "BAC B", "BAC G2"]
+
+
+def seed_rules(apps, schema_editor):
+    PriceRule = apps.get_model("exams", "PriceRule")
+    Exam = apps.get_model("exams", "Exam")
+
+    for level, is_long, pack_type, price in LEVEL_RULES:
+        PriceRule.objects.get_or_create(
+            exam=None,
+            level=level,
+            is_long_model=is_long,
+            pack_type=pack_type,
+            subject_code="",
+            defaults={"price": price},
+        )
+
+    for exam in Exam.objects.filter(name__in=SINGLE_PACK_EXAMS).order_by("name"):
+        PriceRule.objects.get_or_create(
+            exam=exam,
+            pack_type="SINGLE",
+            subject_code="MATH",
+            defaults={
+                "level": exam.level,
+                "is_long_model": exam.is_long_model,
+                "price": 1000,
+            },
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0012_pricerule"),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_rules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:29
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def backfill_summary(apps, schema_editor):
+    Cart = apps.get_model("exams", "Cart")
+    carts = Cart.objects.annotate(
+        n=Count("items"), s=Sum(F("items__pack__price") * F("items__quantity"))
+    )
+    for cart in carts.iterator():
+        cart.item_count = cart.n
+        cart.total = cart.s or 0
+        cart.save(update_fields=["item_count", "total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0013_seed_price_rules"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="total",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
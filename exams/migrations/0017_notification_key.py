@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0016_webhookevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="key",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0017_notification_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="reconcile_after",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="reconcile_attempts",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="transaction_id",
+            field=models.CharField(
+                blank=True,
+                help_text="Référence de la transaction CinetPay",
+                max_length=100,
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["status", "id"], name="order_status_idx"),
+        ),
+    ]
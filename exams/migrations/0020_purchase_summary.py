@@ -0,0 +1,69 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Sum
+import django.db.models.deletion
+
+
+def backfill_summary(apps, schema_editor):
+    Order = apps.get_model("exams", "Order")
+    PurchasedPack = apps.get_model("exams", "PurchasedPack")
+    PurchaseSummary = apps.get_model("exams", "PurchaseSummary")
+
+    paid = Order.objects.filter(status="PAID", user__isnull=False)
+    paid.update(fulfilled_at=F("created_at"))
+    owned = dict(
+        PurchasedPack.objects.values("user_id").annotate(n=Count("id")).values_list("user_id", "n")
+    )
+    rows = paid.values("user_id").annotate(n=Count("id"), s=Sum("total_amount"), last=Max("created_at"))
+    PurchaseSummary.objects.bulk_create([
+        PurchaseSummary(
+            user_id=row["user_id"], orders_count=row["n"], total_spent=row["s"] or 0,
+            owned_packs=owned.get(row["user_id"], 0), last_order_at=row["last"],
+        )
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("exams", "0019_order_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PurchaseSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="purchase_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("orders_count", models.PositiveIntegerField(default=0)),
+                ("total_spent", models.PositiveIntegerField(default=0)),
+                ("owned_packs", models.PositiveIntegerField(default=0)),
+                ("last_order_at", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="fulfilled_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="order_user_created_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0020_purchase_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtoken",
+            name="seat",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="bulk",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="downloadtoken",
+            name="item",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="tokens",
+                to="exams.orderitem",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="order",
+            name="payment_method",
+            field=models.CharField(
+                choices=[
+                    ("MOBILEMONEY", "Mobile Money"),
+                    ("STRIPE", "Carte bancaire (Stripe)"),
+                    ("INVOICE", "Facture (établissement)"),
+                ],
+                default="MOBILEMONEY",
+                max_length=20,
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="downloadtoken",
+            unique_together={("item", "seat")},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0021_bulk_orders"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtoken",
+            name="resume_until",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
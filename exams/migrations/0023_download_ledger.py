@@ -0,0 +1,82 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("exams", "0022_download_resume"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DownloadLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "outcome",
+                    models.CharField(
+                        choices=[
+                            ("COUNTED", "Décompté"),
+                            ("RESUMED", "Reprise"),
+                            ("HEAD", "HEAD"),
+                            ("REFUSED", "Refusé (expiré ou épuisé)"),
+                            ("FORBIDDEN", "Refusé (autre utilisateur)"),
+                            ("MISSING", "Fichier absent"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("status_code", models.PositiveSmallIntegerField()),
+                ("ip", models.GenericIPAddressField(blank=True, null=True)),
+                ("started_at", models.DateTimeField()),
+                ("duration_ms", models.PositiveIntegerField(default=0)),
+                ("bytes_sent", models.BigIntegerField(blank=True, null=True)),
+                ("completed", models.BooleanField(null=True)),
+                (
+                    "token",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="logs",
+                        to="exams.downloadtoken",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="download_logs",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["started_at"], name="download_log_started_idx"
+                    ),
+                    models.Index(
+                        fields=["token", "started_at"], name="download_log_token_idx"
+                    ),
+                    models.Index(
+                        fields=["user", "started_at"], name="download_log_user_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
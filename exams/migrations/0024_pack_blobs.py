@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:11
+
+import django.core.validators
+from django.db import migrations, models
+import exams.models
+import exams.storages
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0023_download_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PackBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("sha256", models.CharField(db_index=True, max_length=64)),
+                ("size", models.BigIntegerField(default=0)),
+                ("refcount", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="pack",
+            name="file",
+            field=models.FileField(
+                blank=True,
+                null=True,
+                storage=exams.storages.BlobStorage(),
+                upload_to="packs/",
+                validators=[
+                    django.core.validators.FileExtensionValidator(["zip"]),
+                    exams.models.validate_zip,
+                ],
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:15
+
+import django.core.validators
+from django.db import migrations, models
+import exams.models
+import exams.storages
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0024_pack_blobs"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="freesample",
+            name="file",
+            field=models.FileField(
+                help_text="Fichier .zip (max ~500Mo, contrôles anti zip-bomb).",
+                storage=exams.storages.ZipManifestStorage(),
+                upload_to="free_samples/",
+                validators=[
+                    django.core.validators.FileExtensionValidator(["zip"]),
+                    exams.models.validate_zip,
+                ],
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0026_webhook_retry"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="downloadlog",
+            name="outcome",
+            field=models.CharField(
+                choices=[
+                    ("COUNTED", "Décompté"),
+                    ("RESUMED", "Reprise"),
+                    ("HEAD", "HEAD"),
+                    ("UNSENT", "Non envoyé (304, 412, 416)"),
+                    ("REFUSED", "Refusé (expiré ou épuisé)"),
+                    ("FORBIDDEN", "Refusé (autre utilisateur)"),
+                    ("MISSING", "Fichier absent"),
+                ],
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exams", "0027_downloadlog_unsent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="downloadtoken",
+            name="resume_offset",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="downloadtoken",
+            name="resumes_left",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -2,25 +2,27 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 from django.utils import timezone
+from datetime import timedelta
 from django.db.models import JSONField
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.core.validators import FileExtensionValidator
-from .storages import ProtectedStorage
+from .storages import BlobStorage, ZipManifestStorage
 
 import uuid
 
 class Exam(models.Model):
-    name = models.CharField(max_length=100, unique=True)
-    slug = models.SlugField(max_length=120, unique=True, blank=True)
-    level = models.CharField(max_length=50, choices=[
+    LEVEL_CHOICES = [
         ('BAC', 'BAC'),
         ('DTI/STI', 'DTI/STI'),
         ('CAP/CB', 'CAP/CB'),
         ('BEPC', 'BEPC'),
-    ])
+    ]
+    name = models.CharField(max_length=100, unique=True)
+    slug = models.SlugField(max_length=120, unique=True, blank=True)
+    level = models.CharField(max_length=50, choices=LEVEL_CHOICES)
     is_long_model = models.BooleanField(default=False)
     active = models.BooleanField(default=True)
 
@@ -59,32 +61,23 @@ def validate_zip(value):
     if hasattr(value, "size") and value.size and value.size > max_size_bytes:
         raise ValidationError("Le ZIP ne doit pas dépasser 500 Mo.")
 
-    # Contrôles de structure avec zipfile
+    # Contrôles de structure sur le manifeste (exams.zip_manifest) : calculé
+    # une fois sur l'envoi et réutilisé au stockage, lu tel quel pour un fichier stocké
     import zipfile
+    from . import zip_manifest
     try:
-        pos = value.tell()
-    except Exception:
-        pos = None
-    try:
-        with zipfile.ZipFile(value) as zf:
-            infos = zf.infolist()
-            if len(infos) > 5000:
-                raise ValidationError("Le ZIP contient trop de fichiers (>5000).")
-
-            total_uncompressed = sum(i.file_size for i in infos)
-            total_compressed = sum(i.compress_size for i in infos) or 1
-            # ratio de décompression
-            ratio = total_uncompressed / float(total_compressed)
-            if ratio > 100:  # très conservateur
-                raise ValidationError("ZIP suspect (ratio de décompression trop élevé).")
-    except zipfile.BadZipFile:
+        entries = zip_manifest.for_validation(value)['entries']
+    except (zipfile.BadZipFile, OSError):
         raise ValidationError("Fichier ZIP invalide ou corrompu.")
-    finally:
-        try:
-            if pos is not None:
-                value.seek(pos)
-        except Exception:
-            pass
+    if len(entries) > 5000:
+        raise ValidationError("Le ZIP contient trop de fichiers (>5000).")
+
+    total_uncompressed = sum(e['size'] for e in entries)
+    total_compressed = sum(e['compressed_size'] for e in entries) or 1
+    # ratio de décompression
+    ratio = total_uncompressed / float(total_compressed)
+    if ratio > 100:  # très conservateur
+        raise ValidationError("ZIP suspect (ratio de décompression trop élevé).")
 
 class Pack(models.Model):
     TYPE_CHOICES = [
@@ -97,7 +90,7 @@ class Pack(models.Model):
     years_range = models.CharField(max_length=30, default='2015–2025')
     price = models.PositiveIntegerField(default=0)  # en F CFA
     file = models.FileField(
-        storage=ProtectedStorage(),
+        storage=BlobStorage(),  # adressé par contenu : voir exams.blobs
         upload_to='packs/',
         blank=True,
         null=True,
@@ -115,16 +108,67 @@ class Pack(models.Model):
         return base
 
     def save(self, *args, **kwargs):
-        # Auto-align price with rules
-        try:
-            from .price_rules import compute_price
-            computed = compute_price(self.exam, self.pack_type, self.subject.code if self.subject else None)
-            if computed:
-                self.price = computed
-        except Exception:
-            pass
+        # Auto-align price with rules (sans règle applicable, le prix saisi est conservé)
+        from .price_rules import price_for_pack
+        computed = price_for_pack(self)
+        if computed:
+            self.price = computed
         super().save(*args, **kwargs)
 
+class PackBlob(models.Model):
+    """
+    Fichier ZIP stocké une fois par contenu (SHA-256) et partagé par les packs
+    qui le désignent. refcount = nombre de packs, blob supprimé à zéro (exams.blobs).
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.refcount} pack(s))"
+
+# --- Tarification ------------------------------------------------------------
+
+class PriceRule(models.Model):
+    """
+    Règle de prix d'un pack, stockée en base et compilée en table de lookup
+    (voir exams.price_rules). Clé : (niveau, modèle long, type de pack, matière).
+    - subject_code vide : s'applique à toutes les matières.
+    - exam renseigné : règle propre à un examen, prioritaire sur celle du niveau
+      (ex. BAC A1 et BAC C partagent le niveau BAC mais pas le même tarif).
+    """
+    level = models.CharField(max_length=50, choices=Exam.LEVEL_CHOICES)
+    is_long_model = models.BooleanField(default=False)
+    pack_type = models.CharField(max_length=10, choices=Pack.TYPE_CHOICES)
+    subject_code = models.CharField(max_length=20, blank=True, default='', help_text="Vide = toutes les matières")
+    exam = models.ForeignKey(
+        Exam, on_delete=models.CASCADE, null=True, blank=True, related_name='price_rules',
+        help_text="Optionnel : règle spécifique à cet examen",
+    )
+    price = models.PositiveIntegerField()  # en F CFA
+    active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['level', 'is_long_model', 'pack_type', 'subject_code']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['level', 'is_long_model', 'pack_type', 'subject_code'],
+                condition=models.Q(exam__isnull=True),
+                name='uniq_pricerule_level',
+            ),
+            models.UniqueConstraint(
+                fields=['exam', 'pack_type', 'subject_code'],
+                condition=models.Q(exam__isnull=False),
+                name='uniq_pricerule_exam',
+            ),
+        ]
+
+    def __str__(self):
+        target = self.exam.name if self.exam_id else f"{self.level}{' (long)' if self.is_long_model else ''}"
+        return f"{target} {self.pack_type} {self.subject_code or '*'} = {self.price} F"
+
 # --- Extrait (ZIP libre d’accès) ---------------------------------------------
 
 class FreeSample(models.Model):
@@ -135,6 +179,7 @@ class FreeSample(models.Model):
     title = models.CharField(max_length=150, default="Extrait Épreuve + Corrigé")
     file = models.FileField(
         upload_to='free_samples/',
+        storage=ZipManifestStorage(),
         validators=[FileExtensionValidator(['zip']), validate_zip],
         help_text="Fichier .zip (max ~500Mo, contrôles anti zip-bomb)."
     )
@@ -157,12 +202,15 @@ class Order(models.Model):
     PAYMENT_CHOICES = [
         ('MOBILEMONEY', 'Mobile Money'),
         ('STRIPE', 'Carte bancaire (Stripe)'),
+        ('INVOICE', 'Facture (établissement)'),
     ]
 
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     email = models.EmailField(blank=True)
     phone = models.CharField(max_length=30)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    # incrémentée à chaque changement d'état (exams.order_states, compare-and-swap)
+    version = models.PositiveIntegerField(default=0, editable=False)
     total_amount = models.PositiveIntegerField(default=0)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES, default='MOBILEMONEY')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -172,6 +220,27 @@ class Order(models.Model):
         null=True,
         help_text="ID de la session Stripe Checkout"
     )
+    transaction_id = models.CharField(
+        max_length=100,
+        blank=True,
+        null=True,
+        help_text="Référence de la transaction CinetPay"
+    )
+    # Réconciliation (exams.reconciliation) : interrogations du prestataire et prochaine échéance
+    reconcile_attempts = models.PositiveSmallIntegerField(default=0, editable=False)
+    reconcile_after = models.DateTimeField(null=True, blank=True, editable=False)
+    # Première livraison, comptée dans le résumé d'achats (exams.purchase_summary)
+    fulfilled_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Commande groupée (exams.bulk_orders) : un lien par place, à distribuer aux élèves
+    bulk = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            # parcours des commandes en attente par lots (keyset sur l'id)
+            models.Index(fields=['status', 'id'], name='order_status_idx'),
+            # historique paginé par curseur (created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.pk} - {self.status} - {self.payment_method}"
@@ -201,10 +270,20 @@ class Payment(models.Model):
         return f"Payment {self.reference} - {self.status}"
 
 class DownloadToken(models.Model):
-    item = models.OneToOneField(OrderItem, on_delete=models.CASCADE)
+    item = models.ForeignKey(OrderItem, on_delete=models.CASCADE, related_name='tokens')
+    # une place par unité achetée (OrderItem.quantity) : 0 pour un achat individuel
+    seat = models.PositiveIntegerField(default=0)
     token = models.CharField(max_length=64, unique=True, default='')
     expires_at = models.DateTimeField()
     remaining_downloads = models.PositiveIntegerField(default=3)
+    # reprise (Range) d'un téléchargement décompté, gratuite jusqu'à cette date,
+    # au plus resumes_left fois, à partir d'un octet déjà reçu (<= resume_offset)
+    resume_until = models.DateTimeField(null=True, blank=True, editable=False)
+    resume_offset = models.BigIntegerField(default=0, editable=False)
+    resumes_left = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        unique_together = ('item', 'seat')
 
     def save(self, *args, **kwargs):
         if not self.token:
@@ -214,9 +293,119 @@ class DownloadToken(models.Model):
     def is_valid(self):
         return self.remaining_downloads > 0 and timezone.now() < self.expires_at
 
+    def can_resume(self):
+        now = timezone.now()
+        return self.resume_until is not None and now < self.resume_until and now < self.expires_at
+
+    def consume(self):
+        """
+        Décompte un téléchargement et ouvre la fenêtre de reprise, en un UPDATE
+        conditionnel : deux requêtes simultanées ne peuvent pas dépasser le quota.
+        False si le jeton est expiré ou épuisé.
+        """
+        now = timezone.now()
+        resume_until = now + timedelta(hours=settings.DOWNLOAD_RESUME_HOURS)
+        claimed = DownloadToken.objects.filter(
+            pk=self.pk, remaining_downloads__gt=0, expires_at__gt=now,
+        ).update(
+            remaining_downloads=models.F('remaining_downloads') - 1, resume_until=resume_until,
+            resume_offset=0, resumes_left=getattr(settings, 'DOWNLOAD_MAX_RESUMES', 5),
+        )
+        return bool(claimed)
+
+    def resume(self, start):
+        """
+        Reprise gratuite à partir de l'octet ``start``, en un UPDATE conditionnel :
+        fenêtre ouverte, reprises restantes, et ``start`` au plus à l'octet
+        atteint par l'envoi interrompu (exams.download_ledger). False sinon.
+        """
+        now = timezone.now()
+        claimed = DownloadToken.objects.filter(
+            pk=self.pk, resume_until__gt=now, expires_at__gt=now,
+            resumes_left__gt=0, resume_offset__gte=start,
+        ).update(resumes_left=models.F('resumes_left') - 1)
+        return bool(claimed)
+
     def __str__(self):
         return f"Token for {self.item} (expires {self.expires_at})"
 
+class DownloadLog(models.Model):
+    """
+    Registre des tentatives de téléchargement par jeton, en ajout seul : écrit
+    par lots hors de la requête (exams.download_ledger), jamais modifié.
+    bytes_sent / completed restent vides quand le proxy envoie le fichier.
+    """
+    OUTCOME_CHOICES = [
+        ('COUNTED', 'Décompté'),
+        ('RESUMED', 'Reprise'),
+        ('HEAD', 'HEAD'),
+        ('UNSENT', 'Non envoyé (304, 412, 416)'),
+        ('REFUSED', 'Refusé (expiré ou épuisé)'),
+        ('FORBIDDEN', 'Refusé (autre utilisateur)'),
+        ('MISSING', 'Fichier absent'),
+    ]
+
+    token = models.ForeignKey(DownloadToken, null=True, on_delete=models.SET_NULL, related_name='logs')
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='download_logs')
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES)
+    status_code = models.PositiveSmallIntegerField()
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    started_at = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField(default=0)
+    bytes_sent = models.BigIntegerField(null=True, blank=True)
+    completed = models.BooleanField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['started_at'], name='download_log_started_idx'),
+            models.Index(fields=['token', 'started_at'], name='download_log_token_idx'),
+            models.Index(fields=['user', 'started_at'], name='download_log_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token_id} {self.outcome} {self.started_at:%Y-%m-%d %H:%M}"
+
+class WebhookEvent(models.Model):
+    """
+    Boîte de réception des webhooks de paiement : chaque notification reçue
+    est enregistrée (une seule fois par prestataire + référence) puis traitée
+    par lots par ``python manage.py process_webhooks`` (exams.webhook_inbox).
+    """
+    PROVIDER_CHOICES = [
+        ('SIMULATOR', 'Simulateur'),
+        ('CINETPAY', 'CinetPay'),
+        ('STRIPE', 'Stripe'),
+    ]
+    STATE_CHOICES = [
+        ('RECEIVED', 'Reçu'),
+        ('PROCESSED', 'Traité'),
+        ('IGNORED', 'Ignoré'),
+        ('FAILED', 'En échec'),
+    ]
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    reference = models.CharField(max_length=255)
+    payload = JSONField(default=dict, blank=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='RECEIVED')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # nouvel essai après un échec, pas avant (backoff de exams.webhook_inbox)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'reference'], name='uniq_webhook_provider_ref'),
+        ]
+        indexes = [
+            # file d'attente : état puis ordre d'arrivée
+            models.Index(fields=['state', 'id'], name='webhook_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.reference} ({self.state})"
+
 class Profile(models.Model):
     ROLE_CHOICES = [
         ('client', 'Client'),
@@ -251,17 +440,20 @@ class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Résumé dénormalisé, tenu à jour par exams.cart_summary
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    total = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"Cart(user={self.user.username})"
 
     @property
     def items_count(self):
-        return self.items.count()
+        return self.item_count
 
     @property
     def total_amount(self):
-        return sum(i.subtotal for i in self.items.select_related('pack'))
+        return self.total
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -300,6 +492,21 @@ class PurchasedPack(models.Model):
     def __str__(self):
         return f"{self.user} possède {self.pack}"
 
+class PurchaseSummary(models.Model):
+    """
+    Résumé des achats d'un utilisateur, tenu à jour à la livraison
+    (exams.purchase_summary) plutôt que recalculé à chaque lecture.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='purchase_summary')
+    orders_count = models.PositiveIntegerField(default=0)
+    total_spent = models.PositiveIntegerField(default=0)
+    owned_packs = models.PositiveIntegerField(default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} : {self.orders_count} commande(s), {self.total_spent} F"
+
 class Notification(models.Model):
     """
     Notification simple (comme Facebook/LinkedIn).
@@ -312,9 +519,17 @@ class Notification(models.Model):
     payload = JSONField(default=dict, blank=True)
     read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Clé d'idempotence optionnelle (ex. "order-paid:42") : une seule notification par clé
+    key = models.CharField(max_length=100, null=True, blank=True, unique=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # liste paginée par curseur (created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='notif_user_created_idx'),
+            # compteur / liste des non lues
+            models.Index(fields=['user', 'read', 'created_at'], name='notif_user_read_idx'),
+        ]
 
     def __str__(self):
         return f"Notif {self.id} -> {self.user} ({'lu' if self.read else 'non lu'})"
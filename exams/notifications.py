@@ -0,0 +1,202 @@
+"""
+Notifications : pagination par curseur, opérations groupées et compteur de
+non lues en cache.
+
+- Pagination « keyset » sur (created_at, id) décroissants, servie par l'index
+  composite (user, -created_at, -id) : coût constant quelle que soit la page.
+- Opérations groupées (marquer lu, supprimer) : un seul UPDATE / DELETE.
+  Aucun receiver post_delete n'est branché sur Notification, pour que Django
+  garde son chemin de suppression rapide (DELETE direct, sans SELECT préalable).
+- Compteur de non lues par utilisateur en cache, ajusté après commit
+  (création +1, lecture -n, suppression -n non lues), une fois par opération ;
+  quand l'écart n'est pas connu, l'entrée est simplement oubliée et sera
+  recomptée (index (user, read, created_at)) à la prochaine lecture. Les
+  suppressions hors de ce module l'oublient elles-mêmes (admin) ; l'entrée
+  expire de toute façon après UNREAD_TIMEOUT. Cache indisponible : sans effet.
+- Chaque changement est aussi poussé en temps réel (exams.push) au consumer
+  WebSocket de l'utilisateur.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+
+from . import push
+
+UNREAD_KEY = 'notif:unread:{user_id}'
+UNREAD_TIMEOUT = 60 * 60
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def _unread_key(user_id):
+    return UNREAD_KEY.format(user_id=user_id)
+
+
+# --- Compteur de non lues ----------------------------------------------------------
+
+def unread_count(user):
+    """Nombre de notifications non lues (cache, sinon un COUNT indexé)."""
+    if not getattr(user, 'is_authenticated', False):
+        return 0
+    key = _unread_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        from .models import Notification
+
+        count = Notification.objects.filter(user_id=user.pk, read=False).count()
+        cache.set(key, count, UNREAD_TIMEOUT)
+    return count
+
+
+def forget_unread(user_id):
+    transaction.on_commit(lambda: cache.delete(_unread_key(user_id)))
+    push.unread_changed(user_id)
+
+
+def adjust_unread(user_id, delta):
+    """Ajuste le compteur en cache après commit (sans effet s'il n'est pas en cache)."""
+    if not delta:
+        return
+    key = _unread_key(user_id)
+
+    def _apply():
+        try:
+            value = cache.incr(key, delta) if delta > 0 else cache.decr(key, -delta)
+        except ValueError:
+            return  # absent du cache : il sera recompté
+        if value is None or value < 0:
+            # cache indisponible (IGNORE_EXCEPTIONS) ou compteur faussé : recompté
+            cache.delete(key)
+
+    transaction.on_commit(_apply, robust=True)
+    push.unread_changed(user_id, delta)
+
+
+def as_json(notification):
+    return {
+        'id': notification.pk,
+        'message': notification.message,
+        'payload': notification.payload,
+        'read': notification.read,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+# --- Pagination ----------------------------------------------------------------------
+
+def encode_cursor(notification):
+    raw = f"{notification.created_at.isoformat()}|{notification.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Curseur -> (created_at, id) ; ValueError si invalide."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError("Curseur invalide") from e
+
+
+def page(user, cursor=None, limit=DEFAULT_PAGE_SIZE, unread_only=False):
+    """
+    Une page de notifications, plus récentes d'abord.
+    Renvoie (notifications, curseur suivant ou None).
+    """
+    from .models import Notification
+
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    qs = Notification.objects.filter(user=user)
+    if unread_only:
+        qs = qs.filter(read=False)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    # une ligne de plus pour savoir s'il existe une page suivante
+    rows = list(qs.order_by('-created_at', '-id')[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# --- Opérations groupées -------------------------------------------------------------
+
+def _selection(user, ids=None, up_to=None, from_id=None):
+    """
+    Notifications de l'utilisateur visées par une opération :
+    liste d'ids, et/ou plage d'ids [from_id, up_to]. Tout si rien n'est précisé.
+    """
+    from .models import Notification
+
+    qs = Notification.objects.filter(user=user)
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    if up_to is not None:
+        qs = qs.filter(pk__lte=up_to)
+    if from_id is not None:
+        qs = qs.filter(pk__gte=from_id)
+    return qs
+
+
+def mark_read(user, ids=None, up_to=None):
+    """Marque comme lues (un UPDATE). Renvoie le nombre de notifications modifiées."""
+    updated = _selection(user, ids=ids, up_to=up_to).filter(read=False).update(read=True)
+    adjust_unread(user.pk, -updated)
+    return updated
+
+
+def delete(user, ids=None, up_to=None, from_id=None):
+    """
+    Supprime (un COUNT des non lues, un DELETE). Renvoie le nombre de
+    notifications supprimées ; compteur ajusté et poussé une seule fois.
+    """
+    with transaction.atomic():
+        qs = _selection(user, ids=ids, up_to=up_to, from_id=from_id)
+        unread = qs.filter(read=False).count()
+        deleted, _ = qs.delete()
+    adjust_unread(user.pk, -min(unread, deleted))
+    return deleted
+
+
+def delete_one(notification):
+    was_unread = not notification.read
+    notification.delete()
+    adjust_unread(notification.user_id, -1 if was_unread else 0)
+
+
+# --- Signaux -------------------------------------------------------------------------
+
+def notify_created(notification):
+    """Compteur + push pour une notification créée (aussi à appeler après un bulk_create)."""
+    push.send_on_commit(notification.user_id, 'notification.created', notification=as_json(notification))
+    adjust_unread(notification.user_id, 0 if notification.read else 1)
+
+
+def _notification_saved(sender, instance, created, **kwargs):
+    if created:
+        notify_created(instance)
+    else:
+        # état précédent inconnu
+        forget_unread(instance.user_id)
+
+
+def _order_saved(sender, instance, **kwargs):
+    # Une commande qui change d'état s'accompagne de notifications / d'un panier vidé
+    from . import cart_summary
+
+    forget_unread(instance.user_id)
+    cart_summary.forget(instance.user_id)
+
+
+def connect_signals():
+    from .models import Notification, Order
+
+    post_save.connect(_notification_saved, sender=Notification, dispatch_uid='notif-unread-save')
+    post_save.connect(_order_saved, sender=Order, dispatch_uid='notif-order-save')
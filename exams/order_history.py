@@ -0,0 +1,67 @@
+"""
+Historique des commandes d'un utilisateur.
+
+Pagination « keyset » sur (created_at, id) décroissants, servie par l'index
+composite (user, -created_at, -id) : coût constant quelle que soit la page.
+Une page coûte trois requêtes, quel que soit le nombre d'articles : les
+commandes, leurs articles avec packs, examens et matières, puis leurs jetons
+de téléchargement (place 0 seulement : une commande groupée peut en avoir
+des milliers, exportés à part en CSV).
+"""
+from django.db.models import Prefetch, Q
+from django.urls import reverse
+
+from .notifications import decode_cursor, encode_cursor
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+
+
+def page(user, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Une page de commandes, plus récentes d'abord.
+    Renvoie (commandes, curseur suivant ou None) ; ValueError si le curseur est invalide.
+    """
+    from .models import DownloadToken, Order, OrderItem
+
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    items = (
+        OrderItem.objects.select_related('pack__exam', 'pack__subject').order_by('id')
+        .prefetch_related(Prefetch('tokens', queryset=DownloadToken.objects.filter(seat=0), to_attr='first_tokens'))
+    )
+    qs = Order.objects.filter(user=user).prefetch_related(Prefetch('items', queryset=items))
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    # une ligne de plus pour savoir s'il existe une page suivante
+    rows = list(qs.order_by('-created_at', '-id')[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    for order in rows:
+        for item in order.items.all():
+            # jeton de la place 0, seulement une fois la commande payée et livrée
+            item.download_token = item.first_tokens[0] if item.first_tokens and order.status == 'PAID' else None
+    return rows[:limit], next_cursor
+
+
+def as_json(order):
+    items = []
+    for item in order.items.all():
+        token = item.download_token
+        items.append({
+            'pack_id': item.pack_id,
+            'name': str(item.pack),
+            'unit_price': int(item.unit_price),
+            'quantity': item.quantity,  # places, pour une commande groupée
+            'download_url': reverse('exams:download_file', args=[token.token]) if token else None,
+            'expires_at': token.expires_at.isoformat() if token else None,
+            'remaining_downloads': token.remaining_downloads if token else None,
+        })
+    return {
+        'id': order.pk,
+        'status': order.status,
+        'payment_method': order.payment_method,
+        'total_amount': order.total_amount,
+        'created_at': order.created_at.isoformat(),
+        'items': items,
+    }
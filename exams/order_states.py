@@ -0,0 +1,134 @@
+"""
+Cycle de vie des commandes et des paiements.
+
+Commande (Order.status) :
+
+    PENDING ──> PAID
+       │         ^
+       └──> CANCELLED   (un paiement confirmé après annulation / expiration l'emporte)
+
+PAID (et CANCELLED) ne sont demandés que sur un statut établi par le
+prestataire : webhook Stripe signé, notification CinetPay dont le statut est
+relu chez CinetPay (exams.webhook_inbox), réconciliation, ou statut relu au
+retour de paiement (views_cart.payment_success). Jamais sur le seul corps
+d'une requête non signée ni sur l'URL de retour. Seule exception : le mode
+simulateur (PAYMENT_PROVIDER = 'SIMULATOR', développement : webhook du
+simulateur, confirmation manuelle de exams.views.order_confirm).
+
+PAID est définitif. Chaque changement d'état est une écriture conditionnelle
+(compare-and-swap) sur la colonne ``version`` :
+
+    UPDATE exams_order SET status = %s, version = version + 1
+    WHERE id = %s AND version = %s
+
+Aucun verrou de ligne, aucune réécriture de la ligne entière : si une autre
+écriture est passée entre la lecture et l'UPDATE (0 ligne modifiée), on relit
+l'état et on revalide. Un seul des chemins concurrents (webhook, retour de
+paiement, confirmation, réconciliation) obtient la transition : c'est lui qui
+livre la commande.
+
+Paiement (Payment.status) : PENDING -> SUCCESS | FAILED, FAILED -> SUCCESS ;
+SUCCESS est définitif. Même principe, la garde portant sur le statut lu.
+"""
+from django.db.models import F
+
+PENDING, PAID, CANCELLED = 'PENDING', 'PAID', 'CANCELLED'
+
+# état courant -> états atteignables
+TRANSITIONS = {
+    PENDING: {PAID, CANCELLED},
+    CANCELLED: {PAID},
+    PAID: set(),
+}
+
+PAYMENT_TRANSITIONS = {
+    'PENDING': {'SUCCESS', 'FAILED'},
+    'FAILED': {'SUCCESS'},
+    'SUCCESS': set(),
+}
+
+MAX_RETRIES = 5
+
+
+class InvalidTransition(Exception):
+    """Transition interdite depuis l'état courant (ex. PAID -> CANCELLED)."""
+
+
+class ConcurrentUpdate(Exception):
+    """La commande change trop souvent : la transition n'a pas pu être posée."""
+
+
+def can_transition(current, target):
+    return target in TRANSITIONS.get(current, ())
+
+
+def sources(target):
+    """États depuis lesquels ``target`` est atteignable."""
+    return [state for state, targets in TRANSITIONS.items() if target in targets]
+
+
+def transition(order, target, **changes):
+    """
+    Fait passer ``order`` à ``target`` (CAS sur la version), avec éventuellement
+    d'autres champs modifiés dans le même UPDATE.
+
+    Renvoie True si cet appel a posé la transition, False si la commande y
+    était déjà. Lève InvalidTransition si elle est interdite. ``order`` est mis
+    à jour (status, version, champs) sans autre requête.
+    """
+    from .models import Order
+
+    status, version = order.status, order.version
+    for _ in range(MAX_RETRIES):
+        if status == target:
+            order.status, order.version = status, version
+            return False
+        if not can_transition(status, target):
+            order.status, order.version = status, version
+            raise InvalidTransition(f"Commande #{order.pk} : {status} -> {target}")
+        updated = Order.objects.filter(pk=order.pk, version=version).update(
+            status=target, version=F('version') + 1, **changes,
+        )
+        if updated:
+            order.status, order.version = target, version + 1
+            for field, value in changes.items():
+                setattr(order, field, value)
+            return True
+        # écriture concurrente : on relit l'état courant et on revalide
+        status, version = Order.objects.values_list('status', 'version').get(pk=order.pk)
+    raise ConcurrentUpdate(f"Commande #{order.pk}")
+
+
+def transition_many(order_ids, target):
+    """
+    Applique ``target`` aux commandes données, quand c'est permis.
+    Renvoie les ids dont la transition a été posée par cet appel ; les autres
+    y étaient déjà, ou ne le peuvent pas (ex. PAID -> CANCELLED).
+    """
+    from .models import Order
+
+    if not order_ids:
+        return []
+    changed = []
+    for order in Order.objects.filter(pk__in=order_ids, status__in=sources(target)).only('pk', 'status', 'version'):
+        try:
+            if transition(order, target):
+                changed.append(order.pk)
+        except InvalidTransition:
+            pass  # passée à un état final entre la lecture et l'écriture
+    return changed
+
+
+def set_payment_status(references, target):
+    """
+    Statut ``target`` pour les paiements donnés, depuis les états qui le permettent
+    (un UPDATE conditionné sur le statut courant). Renvoie le nombre de paiements modifiés.
+    """
+    from .models import Payment
+
+    if not references:
+        return 0
+    allowed = [state for state, targets in PAYMENT_TRANSITIONS.items() if target in targets]
+    if not allowed:
+        return 0
+    return Payment.objects.filter(reference__in=references, status__in=allowed).update(status=target)
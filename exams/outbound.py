@@ -0,0 +1,285 @@
+"""
+Appels sortants vers les prestataires externes (CinetPay, Stripe, OpenAI).
+
+Pour chaque prestataire (réglages OUTBOUND_PROVIDERS, fusionnés avec DEFAULTS) :
+- un pool de connexions HTTP dédié (``session(name)``), Stripe compris ;
+- un délai par appel, réduit au temps restant de l'échéance courante
+  (``with deadline(s):`` — les échéances imbriquées ne peuvent que raccourcir) ;
+- des essais supplémentaires sur erreur transitoire (réseau, délai, 429, 5xx),
+  avec attente exponentielle à gigue complète, sans dépasser l'échéance ;
+- un disjoncteur : après ``failure_threshold`` échecs transitoires consécutifs,
+  les appels échouent tout de suite (CircuitOpen) pendant ``reset_timeout``
+  secondes, puis un seul appel d'essai décide de la réouverture.
+
+État du disjoncteur et latences sont exportés dans les métriques Prometheus
+(registre de django_prometheus, /metrics). L'état est propre à chaque processus.
+
+    result = outbound.call('cinetpay', lambda timeout: ...)
+    response = outbound.request('cinetpay', 'POST', url, json=payload)
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+try:
+    import openai
+except ImportError:  # chatbot désactivé
+    openai = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'cinetpay': {'timeout': 10, 'pool_size': 8, 'max_tries': 3, 'failure_threshold': 5, 'reset_timeout': 30},
+    'stripe': {'timeout': 10, 'pool_size': 8, 'max_tries': 3, 'failure_threshold': 5, 'reset_timeout': 30},
+    'openai': {'timeout': 30, 'pool_size': 4, 'max_tries': 2, 'failure_threshold': 3, 'reset_timeout': 60},
+}
+BACKOFF_BASE = 0.2  # s
+BACKOFF_MAX = 5.0   # s
+MIN_TIMEOUT = 0.05  # s : en deçà, l'échéance est considérée comme dépassée
+
+
+class OutboundError(Exception):
+    """Appel sortant refusé sans avoir été tenté."""
+
+
+class CircuitOpen(OutboundError):
+    """Disjoncteur ouvert : le prestataire est considéré indisponible."""
+
+
+class DeadlineExceeded(OutboundError):
+    """Plus assez de temps avant l'échéance pour tenter l'appel."""
+
+
+class TransientError(Exception):
+    """Réponse à réessayer (429, 5xx…) levée par les fonctions d'appel."""
+
+
+_local = threading.local()
+_lock = threading.Lock()
+_sessions = {}
+_breakers = {}
+_openai_clients = {}
+
+
+def config(name):
+    return {**DEFAULTS.get(name, DEFAULTS['cinetpay']), **getattr(settings, 'OUTBOUND_PROVIDERS', {}).get(name, {})}
+
+
+# --- Échéance ----------------------------------------------------------------------
+
+@contextmanager
+def deadline(seconds):
+    """Borne le temps total des appels sortants du bloc (threads compris : à reposer dans le worker)."""
+    previous = getattr(_local, 'deadline', None)
+    limit = time.monotonic() + seconds
+    _local.deadline = limit if previous is None else min(previous, limit)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining():
+    """Secondes restantes avant l'échéance courante, None sans échéance."""
+    limit = getattr(_local, 'deadline', None)
+    return None if limit is None else limit - time.monotonic()
+
+
+# --- Disjoncteur -------------------------------------------------------------------
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+        metrics.OUTBOUND_BREAKER_STATE.labels(name).set(0)
+
+    def _set(self, state):
+        if state != self.state:
+            logger.warning("Disjoncteur %s : %s -> %s", self.name, self.state, state)
+            self.state = state
+            metrics.OUTBOUND_BREAKER_STATE.labels(self.name).set(self.STATE_VALUES[state])
+            if state == self.OPEN:
+                metrics.OUTBOUND_BREAKER_OPENED.labels(self.name).inc()
+
+    def is_open(self):
+        """Ouvert et encore dans le délai de refroidissement (les appels échoueraient tout de suite)."""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._set(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            self._set(self.CLOSED)
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set(self.OPEN)
+
+
+def breaker(name):
+    if name not in _breakers:
+        with _lock:
+            if name not in _breakers:
+                cfg = config(name)
+                _breakers[name] = CircuitBreaker(name, cfg['failure_threshold'], cfg['reset_timeout'])
+    return _breakers[name]
+
+
+# --- Pools de connexions -------------------------------------------------------------
+
+class _StripeClient(stripe.http_client.RequestsClient):
+    """Client Stripe dont le délai suit celui de l'appel en cours (outbound.call)."""
+
+    @property
+    def _timeout(self):
+        return getattr(_local, 'timeout', None) or self._default_timeout
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self._default_timeout = value
+
+
+def session(name):
+    """Session requests du prestataire (pool de ``pool_size`` connexions keep-alive)."""
+    if name not in _sessions:
+        with _lock:
+            if name not in _sessions:
+                cfg = config(name)
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=cfg['pool_size'], max_retries=0)
+                s.mount('https://', adapter)
+                s.mount('http://', adapter)
+                if name == 'stripe':
+                    stripe.default_http_client = _StripeClient(timeout=cfg['timeout'], session=s)
+                _sessions[name] = s
+    return _sessions[name]
+
+
+def stripe_ready():
+    """Configure Stripe (clé, URL de base, pool) avant un appel."""
+    session('stripe')
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    if getattr(settings, 'STRIPE_API_BASE', None):
+        stripe.api_base = settings.STRIPE_API_BASE
+
+
+def openai_client(api_key):
+    """Client OpenAI partagé (son pool de connexions), sans essais internes : call() s'en charge."""
+    if api_key not in _openai_clients:
+        with _lock:
+            if api_key not in _openai_clients:
+                _openai_clients[api_key] = openai.OpenAI(
+                    api_key=api_key, max_retries=0, timeout=config('openai')['timeout'],
+                )
+    return _openai_clients[api_key]
+
+
+# --- Appel -------------------------------------------------------------------------
+
+def _transient_errors():
+    errors = [requests.ConnectionError, requests.Timeout, TransientError,
+              stripe.error.APIConnectionError, stripe.error.RateLimitError]
+    if openai is not None:
+        errors += [openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError]
+    return tuple(errors)
+
+
+def _is_transient(error):
+    if isinstance(error, stripe.error.APIError) and not isinstance(error, stripe.error.InvalidRequestError):
+        return (error.http_status or 500) >= 500
+    return isinstance(error, _transient_errors())
+
+
+def call(name, func, retry=True):
+    """
+    Appelle ``func(timeout)`` pour le prestataire ``name`` (disjoncteur, échéance,
+    essais sur erreur transitoire si ``retry``). Lève CircuitOpen / DeadlineExceeded
+    sans appeler, ou l'erreur du dernier essai.
+    """
+    cfg = config(name)
+    circuit = breaker(name)
+    tries = cfg['max_tries'] if retry else 1
+    for attempt in range(tries):
+        timeout = cfg['timeout']
+        left = remaining()
+        if left is not None:
+            if left < MIN_TIMEOUT:
+                metrics.OUTBOUND_CALLS.labels(name, 'deadline').inc()
+                raise DeadlineExceeded(name)
+            timeout = min(timeout, left)
+        if not circuit.allow():
+            metrics.OUTBOUND_CALLS.labels(name, 'short_circuited').inc()
+            raise CircuitOpen(name)
+
+        start = time.perf_counter()
+        _local.timeout = timeout
+        try:
+            result = func(timeout)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            if not _is_transient(e):
+                # le prestataire a répondu (4xx, réponse invalide) : il est joignable
+                circuit.success()
+                metrics.OUTBOUND_LATENCY.labels(name, 'error').observe(elapsed)
+                metrics.OUTBOUND_CALLS.labels(name, 'error').inc()
+                raise
+            circuit.failure()
+            metrics.OUTBOUND_LATENCY.labels(name, 'failure').observe(elapsed)
+            metrics.OUTBOUND_CALLS.labels(name, 'failure').inc()
+            pause = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            left = remaining()
+            if attempt == tries - 1 or (left is not None and pause + MIN_TIMEOUT >= left):
+                raise
+            logger.info("Appel %s en échec (%s), nouvel essai dans %.2f s", name, e, pause)
+            time.sleep(pause)
+        else:
+            circuit.success()
+            metrics.OUTBOUND_LATENCY.labels(name, 'ok').observe(time.perf_counter() - start)
+            metrics.OUTBOUND_CALLS.labels(name, 'ok').inc()
+            return result
+        finally:
+            _local.timeout = None
+
+
+def request(name, method, url, retry=True, **kwargs):
+    """Requête HTTP via le pool du prestataire ; 429 et 5xx sont des erreurs transitoires."""
+    def send(timeout):
+        response = session(name).request(method, url, timeout=timeout, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientError(f"HTTP {response.status_code}")
+        return response
+    return call(name, send, retry=retry)
@@ -0,0 +1,333 @@
+"""
+Prestataire de paiement local (CinetPay / Stripe) pour tester hors ligne
+l'aller-retour complet : création du paiement, puis webhooks vers Examhub.
+
+API imitée :
+- POST /v2/payment               CinetPay (JSON) -> {"code": "201", "data": {"payment_url"}}
+- POST /v2/payment/check         CinetPay : statut d'une transaction (réconciliation)
+- POST /v1/checkout/sessions     Stripe (formulaire) -> {"id": "cs_test_...", "url"}
+- GET  /v1/checkout/sessions/<id>  Stripe : statut de la session (réconciliation)
+- POST /simulate/payment         {"reference": ..., "status": ...} : webhook du simulateur
+                                 historique (payment_webhook) pour une référence Payment
+- GET  /pay/<référence>          page « paiement simulé » renvoyant vers l'URL de retour
+- GET  /stats                    compteurs (créations, échecs, webhooks envoyés / en erreur)
+
+Après chaque création réussie, un webhook est planifié (``webhook_delay``) :
+statut accepté, ou refusé/expiré selon ``webhook_failure_rate``, et rejoué
+``retry_storm`` fois de plus (mêmes identifiants) pour simuler les renvois
+d'un prestataire. Latence et taux d'échec de l'API de création sont réglables.
+
+Utilisé par la commande ``payment_standin`` (et par ``checkout_loadtest``).
+"""
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class StandinConfig:
+    def __init__(
+        self, base_url, latency=0.3, jitter=0.2, failure_rate=0.0,
+        webhooks=True, webhook_delay=0.5, webhook_failure_rate=0.0,
+        retry_storm=0, retry_interval=0.2,
+        stripe_webhook_url='http://127.0.0.1:8000/examens/webhooks/stripe/',
+        stripe_webhook_secret='',
+        payment_webhook_url='http://127.0.0.1:8000/examens/payments/webhook/',
+        notify_url_override='',
+    ):
+        self.base_url = base_url
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.webhooks = webhooks
+        self.webhook_delay = webhook_delay
+        self.webhook_failure_rate = webhook_failure_rate
+        self.retry_storm = retry_storm
+        self.retry_interval = retry_interval
+        self.stripe_webhook_url = stripe_webhook_url
+        self.stripe_webhook_secret = stripe_webhook_secret
+        self.payment_webhook_url = payment_webhook_url
+        self.notify_url_override = notify_url_override
+
+
+def cinetpay_notification(payload, accepted=True):
+    """Corps + en-têtes de la notification CinetPay pour une charge utile de création."""
+    body = json.dumps({
+        'transaction_id': payload.get('transaction_id'),
+        'cpm_site_id': payload.get('site_id'),
+        'amount': payload.get('amount'),
+        'currency': payload.get('currency'),
+        'status': 'ACCEPTED' if accepted else 'REFUSED',
+        'metadata': payload.get('metadata'),
+    }).encode('utf-8')
+    return body, {'Content-Type': 'application/json'}
+
+
+def stripe_event(session_id, metadata, accepted=True, secret=''):
+    """Corps + en-têtes d'un événement checkout.session.*, signé si ``secret``."""
+    body = json.dumps({
+        'id': f"evt_{uuid.uuid4().hex}",
+        'object': 'event',
+        'type': 'checkout.session.completed' if accepted else 'checkout.session.expired',
+        'data': {'object': {
+            'id': session_id, 'object': 'checkout.session',
+            'payment_status': 'paid' if accepted else 'unpaid',
+            'metadata': metadata,
+        }},
+    }).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        timestamp = str(int(time.time()))
+        signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+        headers['Stripe-Signature'] = f"t={timestamp},v1={signature}"
+    return body, headers
+
+
+class WebhookDispatcher:
+    """Planifie et envoie les webhooks (un thread d'ordonnancement + un pool d'envoi)."""
+
+    def __init__(self, workers=16):
+        self.session = requests.Session()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='standin-webhook')
+        self.queue = []
+        self.cond = threading.Condition()
+        self.stats = {'webhooks_sent': 0, 'webhooks_failed': 0}
+        self.stats_lock = threading.Lock()
+        threading.Thread(target=self._run, name='standin-scheduler', daemon=True).start()
+
+    def schedule(self, delay, url, body, headers):
+        with self.cond:
+            heapq.heappush(self.queue, (time.monotonic() + delay, uuid.uuid4().hex, url, body, headers))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    timeout = self.queue[0][0] - time.monotonic() if self.queue else None
+                    self.cond.wait(timeout)
+                _, _, url, body, headers = heapq.heappop(self.queue)
+            self.pool.submit(self._send, url, body, headers)
+
+    def _send(self, url, body, headers):
+        try:
+            response = self.session.post(url, data=body, headers=headers, timeout=10)
+            ok = response.status_code < 500
+        except requests.RequestException as e:
+            logger.warning("Webhook %s : %s", url, e)
+            ok = False
+        with self.stats_lock:
+            self.stats['webhooks_sent' if ok else 'webhooks_failed'] += 1
+
+
+class StandinState:
+    """Paramètres, références créées et compteurs, partagés par les threads du serveur."""
+
+    def __init__(self, config):
+        self.config = config
+        self.return_urls = {}
+        self.outcomes = {}  # référence -> (accepté ?, instant de création)
+        self.lock = threading.Lock()
+        self.counters = {'created': 0, 'create_failed': 0}
+        self.dispatcher = WebhookDispatcher() if config.webhooks else None
+
+    def wait(self):
+        delay = self.config.latency + random.uniform(0, self.config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def should_fail(self):
+        return random.random() < self.config.failure_rate
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def remember(self, reference, return_url):
+        """Enregistre le paiement et tire son issue (acceptée ou non) ; renvoie l'issue."""
+        accepted = random.random() >= self.config.webhook_failure_rate
+        with self.lock:
+            self.return_urls[reference] = return_url
+            self.outcomes[reference] = (accepted, time.monotonic())
+        return accepted
+
+    def outcome(self, reference):
+        """True / False une fois le paiement « terminé » (après webhook_delay), None avant ou inconnu."""
+        with self.lock:
+            accepted, created = self.outcomes.get(reference, (None, 0))
+        if accepted is None or time.monotonic() - created < self.config.webhook_delay:
+            return None
+        return accepted
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+        if self.dispatcher:
+            with self.dispatcher.stats_lock:
+                data.update(self.dispatcher.stats)
+            data['webhooks_scheduled'] = len(self.dispatcher.queue)
+        return data
+
+    def fire(self, url, body, headers):
+        """Webhook + renvois identiques (tempête de retries)."""
+        if not self.dispatcher or not url:
+            return
+        config = self.config
+        for attempt in range(1 + config.retry_storm):
+            self.dispatcher.schedule(config.webhook_delay + attempt * config.retry_interval, url, body, headers)
+
+    # --- Webhooks par prestataire ------------------------------------------------
+
+    def fire_cinetpay(self, payload, accepted):
+        body, headers = cinetpay_notification(payload, accepted)
+        self.fire(self.config.notify_url_override or payload.get('notify_url'), body, headers)
+
+    def fire_stripe(self, session_id, form, accepted):
+        metadata = {
+            key[len('metadata['):-1]: values[0]
+            for key, values in form.items() if key.startswith('metadata[')
+        }
+        body, headers = stripe_event(session_id, metadata, accepted, self.config.stripe_webhook_secret)
+        self.fire(self.config.stripe_webhook_url, body, headers)
+
+    def fire_simulator(self, reference, status=None):
+        if status is None:
+            status = 'SUCCESS' if random.random() >= self.config.webhook_failure_rate else 'FAILED'
+        body = f"reference={reference}&status={status}".encode()
+        self.fire(self.config.payment_webhook_url, body, {'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, comme les vrais prestataires
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self._body()
+        state = self.state
+
+        if self.path.startswith('/simulate/payment'):
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                return self._send(400, {'error': 'JSON invalide'})
+            if not data.get('reference'):
+                return self._send(400, {'error': 'reference manquante'})
+            state.fire_simulator(data['reference'], data.get('status'))
+            return self._send(202, {'ok': True})
+
+        state.wait()
+
+        if self.path.startswith('/v2/payment/check'):
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                return self._send(400, {'code': '608', 'description': 'JSON invalide'})
+            if state.should_fail():
+                return self._send(503, {'code': '500', 'description': 'Erreur simulée du prestataire'})
+            reference = payload.get('transaction_id')
+            if reference not in state.outcomes:
+                return self._send(200, {'code': '627', 'message': 'TRANSACTION_NOT_FOUND', 'data': {}})
+            accepted = state.outcome(reference)
+            status = 'WAITING_FOR_CUSTOMER' if accepted is None else ('ACCEPTED' if accepted else 'REFUSED')
+            return self._send(200, {'code': '00' if accepted else '662', 'message': status, 'data': {'status': status}})
+
+        if self.path.startswith('/v2/payment'):
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                return self._send(400, {'code': '608', 'description': 'JSON invalide'})
+            if state.should_fail():
+                state.count('create_failed')
+                return self._send(200, {'code': '624', 'description': 'Erreur simulée du prestataire'})
+            reference = payload.get('transaction_id') or uuid.uuid4().hex
+            accepted = state.remember(reference, payload.get('return_url'))
+            state.count('created')
+            state.fire_cinetpay(payload, accepted)
+            return self._send(200, {
+                'code': '201',
+                'message': 'CREATED',
+                'data': {
+                    'payment_token': uuid.uuid4().hex,
+                    'payment_url': f"{state.config.base_url}/pay/{reference}",
+                },
+            })
+
+        if self.path.startswith('/v1/checkout/sessions'):
+            form = parse_qs(body.decode('utf-8'))
+            if state.should_fail():
+                state.count('create_failed')
+                return self._send(502, {'error': {'type': 'api_error', 'message': 'Erreur simulée du prestataire'}})
+            reference = f"cs_test_{uuid.uuid4().hex}"
+            accepted = state.remember(
+                reference, (form.get('success_url') or [''])[0].replace('{CHECKOUT_SESSION_ID}', reference),
+            )
+            state.count('created')
+            state.fire_stripe(reference, form, accepted)
+            return self._send(200, {
+                'id': reference,
+                'object': 'checkout.session',
+                'url': f"{state.config.base_url}/pay/{reference}",
+            })
+
+        self._send(404, {'error': 'not found'})
+
+    def do_GET(self):
+        if self.path.startswith('/stats'):
+            return self._send(200, self.state.stats())
+        if self.path.startswith('/v1/checkout/sessions/'):
+            reference = self.path[len('/v1/checkout/sessions/'):].split('?')[0]
+            if reference not in self.state.outcomes:
+                return self._send(404, {'error': {'type': 'invalid_request_error', 'message': 'No such checkout.session'}})
+            accepted = self.state.outcome(reference)
+            return self._send(200, {
+                'id': reference,
+                'object': 'checkout.session',
+                'status': 'open' if accepted is None else ('complete' if accepted else 'expired'),
+                'payment_status': 'paid' if accepted else 'unpaid',
+            })
+        if self.path.startswith('/pay/'):
+            reference = self.path[len('/pay/'):]
+            return_url = self.state.return_urls.get(reference) or '/'
+            html = (
+                "<!doctype html><meta charset='utf-8'><title>Paiement simulé</title>"
+                f"<p>Paiement simulé : {reference}</p>"
+                f"<p><a href='{return_url}'>Revenir sur Examhub</a></p>"
+            )
+            return self._send(200, html.encode('utf-8'), 'text/html; charset=utf-8')
+        self._send(404, {'error': 'not found'})
+
+
+def make_server(host, port, **options):
+    """Serveur prêt à lancer (serve_forever) ; ``options`` : voir StandinConfig."""
+    config = StandinConfig(base_url=f"http://{host}:{port}", **options)
+    handler = type('Handler', (StandinHandler,), {'state': StandinState(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
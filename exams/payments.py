@@ -0,0 +1,171 @@
+"""
+Initialisation des paiements (CinetPay / Stripe) hors du worker de requête.
+
+``cart_checkout`` crée la commande puis appelle ``start_checkout`` qui rend la
+main tout de suite : l'appel au prestataire part sur un pool de threads borné
+(PAYMENT_INIT_CONCURRENCY appels simultanés au plus, PAYMENT_INIT_QUEUE en
+attente ; au-delà, CheckoutBusy). Les appels passent par exams.outbound (pool
+de connexions par prestataire, essais, disjoncteur) avec une échéance de
+PAYMENT_INIT_TIMEOUT secondes pour toute l'initialisation ; disjoncteur ouvert,
+``start_checkout`` refuse tout de suite (CheckoutBusy) au lieu de créer une
+commande vouée à l'échec.
+
+L'état de l'initialisation est stocké en cache (partagé entre processus) :
+    {"state": "preparing" | "ready" | "failed", "redirect_url": ..., "error": ...}
+Le client le lit via ``exams:checkout_status`` et le reçoit aussi en temps réel
+sur le WebSocket des notifications (événement « checkout »).
+
+Les URL des prestataires sont configurables (CINETPAY_BASE_URL, STRIPE_API_BASE)
+pour viser le prestataire local de substitution (commande ``payment_standin``).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+
+from . import outbound, push
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = 'checkout:{order_id}'
+STATE_TIMEOUT = 60 * 60
+
+PREPARING, READY, FAILED = 'preparing', 'ready', 'failed'
+
+
+class CheckoutBusy(Exception):
+    """Trop d'initialisations de paiement en cours : réessayer plus tard."""
+
+
+def _concurrency():
+    return int(getattr(settings, 'PAYMENT_INIT_CONCURRENCY', 8))
+
+
+def _timeout():
+    return float(getattr(settings, 'PAYMENT_INIT_TIMEOUT', 15))
+
+
+# --- Pool de workers (un par processus) ----------------------------------------------
+
+_lock = threading.Lock()
+_pool = {'executor': None, 'slots': None}
+
+
+def _get_executor():
+    if _pool['executor'] is None:
+        with _lock:
+            if _pool['executor'] is None:
+                concurrency = _concurrency()
+                queue = int(getattr(settings, 'PAYMENT_INIT_QUEUE', 64))
+                # jetons = appels en cours + en file : borne la mémoire et le temps d'attente
+                _pool['slots'] = threading.BoundedSemaphore(concurrency + queue)
+                _pool['executor'] = ThreadPoolExecutor(
+                    max_workers=concurrency, thread_name_prefix='payment-init',
+                )
+    return _pool['executor']
+
+
+# --- État partagé --------------------------------------------------------------------
+
+def _state_key(order_id):
+    return STATE_KEY.format(order_id=order_id)
+
+
+def get_state(order_id):
+    return cache.get(_state_key(order_id))
+
+
+def _set_state(order_id, user_id, state, redirect_url=None, error=None):
+    data = {'state': state, 'redirect_url': redirect_url, 'error': error}
+    cache.set(_state_key(order_id), data, STATE_TIMEOUT)
+    if state != PREPARING:
+        push.send(user_id, 'checkout.update', order_id=order_id, **data)
+    return data
+
+
+# --- Prestataires --------------------------------------------------------------------
+
+PROVIDERS = {'STRIPE': 'stripe', 'CINETPAY': 'cinetpay'}
+
+
+def _create_stripe_session(order_id, params):
+    outbound.stripe_ready()
+    # clé d'idempotence : un nouvel essai ne crée pas une seconde session
+    session = outbound.call('stripe', lambda timeout: stripe.checkout.Session.create(
+        idempotency_key=f"checkout-{order_id}", **params,
+    ))
+    return session.id, session.url
+
+
+def _create_cinetpay_payment(payload):
+    # même transaction_id à chaque essai : CinetPay refuse les doublons
+    response = outbound.request('cinetpay', 'POST', settings.CINETPAY_BASE_URL, json=payload)
+    data = response.json()
+    if data.get('code') != '201':
+        raise ValueError(data.get('description') or "Erreur inconnue")
+    return payload['transaction_id'], data['data']['payment_url']
+
+
+def _initiate(order_id, user_id, method, params):
+    """Exécuté sur le pool : appel au prestataire puis mise à jour de l'état."""
+    from .models import Order
+
+    try:
+        with outbound.deadline(_timeout()):
+            if method == 'STRIPE':
+                reference, url = _create_stripe_session(order_id, params)
+                Order.objects.filter(pk=order_id).update(stripe_session_id=reference)
+            else:
+                reference, url = _create_cinetpay_payment(params)
+                Order.objects.filter(pk=order_id).update(transaction_id=reference)
+        _set_state(order_id, user_id, READY, redirect_url=url)
+        logger.info("Paiement prêt pour la commande #%s (%s, %s)", order_id, method, reference)
+    except outbound.OutboundError as e:
+        logger.warning("Paiement non initialisé, commande #%s (%s) : %r", order_id, method, e)
+        _set_state(order_id, user_id, FAILED, error="Le service de paiement ne répond pas. Merci de réessayer plus tard.")
+    except Exception as e:
+        logger.warning("Échec d'initialisation du paiement, commande #%s (%s) : %s", order_id, method, e)
+        _set_state(order_id, user_id, FAILED, error=str(e))
+    finally:
+        _pool['slots'].release()
+        close_old_connections()
+
+
+def start_checkout(order, method, params):
+    """
+    Lance l'initialisation du paiement en arrière-plan et rend la main.
+    ``params`` : arguments de stripe.checkout.Session.create ou charge utile
+    CinetPay. Lève CheckoutBusy si le budget de concurrence est épuisé ou si
+    le disjoncteur du prestataire est ouvert.
+    """
+    if outbound.breaker(PROVIDERS[method]).is_open():
+        raise CheckoutBusy()
+    executor = _get_executor()
+    slots = _pool['slots']
+    # refus immédiat si tout est pris ; la place n'est réservée qu'après commit,
+    # pour qu'une transaction annulée n'en garde aucune
+    if not slots.acquire(blocking=False):
+        raise CheckoutBusy()
+    slots.release()
+    state = _set_state(order.pk, order.user_id, PREPARING)
+
+    def _submit():
+        if not slots.acquire(blocking=False):
+            # prise entre-temps par une autre initialisation
+            _set_state(order.pk, order.user_id, FAILED, error=(
+                "Le service de paiement est très sollicité. Merci de réessayer dans quelques instants."
+            ))
+            return
+        try:
+            executor.submit(_initiate, order.pk, order.user_id, method, params)
+        except RuntimeError:
+            slots.release()
+            _set_state(order.pk, order.user_id, FAILED, error="Service de paiement indisponible")
+
+    # la commande doit être visible du worker avant l'appel au prestataire
+    transaction.on_commit(_submit)
+    return state
@@ -1,32 +1,100 @@
-def compute_price(exam, pack_type, subject_code=None):
-    level = exam.level
-    name = exam.name
-    is_long = exam.is_long_model
-
-    # Cas 1 : Examens à 3 packs
-    exams_with_three_packs = ["BAC C", "BAC D", "BAC F4", "DTI/STI", "CAP/CB", "BEPC (modèle court)"]
-
-    if name in exams_with_three_packs:
-        if pack_type == 'DOUBLE':
-            if level in ('BAC', 'DTI/STI'):
-                return 2500
-            if level in ('CAP/CB', 'BEPC') and not is_long:
-                return 1500
-            return 0
-        else:  # pack MATH ou PCT
-            if level in ('BAC', 'DTI/STI'):
-                return 1500
-            if level in ('CAP/CB', 'BEPC') and not is_long:
-                return 1000
-            return 0
-
-    # Cas 2 : Examens à 1 seul pack (Math uniquement)
-    exams_with_one_pack = ["BAC A1", "BAC A2", "BAC B", "BAC G2", "BEPC (modèle long)"]
-
-    if name in exams_with_one_pack:
-        if pack_type == 'MATH':
-            return 1000
-        return 0
-
-    # Par défaut, aucun prix
+"""
+Moteur de tarification piloté par les données.
+
+Les règles (modèle PriceRule) sont compilées en une table de lookup en mémoire,
+clé (niveau, modèle long, type de pack, code matière), plus une table des
+règles propres à un examen. La table est mémoïsée par processus et invalidée
+via un compteur de version en cache, incrémenté à chaque écriture de règle.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+VERSION_KEY = 'pricing:version'
+
+_compiled = {'version': None, 'table': None}
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY) or 1
+    return version
+
+
+def bump_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        version = (_compiled['version'] or 0) + 1
+        cache.set(VERSION_KEY, version, timeout=None)
+        return version
+
+
+def compile_rules():
+    """Construit la table {clé: prix} depuis les règles actives (1 requête)."""
+    from .models import PriceRule
+
+    table = {}
+    rows = PriceRule.objects.filter(active=True).values_list(
+        'exam_id', 'level', 'is_long_model', 'pack_type', 'subject_code', 'price'
+    )
+    for exam_id, level, is_long, pack_type, subject_code, price in rows:
+        if exam_id:
+            table[('exam', exam_id, pack_type, subject_code)] = price
+        else:
+            table[('level', level, is_long, pack_type, subject_code)] = price
+    return table
+
+
+def get_table():
+    """Table compilée, reconstruite seulement si la version a changé."""
+    version = get_version()
+    if _compiled['version'] != version or _compiled['table'] is None:
+        _compiled['table'] = compile_rules()
+        _compiled['version'] = version
+    return _compiled['table']
+
+
+def lookup(table, exam, pack_type, subject_code=None):
+    """
+    Prix pour un examen / type de pack / matière, du plus spécifique au plus
+    général. 0 si aucune règle ne s'applique.
+    """
+    code = subject_code or ''
+    keys = []
+    if exam.pk:
+        keys += [('exam', exam.pk, pack_type, code), ('exam', exam.pk, pack_type, '')]
+    keys += [
+        ('level', exam.level, exam.is_long_model, pack_type, code),
+        ('level', exam.level, exam.is_long_model, pack_type, ''),
+    ]
+    for key in keys:
+        price = table.get(key)
+        if price is not None:
+            return price
     return 0
+
+
+def compute_price(exam, pack_type, subject_code=None):
+    return lookup(get_table(), exam, pack_type, subject_code)
+
+
+def price_for_pack(pack, table=None):
+    """Prix calculé d'un Pack (0 si aucune règle : le prix saisi est alors conservé)."""
+    if table is None:
+        table = get_table()
+    subject = pack.subject if pack.subject_id else None
+    return lookup(table, pack.exam, pack.pack_type, subject.code if subject else None)
+
+
+def invalidate_rules(**kwargs):
+    transaction.on_commit(bump_version)
+
+
+def connect_signals():
+    from .models import PriceRule
+
+    post_save.connect(invalidate_rules, sender=PriceRule, dispatch_uid='pricing-invalidate-save')
+    post_delete.connect(invalidate_rules, sender=PriceRule, dispatch_uid='pricing-invalidate-delete')
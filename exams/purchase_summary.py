@@ -0,0 +1,96 @@
+"""
+Résumé des achats par utilisateur : commandes livrées, montant dépensé, packs
+possédés, date de la dernière commande.
+
+La ligne PurchaseSummary est mise à jour par la livraison (exams.fulfillment),
+jamais recalculée à la lecture :
+- chaque commande n'est comptée qu'une fois : sa première livraison la marque
+  (Order.fulfilled_at, un UPDATE conditionné sur « pas encore marquée » pour
+  tout le lot, puis relecture des commandes marquées par cet appel), les
+  livraisons suivantes (page rechargée, webhook rejoué) ne comptent rien et ne
+  coûtent aucune requête ;
+- totaux agrégés par acheteur, puis un seul UPDATE pour tous les acheteurs du
+  lot : incréments atomiques (F() + Case/When par utilisateur), sans lecture
+  préalable, et packs possédés en COUNT de PurchasedPack (sous-requête).
+  Nombre de requêtes fixe, quel que soit le nombre de commandes.
+"""
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+EMPTY = {'orders_count': 0, 'total_spent': 0, 'owned_packs': 0, 'last_order_at': None}
+
+
+def get_summary(user):
+    """Résumé de l'utilisateur (une lecture par clé primaire)."""
+    from .models import PurchaseSummary
+
+    row = PurchaseSummary.objects.filter(pk=user.pk).values(*EMPTY).first()
+    return row or dict(EMPTY)
+
+
+def as_json(summary):
+    last = summary['last_order_at']
+    return {**summary, 'last_order_at': last.isoformat() if last else None}
+
+
+def _claim(orders):
+    """Marque les commandes pas encore comptées ; renvoie celles dont le marquage revient à cet appel."""
+    from .models import Order
+
+    pending = {order.pk: order for order in orders if order.user_id and order.fulfilled_at is None}
+    if not pending:
+        return []
+    now = timezone.now()
+    if not Order.objects.filter(pk__in=list(pending), fulfilled_at__isnull=True).update(fulfilled_at=now):
+        return []
+    # marquées par cet appel : celles qui portent exactement cet horodatage
+    claimed = []
+    for pk in Order.objects.filter(pk__in=list(pending), fulfilled_at=now).values_list('pk', flat=True):
+        pending[pk].fulfilled_at = now
+        claimed.append(pending[pk])
+    return claimed
+
+
+def _per_user(values, output_field):
+    """CASE pk WHEN <user> THEN <valeur> … pour un UPDATE groupé."""
+    return Case(
+        *(When(pk=user_id, then=Value(value)) for user_id, value in values.items()),
+        output_field=output_field,
+    )
+
+
+def record_fulfilled(orders):
+    """
+    Compte les commandes livrées dans le résumé de leurs acheteurs.
+    ``orders`` : commandes chargées (user_id, total_amount, created_at, fulfilled_at).
+    """
+    from .models import PurchasedPack, PurchaseSummary
+
+    claimed = _claim(orders)
+    if not claimed:
+        return
+
+    per_user = {}
+    for order in claimed:
+        count, total, last = per_user.get(order.user_id, (0, 0, order.created_at))
+        per_user[order.user_id] = (count + 1, total + int(order.total_amount or 0), max(last, order.created_at))
+
+    PurchaseSummary.objects.bulk_create(
+        [PurchaseSummary(user_id=user_id) for user_id in per_user], ignore_conflicts=True,
+    )
+    counts = {user_id: count for user_id, (count, _, _) in per_user.items()}
+    totals = {user_id: total for user_id, (_, total, _) in per_user.items()}
+    lasts = {user_id: last for user_id, (_, _, last) in per_user.items()}
+    last = _per_user(lasts, DateTimeField())
+    owned = (
+        PurchasedPack.objects.filter(user_id=OuterRef('pk')).order_by().values('user_id')
+        .annotate(c=Count('id')).values('c')
+    )
+    PurchaseSummary.objects.filter(pk__in=list(per_user)).update(
+        orders_count=F('orders_count') + _per_user(counts, IntegerField()),
+        total_spent=F('total_spent') + _per_user(totals, IntegerField()),
+        last_order_at=Greatest(Coalesce('last_order_at', last), last),
+        owned_packs=Coalesce(Subquery(owned, output_field=IntegerField()), 0),
+        updated_at=timezone.now(),
+    )
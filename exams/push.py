@@ -0,0 +1,59 @@
+"""
+Envoi temps réel vers le consumer WebSocket des notifications
+(exams.consumers.NotificationConsumer), un groupe par utilisateur.
+
+Les envois partent après commit (jamais pour une écriture annulée) et ne
+doivent jamais faire échouer la requête : une couche de canaux indisponible
+est simplement loggée.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(user_id):
+    return f'notifications_user_{user_id}'
+
+
+def send(user_id, event_type, **data):
+    """Envoie un événement au groupe de l'utilisateur (immédiatement)."""
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(group_name(user_id), {'type': event_type, **data})
+    except Exception as e:
+        logger.warning("Push WebSocket impossible (user %s, %s) : %s", user_id, event_type, e)
+
+
+def send_on_commit(user_id, event_type, **data):
+    transaction.on_commit(lambda: send(user_id, event_type, **data))
+
+
+def cart_changed(user_id):
+    """Après commit : pousse le nouveau nombre d'articles du panier."""
+    def _send():
+        from django.contrib.auth.models import User
+
+        from . import cart_summary
+
+        user = User(pk=user_id)
+        send(user_id, 'cart.count', count=cart_summary.get_summary(user)['count'])
+
+    transaction.on_commit(_send)
+
+
+def unread_changed(user_id, delta=None):
+    """Après commit : pousse le compteur de non lues (et l'écart s'il est connu)."""
+    def _send():
+        from django.contrib.auth.models import User
+
+        from . import notifications
+
+        send(user_id, 'unread.count', unread=notifications.unread_count(User(pk=user_id)), delta=delta)
+
+    transaction.on_commit(_send)
@@ -0,0 +1,202 @@
+"""
+Réconciliation des commandes restées en attente (webhook perdu, client parti).
+
+``reconcile()`` parcourt par lots (keyset sur l'id, index order_status_idx) les
+commandes PENDING plus vieilles que RECONCILE_MIN_AGE dont l'échéance est
+passée, et interroge le prestataire (CinetPay /payment/check, Stripe
+Session.retrieve) :
+- au plus RECONCILE_CONCURRENCY appels simultanés, via exams.outbound (pool de
+  connexions du prestataire, essais avec attente exponentielle et gigue sur
+  erreur transitoire, disjoncteur) ;
+- réponse définitive : mêmes transitions que les webhooks (exams.order_states),
+  puis livraison (exams.fulfillment) ;
+- toujours en attente ou erreur : prochaine interrogation repoussée
+  (RECONCILE_BASE_DELAY doublé à chaque fois, plafonné à RECONCILE_MAX_DELAY).
+
+``backlog()`` mesure le retard (commandes à traiter, âge de la plus ancienne)
+et met à jour les métriques Prometheus (exams.metrics).
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from . import fulfillment, metrics, order_states, outbound
+
+logger = logging.getLogger(__name__)
+
+CHECK_DEADLINE = 30  # s par commande, essais compris
+
+# Statuts CinetPay -> statut de commande (absent : encore en attente)
+CINETPAY_STATUSES = {'ACCEPTED': 'PAID', 'REFUSED': 'CANCELLED', 'CANCELED': 'CANCELLED', 'CANCELLED': 'CANCELLED'}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _referenced():
+    return Q(stripe_session_id__isnull=False) | Q(transaction_id__isnull=False)
+
+
+# --- Interrogation du prestataire ----------------------------------------------------
+
+def _check_cinetpay(transaction_id):
+    response = outbound.request('cinetpay', 'POST', settings.CINETPAY_CHECK_URL, json={
+        'apikey': settings.CINETPAY_API_KEY,
+        'site_id': settings.CINETPAY_SITE_ID,
+        'transaction_id': transaction_id,
+    })
+    data = response.json()
+    status = ((data.get('data') or {}).get('status') or '').upper()
+    return CINETPAY_STATUSES.get(status)
+
+
+def _check_stripe(session_id):
+    outbound.stripe_ready()
+    session = outbound.call('stripe', lambda timeout: stripe.checkout.Session.retrieve(session_id))
+    if session.get('status') == 'complete' and session.get('payment_status') in ('paid', 'no_payment_required'):
+        return 'PAID'
+    if session.get('status') == 'expired':
+        return 'CANCELLED'
+    return None
+
+
+def check_status(order):
+    """
+    Statut de la commande chez le prestataire : 'PAID', 'CANCELLED' ou None (en attente).
+    ``order`` : dict {pk, stripe_session_id, transaction_id}.
+    """
+    with outbound.deadline(CHECK_DEADLINE):
+        if order['stripe_session_id']:
+            return _check_stripe(order['stripe_session_id'])
+        return _check_cinetpay(order['transaction_id'])
+
+
+def _safe_check(order):
+    try:
+        return order['pk'], check_status(order), None
+    except Exception as e:
+        logger.warning("Réconciliation de la commande #%s impossible : %s", order['pk'], e)
+        return order['pk'], None, e
+
+
+# --- Passe de réconciliation ---------------------------------------------------------
+
+def _due(now):
+    from .models import Order
+
+    min_age = timedelta(seconds=_setting('RECONCILE_MIN_AGE', 600))
+    return (
+        Order.objects.filter(status='PENDING', created_at__lte=now - min_age)
+        .filter(_referenced())
+        .filter(Q(reconcile_after__isnull=True) | Q(reconcile_after__lte=now))
+    )
+
+
+def _apply(batch, results):
+    """Transitions + livraison pour les réponses définitives, report pour les autres."""
+    from .models import Order
+
+    paid_ids = [pk for pk, status, _ in results if status == 'PAID']
+    cancelled_ids = [pk for pk, status, _ in results if status == 'CANCELLED']
+    now = timezone.now()
+    base = _setting('RECONCILE_BASE_DELAY', 300)
+    cap = _setting('RECONCILE_MAX_DELAY', 6 * 3600)
+    orders = {order['pk']: order for order in batch}
+    postponed = [
+        Order(
+            pk=pk,
+            reconcile_attempts=orders[pk]['reconcile_attempts'] + 1,
+            reconcile_after=now + timedelta(seconds=min(base * 2 ** min(orders[pk]['reconcile_attempts'], 16), cap)),
+        )
+        for pk, status, _ in results if status is None
+    ]
+    with transaction.atomic():
+        paid = order_states.transition_many(paid_ids, 'PAID')
+        cancelled = order_states.transition_many(cancelled_ids, 'CANCELLED')
+        if postponed:
+            Order.objects.bulk_update(postponed, ['reconcile_attempts', 'reconcile_after'])
+        if paid:
+            fulfillment.fulfill_orders(paid)
+    return paid, cancelled
+
+
+def reconcile(batch_size=None, concurrency=None, max_batches=None):
+    """
+    Une passe sur les commandes à réconcilier.
+    Renvoie {checked, paid, cancelled, pending, errors}.
+    """
+    batch_size = batch_size or _setting('RECONCILE_BATCH_SIZE', 100)
+    concurrency = concurrency or _setting('RECONCILE_CONCURRENCY', 4)
+    stats = {'checked': 0, 'paid': 0, 'cancelled': 0, 'pending': 0, 'errors': 0}
+    now = timezone.now()
+    last_id = 0
+    batches = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reconcile') as executor:
+        while max_batches is None or batches < max_batches:
+            batches += 1
+            batch = list(
+                _due(now).filter(pk__gt=last_id).order_by('pk')
+                .values('pk', 'stripe_session_id', 'transaction_id', 'reconcile_attempts')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['pk']
+
+            # appels HTTP uniquement sur le pool (aucun accès à la base)
+            results = list(executor.map(_safe_check, batch))
+            paid, cancelled = _apply(batch, results)
+
+            errors = sum(1 for _, _, error in results if error)
+            pending = sum(1 for _, status, error in results if status is None and not error)
+            stats['checked'] += len(batch)
+            stats['paid'] += len(paid)
+            stats['cancelled'] += len(cancelled)
+            stats['pending'] += pending
+            stats['errors'] += errors
+            metrics.RECONCILE_RESULTS.labels('paid').inc(len(paid))
+            metrics.RECONCILE_RESULTS.labels('cancelled').inc(len(cancelled))
+            metrics.RECONCILE_RESULTS.labels('pending').inc(pending)
+            metrics.RECONCILE_RESULTS.labels('error').inc(errors)
+            if len(batch) < batch_size:
+                break
+
+    metrics.RECONCILE_LAST_RUN.set(time.time())
+    return stats
+
+
+# --- Retard ----------------------------------------------------------------------------
+
+def backlog():
+    """
+    Retard de réconciliation (une requête) :
+    {pending, due, waiting, unreferenced, lag_seconds}. Met à jour les métriques.
+    """
+    from .models import Order
+
+    now = timezone.now()
+    min_age = timedelta(seconds=_setting('RECONCILE_MIN_AGE', 600))
+    referenced = _referenced()
+    due = referenced & Q(created_at__lte=now - min_age) & (Q(reconcile_after__isnull=True) | Q(reconcile_after__lte=now))
+    data = Order.objects.filter(status='PENDING').aggregate(
+        pending=Count('pk'),
+        due=Count('pk', filter=due),
+        unreferenced=Count('pk', filter=~referenced),
+        oldest=Min('created_at', filter=referenced),
+    )
+    oldest = data.pop('oldest')
+    data['waiting'] = data['pending'] - data['due'] - data['unreferenced']
+    data['lag_seconds'] = int((now - oldest).total_seconds()) if oldest else 0
+
+    for state in ('due', 'waiting', 'unreferenced'):
+        metrics.RECONCILE_BACKLOG.labels(state).set(data[state])
+    metrics.RECONCILE_LAG.set(data['lag_seconds'])
+    return data
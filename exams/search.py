@@ -0,0 +1,285 @@
+"""
+Index de recherche en mémoire pour les examens et les packs.
+
+Construit à partir du snapshot du catalogue (voir ``exams.catalog``), il remplace
+le ``name__istartswith`` exécuté en base à chaque frappe :
+
+- normalisation : minuscules, accents supprimés, pluriels simples ("maths" -> "math") ;
+- correspondance exacte, par préfixe et tolérante aux fautes (distance 1,
+  candidats générés par suppressions à la manière de SymSpell) ;
+- classement par score pondéré (nom d'examen / matière > type de pack) ;
+- mise à jour incrémentale : quand la version du catalogue change, seuls les
+  documents ajoutés, modifiés ou supprimés sont réindexés.
+
+Exemple : "bac d maths" -> pack "BAC D Matière seule — Mathématiques".
+"""
+import bisect
+import re
+import threading
+import unicodedata
+
+from . import catalog
+
+STOP_WORDS = {'de', 'des', 'du', 'la', 'le', 'les', 'et', 'en', 'pour', 'avec'}
+
+EXACT, PREFIX, FUZZY = 3, 2, 1
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    """Minuscules sans accents : 'Mathématiques' -> 'mathematiques'."""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def _stem(token):
+    if len(token) > 3 and token.endswith('s'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [
+        _stem(t) for t in _TOKEN_RE.findall(normalize(text))
+        if t not in STOP_WORDS
+    ]
+
+
+def _deletes(token):
+    """Variantes à une suppression près (le token lui-même inclus)."""
+    variants = {token}
+    if len(token) > 1:
+        variants.update(token[:i] + token[i + 1:] for i in range(len(token)))
+    return variants
+
+
+def _within_one_edit(a, b):
+    """Distance de Damerau-Levenshtein <= 1 (insertion, suppression, substitution, transposition)."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diffs = [i for i in range(la) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return (
+            len(diffs) == 2 and diffs[1] == diffs[0] + 1
+            and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+        )
+    if la > lb:
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+def _exam_document(exam):
+    weights = {}
+    for t in tokenize(exam['name']):
+        weights[t] = 2
+    for t in tokenize(exam['level']):
+        weights.setdefault(t, 1)
+    return {
+        'kind': 'exam',
+        'id': exam['id'],
+        'label': exam['name'],
+        'exam_id': exam['id'],
+        'exam_slug': exam['slug'],
+        'price': None,
+    }, weights
+
+
+def _pack_document(exam, pack):
+    weights = {}
+    for t in tokenize(exam['name']):
+        weights[t] = 2
+    subject = pack['subject']
+    if pack['pack_type'] == 'SINGLE' and subject:
+        for t in tokenize(f"{subject['name']} {subject['code']}"):
+            weights[t] = 2
+    for t in tokenize(pack['get_pack_type_display']):
+        weights.setdefault(t, 1)
+    return {
+        'kind': 'pack',
+        'id': pack['id'],
+        'label': pack['label'],
+        'exam_id': exam['id'],
+        'exam_slug': exam['slug'],
+        'price': pack['price'],
+    }, weights
+
+
+def _documents(snapshot):
+    docs = {}
+    for exam in snapshot['exams']:
+        meta, weights = _exam_document(exam)
+        docs[('exam', exam['id'])] = (meta, weights)
+        for pack in exam['packs']:
+            meta, weights = _pack_document(exam, pack)
+            docs[('pack', pack['id'])] = (meta, weights)
+    return docs
+
+
+class SearchIndex:
+    """Index inversé token -> documents, avec liste triée (préfixes) et table de suppressions (fautes)."""
+
+    def __init__(self):
+        self.version = None
+        self.docs = {}          # clé -> (meta, {token: poids})
+        self.postings = {}      # token -> set(clés)
+        self.sorted_tokens = []
+        self.deletes = {}       # variante -> set(tokens)
+        self.exam_order = {}    # exam_id -> rang dans le catalogue
+
+    # --- Mise à jour -----------------------------------------------------------
+
+    def _add_token(self, token, key):
+        keys = self.postings.get(token)
+        if keys is None:
+            keys = self.postings[token] = set()
+            bisect.insort(self.sorted_tokens, token)
+            for variant in _deletes(token):
+                self.deletes.setdefault(variant, set()).add(token)
+        keys.add(key)
+
+    def _remove_token(self, token, key):
+        keys = self.postings.get(token)
+        if keys is None:
+            return
+        keys.discard(key)
+        if keys:
+            return
+        del self.postings[token]
+        idx = bisect.bisect_left(self.sorted_tokens, token)
+        if idx < len(self.sorted_tokens) and self.sorted_tokens[idx] == token:
+            del self.sorted_tokens[idx]
+        for variant in _deletes(token):
+            tokens = self.deletes.get(variant)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.deletes[variant]
+
+    def add(self, key, meta, weights):
+        self.docs[key] = (meta, weights)
+        for token in weights:
+            self._add_token(token, key)
+
+    def remove(self, key):
+        _, weights = self.docs.pop(key)
+        for token in weights:
+            self._remove_token(token, key)
+
+    def sync(self, snapshot):
+        """Aligne l'index sur un snapshot ; renvoie le nombre de documents réindexés."""
+        fresh = _documents(snapshot)
+        changed = 0
+        for key in [k for k in self.docs if k not in fresh]:
+            self.remove(key)
+            changed += 1
+        for key, (meta, weights) in fresh.items():
+            current = self.docs.get(key)
+            if current is not None and current == (meta, weights):
+                continue
+            if current is not None:
+                self.remove(key)
+            self.add(key, meta, weights)
+            changed += 1
+        self.exam_order = {e['id']: i for i, e in enumerate(snapshot['exams'])}
+        self.version = snapshot['version']
+        return changed
+
+    # --- Recherche ---------------------------------------------------------------
+
+    def _candidates(self, term, allow_prefix):
+        """Tokens de l'index correspondant à `term`, avec leur qualité de correspondance."""
+        found = {}
+        if term in self.postings:
+            found[term] = EXACT
+        if allow_prefix:
+            idx = bisect.bisect_left(self.sorted_tokens, term)
+            while idx < len(self.sorted_tokens) and self.sorted_tokens[idx].startswith(term):
+                found.setdefault(self.sorted_tokens[idx], PREFIX)
+                idx += 1
+        if len(term) >= 3:
+            for variant in _deletes(term):
+                for token in self.deletes.get(variant, ()):
+                    if token not in found and _within_one_edit(term, token):
+                        found[token] = FUZZY
+        return found
+
+    def search(self, query, limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        totals = None
+        for term in terms:
+            # Une lettre isolée ("bac d") est un mot exact, sauf en tout début de frappe
+            allow_prefix = len(term) >= 2 or len(terms) == 1
+            scores = {}
+            for token, quality in self._candidates(term, allow_prefix).items():
+                for key in self.postings[token]:
+                    score = quality * self.docs[key][1][token]
+                    if score > scores.get(key, 0):
+                        scores[key] = score
+            if totals is None:
+                totals = scores
+            else:
+                totals = {k: totals[k] + s for k, s in scores.items() if k in totals}
+            if not totals:
+                return []
+
+        ranked = sorted(
+            totals.items(),
+            key=lambda kv: (
+                -kv[1],
+                kv[0][0] != 'exam',
+                self.exam_order.get(self.docs[kv[0]][0]['exam_id'], 0),
+                kv[0][1],
+            ),
+        )
+        results = []
+        for key, score in ranked[:limit]:
+            meta = dict(self.docs[key][0])
+            meta['score'] = score
+            results.append(meta)
+        return results
+
+
+_index = SearchIndex()
+_lock = threading.Lock()
+
+
+def search(query, limit=20):
+    """
+    Résultats classés (examens et packs) pour `query`.
+    L'index est resynchronisé au besoin avec la version courante du catalogue ;
+    le verrou protège la mise à jour incrémentale des lectures concurrentes.
+    """
+    snapshot = catalog.get_snapshot()
+    with _lock:
+        if _index.version != snapshot['version']:
+            _index.sync(snapshot)
+        return _index.search(query, limit=limit)
+
+
+def matching_exams(query):
+    """
+    Examens du snapshot correspondant à `query`, directement ou via un de leurs
+    packs, dans l'ordre du meilleur score (pour le fragment HTML des cartes).
+    """
+    snapshot = catalog.get_snapshot()
+    by_id = {e['id']: e for e in snapshot['exams']}
+    exams = []
+    seen = set()
+    for hit in search(query, limit=None):
+        exam_id = hit['exam_id']
+        if exam_id not in seen and exam_id in by_id:
+            seen.add(exam_id)
+            exams.append(by_id[exam_id])
+    return exams
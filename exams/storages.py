@@ -10,3 +10,63 @@ class ProtectedStorage(FileSystemStorage):
     def __init__(self, *args, **kwargs):
         location = getattr(settings, "PROTECTED_MEDIA_ROOT", settings.BASE_DIR / "protected_media")
         super().__init__(location=location, base_url=None)  # base_url=None = pas d'URL publique
+
+
+class ZipManifestMixin:
+    """
+    Écrit le manifeste des ZIP enregistrés (``<nom>.manifest.json``) et le
+    supprime avec le fichier : voir exams.zip_manifest.
+    """
+    def _save(self, name, content):
+        from . import zip_manifest
+
+        name = super()._save(name, content)
+        if name.lower().endswith('.zip'):
+            zip_manifest.save(self, name, getattr(content, 'zip_manifest', None))
+        return name
+
+    def delete(self, name):
+        from . import zip_manifest
+
+        super().delete(name)
+        zip_manifest.discard(self, name)
+
+
+class ZipManifestStorage(ZipManifestMixin, FileSystemStorage):
+    """Stockage public (MEDIA_ROOT) des extraits et pièces jointes, ZIP indexés."""
+
+
+class BlobStorage(ZipManifestMixin, ProtectedStorage):
+    """
+    Stockage protégé adressé par contenu (ZIP des packs) : un fichier est rangé
+    sous blobs/<ab>/<sha256>.<ext>, le nom proposé n'est pas gardé. Un contenu
+    déjà présent n'est pas réécrit : plusieurs packs partagent le même blob.
+
+    Les blobs sont partagés : ``delete()`` ne les touche pas, ils sont
+    supprimés par gc_pack_blobs (exams.blobs) quand plus aucun pack ne les
+    référence. Les fichiers d'avant (packs/<nom>-<uuid>.zip) se suppriment
+    comme avant.
+    """
+    def _save(self, name, content):
+        from . import blobs
+
+        digest = blobs.content_digest(content)
+        blob_name = blobs.blob_name(digest, os.path.splitext(name)[1])
+        if self.exists(blob_name):
+            blobs.touch(blob_name)  # réutilisé : pas de suppression par gc_pack_blobs pendant l'envoi
+            return blob_name
+        saved = super()._save(blob_name, content)
+        if saved != blob_name:
+            # écrit en même temps par une autre requête : même contenu, on garde le sien
+            super().delete(saved)
+        return blob_name
+
+    def delete(self, name):
+        from . import blobs
+
+        if not blobs.is_blob(name):
+            super().delete(name)
+
+    def purge(self, name):
+        """Supprime vraiment le fichier (ramasse-miettes des blobs)."""
+        super().delete(name)
@@ -4,11 +4,14 @@ from . import views
 from .views_protect import index_protected
 from . import views_account
 from . import views_cart
+from . import views_api
+from . import views_bulk
 
 app_name = 'exams'
 
 urlpatterns = [
     path('', index_protected, name='index'),
+    path('recherche/', views.search_json, name='search'),
 
     path('examens/<slug:slug>/', views.exam_detail, name='exam_detail'),
     path('order/create/', views.create_order, name='create_order'),
@@ -23,16 +26,25 @@ urlpatterns = [
     path('extraits/', views.free_sample_page, name='free_sample'),
     path('extraits/<int:pk>/telecharger/', views.free_sample_download, name='free_sample_download'),
 
+    # API JSON du catalogue (lecture seule, client mobile)
+    path('api/v1/version/', views_api.catalog_version, name='api_catalog_version'),
+    path('api/v1/catalog/', views_api.catalog_full, name='api_catalog'),
+    path('api/v1/<str:resource>/', views_api.resource_list, name='api_resource_list'),
+
     # Compte / Profil
     path('me/', views_account.my_profile, name='my_profile'),
     path('me/delete/', views_account.delete_account, name='delete_account'),
+    path('me/commandes/', views_account.order_history_list, name='order_history'),
+    path('me/commandes/api/', views_account.order_history_api, name='order_history_api'),
 
     # Panier
     path('panier/', views_cart.cart_detail, name='cart_detail'),
     path('panier/ajouter/', views_cart.add_to_cart, name='add_to_cart'),
     path('panier/ajouter-plusieurs/', views_cart.add_multiple_to_cart, name='add_multiple_to_cart'),
+    path('panier/operations/', views_cart.cart_batch, name='cart_batch'),
     path('panier/supprimer/<int:item_id>/', views_cart.remove_from_cart, name='remove_from_cart'),
     path('panier/valider/', views_cart.cart_checkout, name='cart_checkout'),
+    path('paiement/<int:order_id>/statut/', views_cart.checkout_status, name='checkout_status'),
     
     # Paiement Stripe
     path('paiement/success/', views_cart.payment_success, name='payment_success'),
@@ -46,6 +58,13 @@ urlpatterns = [
     path('notifications/<int:pk>/supprimer/', views_account.notifications_delete, name='notifications_delete'),
     path('notifications/lire-tout/', views_account.notifications_mark_all_read, name='notifications_mark_all_read'),
     path('notifications/supprimer-tout/', views_account.notifications_delete_all, name='notifications_delete_all'),
+    path('notifications/api/', views_account.notifications_api, name='notifications_api'),
+    path('notifications/api/lire/', views_account.notifications_api_mark_read, name='notifications_api_mark_read'),
+    path('notifications/api/supprimer/', views_account.notifications_api_delete, name='notifications_api_delete'),
+
+    # Commandes groupées (établissements)
+    path('commandes-groupees/api/', views_bulk.bulk_order_create_api, name='bulk_order_create_api'),
+    path('commandes-groupees/<int:order_id>/liens.csv', views_bulk.bulk_order_links, name='bulk_order_links'),
 
     # Simulateur de paiement (test sans argent)
     path('paiement/simuler/', views_cart.payment_simulator, name='payment_simulator'),
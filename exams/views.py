@@ -2,27 +2,33 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse, HttpResponseBadRequest, FileResponse, Http404
 from django.urls import reverse
 from django.conf import settings
-from django.utils import timezone
+from django.db import transaction
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
 from .models import Exam, Pack, Order, OrderItem, Payment, DownloadToken, FreeSample
 from .forms import PaymentForm
-from .price_rules import compute_price
-from datetime import timedelta
+from .price_rules import price_for_pack
+from . import catalog, download_ledger, file_delivery, fulfillment, order_states, search, webhook_inbox
+from .http_cache import catalog_conditional
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponseBadRequest, FileResponse, Http404, HttpResponse
 from django.template.loader import render_to_string
+from django.utils.text import slugify
 
 import uuid
 import os
+import time
 
+@catalog_conditional
 def index(request):
     q = (request.GET.get('q') or "").strip()
-    exams = Exam.objects.filter(active=True)
+    # Lecture depuis le snapshot du catalogue (aucune requête SQL)
     if q:
-        # Recherche intuitive: commence par (comme demandé)
-        exams = exams.filter(name__istartswith=q)
+        # Index en mémoire : sans accents, préfixes et fautes de frappe tolérés
+        exams = search.matching_exams(q)
+    else:
+        exams = catalog.active_exams()
 
     # Si requête AJAX: on renvoie seulement le fragment HTML des cartes
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -31,12 +37,30 @@ def index(request):
 
     return render(request, 'index.html', {'exams': exams, 'q': q, "active_menu": "exams"})
 
+@login_required
+def search_json(request):
+    """
+    Même recherche que le fragment HTML de l'index, en JSON :
+    examens et packs classés par pertinence.
+    """
+    q = (request.GET.get('q') or "").strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+    except (TypeError, ValueError):
+        limit = 20
+    results = search.search(q, limit=limit) if q else []
+    for r in results:
+        r['url'] = reverse('exams:exam_detail', args=[r['exam_slug']])
+    return JsonResponse({'ok': True, 'q': q, 'results': results})
+
+@catalog_conditional
 def exam_detail(request, slug):
-    exam = get_object_or_404(Exam, slug=slug, active=True)
-    packs = Pack.objects.filter(exam=exam, is_active=True)
+    exam = catalog.get_exam(slug)
+    if exam is None:
+        raise Http404("Examen introuvable.")
     ctx = {
         "exam": exam,
-        "packs": packs,
+        "packs": exam['packs'],
         "active_menu": "packs",
     }
     return render(request, 'exam_detail.html', ctx)
@@ -56,7 +80,7 @@ def create_order(request):
 
     pack = get_object_or_404(Pack, pk=pack_id, is_active=True)
 
-    price = compute_price(pack.exam, pack.pack_type, pack.subject.code if pack.subject else None)
+    price = price_for_pack(pack) or pack.price
 
     order = Order.objects.create(
         user=request.user if request.user.is_authenticated else None,
@@ -79,116 +103,121 @@ def create_order(request):
     return JsonResponse({'ok': True, 'redirect': confirm_url})
 
 def order_confirm(request, order_id):
-    from datetime import timedelta
     order = get_object_or_404(Order, pk=order_id)
 
     if request.method == 'POST':
+        # bouton « simuler le paiement » : jamais hors du mode simulateur
+        if not webhook_inbox.simulator_enabled():
+            messages.error(request, "La confirmation manuelle du paiement n'est pas disponible.")
+            return redirect('exams:order_confirm', order_id=order.id)
         payment = get_object_or_404(Payment, order=order)
-        payment.status = 'SUCCESS'
-        payment.save()
-        order.status = 'PAID'
-        order.save()
-
-        for item in order.items.all():
-            expires = timezone.now() + timedelta(hours=settings.DOWNLOAD_TOKEN_TTL_HOURS)
-            DownloadToken.objects.update_or_create(
-                item=item,
-                defaults={'expires_at': expires, 'remaining_downloads': settings.DOWNLOAD_MAX_TIMES}
-            )
+        with transaction.atomic():
+            order_states.set_payment_status([payment.reference], 'SUCCESS')
+            try:
+                order_states.transition(order, 'PAID')
+            except order_states.InvalidTransition:
+                pass  # déjà dans un état final
+            # idempotent : sans effet si le webhook a déjà livré
+            fulfillment.fulfill_order(order)
         messages.success(request, 'Paiement confirmé. Vos téléchargements sont prêts.')
         return redirect('exams:order_confirm', order_id=order.id)
 
     tokens = []
     if order.status == 'PAID':
-        for item in order.items.select_related('pack'):
-            try:
-                t = DownloadToken.objects.get(item=item)
-                tokens.append(t)
-            except DownloadToken.DoesNotExist:
-                pass
+        tokens = list(
+            DownloadToken.objects.filter(item__order=order, seat=0)
+            .select_related('item__pack__exam', 'item__pack__subject')
+            .order_by('item_id')
+        )
 
     return render(request, 'order_confirm.html', {'order': order, 'tokens': tokens})
 
 @csrf_exempt
 def payment_webhook(request):
+    """Webhook du simulateur (PAYMENT_PROVIDER = 'SIMULATOR') : enregistré dans l'inbox, traité par process_webhooks."""
+    if not webhook_inbox.simulator_enabled():
+        raise Http404("Simulateur de paiement désactivé.")
     if request.method != 'POST':
         return HttpResponseBadRequest('Méthode invalide')
-    ref = request.POST.get('reference')
-    status = request.POST.get('status')
     try:
-        payment = Payment.objects.get(reference=ref)
-    except Payment.DoesNotExist:
-        return JsonResponse({'ok': False, 'error': 'payment not found'}, status=404)
-
-    payment.status = status
-    payment.raw_payload = dict(request.POST)
-    payment.save()
-
-    if status == 'SUCCESS':
-        order = payment.order
-        order.status = 'PAID'
-        order.save()
-        for item in order.items.all():
-            expires = timezone.now() + timedelta(hours=settings.DOWNLOAD_TOKEN_TTL_HOURS)
-            DownloadToken.objects.update_or_create(
-                item=item,
-                defaults={'expires_at': expires, 'remaining_downloads': settings.DOWNLOAD_MAX_TIMES}
-            )
+        reference, payload = webhook_inbox.parse_simulator(request)
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    webhook_inbox.record('SIMULATOR', reference, payload)
     return JsonResponse({'ok': True})
 
+def _pack_filename(pack):
+    """Nom proposé au téléchargement : le fichier stocké porte l'empreinte du contenu (exams.blobs)."""
+    return f"{slugify(str(pack)) or 'pack'}.zip"
+
 @login_required
 def download_file(request, token):
     """
     Téléchargement client via token :
     - token valide et non expiré
-    - l'utilisateur connecté doit posséder la commande (sauf staff)
-    - envoi du ZIP en pièce jointe
+    - l'utilisateur connecté doit posséder la commande (sauf staff, et sauf
+      commande groupée : ses liens sont distribués aux élèves)
+    - envoi du ZIP en pièce jointe (par le proxy si FILE_OFFLOAD, cf. exams.file_delivery)
+    - un téléchargement décompté et interrompu peut être repris (Range +
+      If-Range, à partir d'un octet déjà reçu) pendant DOWNLOAD_RESUME_HOURS,
+      DOWNLOAD_MAX_RESUMES fois, sans être décompté de nouveau ; HEAD, 304,
+      412 et 416 (rien d'envoyé) non plus
+    - décompte par UPDATE conditionnel (DownloadToken.consume) ; chaque
+      tentative va au registre des téléchargements (exams.download_ledger)
     """
+    started = time.monotonic()
     t = get_object_or_404(
-        DownloadToken.objects.select_related('item__order', 'item__pack'),
+        DownloadToken.objects.select_related('item__order', 'item__pack__exam', 'item__pack__subject'),
         token=token
     )
-    if not t.is_valid():
-        messages.error(request, 'Lien de téléchargement expiré ou nombre de téléchargements atteint.')
-        return redirect('exams:index')
-
     order = t.item.order
     owner = getattr(order, 'user', None)
-    if owner and (request.user != owner) and (not request.user.is_staff):
+    if owner and not order.bulk and (request.user != owner) and (not request.user.is_staff):
         messages.error(request, "Ce lien ne vous appartient pas.")
-        return redirect('exams:index')
+        return download_ledger.track(request, redirect('exams:index'), t, 'FORBIDDEN', started)
 
     pack = t.item.pack
     if not pack.file:
         messages.error(request, "Aucun fichier n'est associé à ce pack. Contactez l'administrateur.")
-        return redirect('exams:index')
+        return download_ledger.track(request, redirect('exams:index'), t, 'MISSING', started)
 
     file_path = pack.file.path
     if not os.path.exists(file_path):
         messages.error(request, "Le fichier demandé est introuvable. Contactez l'administrateur.")
-        return redirect('exams:index')
+        return download_ledger.track(request, redirect('exams:index'), t, 'MISSING', started)
+
+    # réponse décidée avant le décompte : 304, 412 et 416 n'envoient pas le fichier
+    status, ranges = file_delivery.plan(request, file_path)
+    resume_at = file_delivery.resume_point(request, status, ranges)
+    if status not in (200, 206):
+        outcome = 'UNSENT' if t.is_valid() or t.can_resume() else 'REFUSED'
+    elif request.method == 'HEAD':
+        outcome = 'HEAD' if t.is_valid() or t.can_resume() else 'REFUSED'
+    elif resume_at is not None and t.resume(resume_at):
+        outcome = 'RESUMED'
+    else:
+        # les reprises qui suivent (If-Range, octets déjà reçus) sont gratuites
+        outcome = 'COUNTED' if t.consume() else 'REFUSED'
+    if outcome == 'REFUSED':
+        messages.error(request, 'Lien de téléchargement expiré ou nombre de téléchargements atteint.')
+        return download_ledger.track(request, redirect('exams:index'), t, outcome, started)
 
-    # Décrémenter le compteur
-    t.remaining_downloads -= 1
-    t.save(update_fields=['remaining_downloads'])
-
-    resp = FileResponse(open(file_path, 'rb'), as_attachment=True, filename=os.path.basename(file_path))
-    resp['Content-Type'] = 'application/zip'
-    resp['X-Content-Type-Options'] = 'nosniff'
-    try:
-        resp['Content-Length'] = os.path.getsize(file_path)
-    except Exception:
-        pass
-    return resp
+    response = file_delivery.serve(request, file_path, filename=_pack_filename(pack))
+    # octet de départ de l'envoi, pour fixer le point de reprise s'il est interrompu
+    offset = None
+    if outcome in ('COUNTED', 'RESUMED') and (status == 200 or len(ranges) == 1):
+        offset = ranges[0][0] if status == 206 else 0
+    return download_ledger.track(request, response, t, outcome, started, offset=offset)
 
 # --- Extraits (libres d’accès) ----------------------------------------------
 
+@catalog_conditional
 def free_sample_page(request):
     """
     Affiche la page des extraits.
-    On prend le plus récent objet actif, s'il existe.
+    On prend le plus récent objet actif, s'il existe (lu depuis le snapshot du catalogue).
     """
-    sample = FreeSample.objects.filter(is_active=True).order_by('-uploaded_at').first()
+    sample = catalog.free_sample()
     ctx = {
         'sample': sample,
         'active_menu': 'free_sample',
@@ -207,31 +236,17 @@ def free_sample_download(request, pk):
     if not os.path.exists(file_path):
         raise Http404("Fichier introuvable.")
 
-    resp = FileResponse(open(file_path, 'rb'), as_attachment=True, filename=os.path.basename(file_path))
-    resp['Content-Type'] = 'application/zip'
-    resp['X-Content-Type-Options'] = 'nosniff'
-    try:
-        resp['Content-Length'] = os.path.getsize(file_path)
-    except Exception:
-        pass
-    return resp
+    return file_delivery.serve(request, file_path)
 
 @staff_member_required
 def admin_pack_download(request, pk):
     """
     Téléchargement du ZIP côté back-office (staff uniquement).
     """
-    pack = get_object_or_404(Pack, pk=pk)
+    pack = get_object_or_404(Pack.objects.select_related('exam', 'subject'), pk=pk)
     if not pack.file:
         raise Http404("Aucun fichier pour ce pack.")
     file_path = pack.file.path
     if not os.path.exists(file_path):
         raise Http404("Fichier introuvable.")
-    resp = FileResponse(open(file_path, 'rb'), as_attachment=True, filename=os.path.basename(file_path))
-    resp['Content-Type'] = 'application/zip'
-    resp['X-Content-Type-Options'] = 'nosniff'
-    try:
-        resp['Content-Length'] = os.path.getsize(file_path)
-    except Exception:
-        pass
-    return resp
+    return file_delivery.serve(request, file_path, filename=_pack_filename(pack))
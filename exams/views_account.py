@@ -7,9 +7,10 @@ from django.http import JsonResponse
 from django.conf import settings
 from .forms import UserUpdateForm, ProfileUpdateForm
 from .models import Order, Notification
+from . import notifications, order_history, outbound, purchase_summary
 from pathlib import Path
 from django.views.decorators.csrf import csrf_exempt 
-from openai import OpenAI
+from django.views.decorators.cache import never_cache
 
 import os
 import json
@@ -184,17 +185,25 @@ def chatbot_ask(request):
     if not openai_api_key:
         return JsonResponse({'error': 'openai_api_key_missing'}, status=500)
 
-    client = OpenAI(api_key=openai_api_key)
+    client = outbound.openai_client(openai_api_key)
     model = getattr(settings, "OPENAI_MODEL", "gpt-4o") or "gpt-4o"
 
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.2,
-            max_tokens=1200,
-        )
+        # échéance de la requête : essais compris, le worker n'attend pas plus longtemps
+        with outbound.deadline(getattr(settings, "CHATBOT_DEADLINE", 45)):
+            response = outbound.call('openai', lambda timeout: client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=1200,
+                timeout=timeout,
+            ))
         assistant_text = response.choices[0].message.content
+    except outbound.OutboundError:
+        return JsonResponse({
+            'error': 'assistant_unavailable',
+            'detail': "L'assistant est momentanément indisponible. Réessayez dans quelques instants.",
+        }, status=503, headers={'Retry-After': '30'})
     except Exception as e:
         return JsonResponse({'error': 'openai_error', 'detail': str(e)}, status=500)
 
@@ -221,32 +230,161 @@ def chatbot_clear(request):
 
 @login_required
 def notifications_list(request):
-    notifs = Notification.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'notifications.html', {'notifications': notifs})
+    """Notifications paginées par curseur (?cursor=), plus récentes d'abord."""
+    try:
+        notifs, next_cursor = notifications.page(request.user, cursor=request.GET.get('cursor'))
+    except ValueError:
+        return redirect('exams:notifications_list')
+    return render(request, 'notifications.html', {
+        'notifications': notifs,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+    })
+
+@login_required
+def order_history_list(request):
+    """Mes commandes, paginées par curseur (?cursor=), plus récentes d'abord."""
+    try:
+        orders, next_cursor = order_history.page(request.user, cursor=request.GET.get('cursor'))
+    except ValueError:
+        return redirect('exams:order_history')
+    return render(request, 'account/orders.html', {
+        'orders': orders,
+        'summary': purchase_summary.get_summary(request.user),
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'active_menu': 'orders',
+    })
+
+@login_required
+@require_GET
+@never_cache
+def order_history_api(request):
+    """GET : page de commandes (?cursor=, ?limit=) + résumé des achats."""
+    try:
+        limit = int(request.GET.get('limit', order_history.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = order_history.DEFAULT_PAGE_SIZE
+    try:
+        orders, next_cursor = order_history.page(request.user, cursor=request.GET.get('cursor'), limit=limit)
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Curseur invalide.'}, status=400)
+    return JsonResponse({
+        'ok': True,
+        'results': [order_history.as_json(o) for o in orders],
+        'next': next_cursor,
+        'summary': purchase_summary.as_json(purchase_summary.get_summary(request.user)),
+    })
 
 @login_required
 def notifications_mark_read(request, pk):
-    n = get_object_or_404(Notification, pk=pk, user=request.user)
-    n.read = True
-    n.save(update_fields=['read'])
+    get_object_or_404(Notification, pk=pk, user=request.user)
+    notifications.mark_read(request.user, ids=[pk])
     return redirect('exams:notifications_list')
 
 @login_required
 def notifications_delete(request, pk):
     n = get_object_or_404(Notification, pk=pk, user=request.user)
-    n.delete()
+    notifications.delete_one(n)
     return redirect('exams:notifications_list')
 
 @login_required
 def notifications_mark_all_read(request):
     """Marquer toutes les notifications de l'utilisateur comme lues."""
-    Notification.objects.filter(user=request.user, read=False).update(read=True)
+    notifications.mark_read(request.user)
     messages.success(request, "Toutes les notifications ont été marquées comme lues.")
     return redirect('exams:notifications_list')
 
 @login_required
 def notifications_delete_all(request):
     """Supprimer toutes les notifications de l'utilisateur."""
-    Notification.objects.filter(user=request.user).delete()
+    notifications.delete(request.user)
     messages.success(request, "Toutes vos notifications ont été supprimées.")
     return redirect('exams:notifications_list')
+
+
+# --- API JSON des notifications ----------------------------------------------
+
+def _int_or_none(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def _bulk_selection(request):
+    """
+    Lit {"ids": [...]} et/ou {"up_to": id} / {"from_id": id} du corps JSON.
+    Renvoie (kwargs, erreur).
+    """
+    try:
+        data = json.loads(request.body.decode('utf-8') or '{}')
+    except (ValueError, UnicodeDecodeError):
+        return None, 'JSON invalide.'
+    if not isinstance(data, dict):
+        return None, 'JSON invalide.'
+    try:
+        ids = data.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list):
+                return None, '"ids" doit être une liste.'
+            ids = [int(i) for i in ids]
+        selection = {
+            'ids': ids,
+            'up_to': _int_or_none(data.get('up_to')),
+            'from_id': _int_or_none(data.get('from_id')),
+        }
+    except (TypeError, ValueError):
+        return None, 'Identifiants invalides.'
+    if all(v is None for v in selection.values()):
+        return None, 'Précisez "ids", "up_to" ou "from_id".'
+    return selection, None
+
+
+@login_required
+@require_GET
+@never_cache
+def notifications_api(request):
+    """GET : page de notifications (?cursor=, ?limit=, ?unread=1) + compteur."""
+    try:
+        limit = int(request.GET.get('limit', notifications.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = notifications.DEFAULT_PAGE_SIZE
+    try:
+        notifs, next_cursor = notifications.page(
+            request.user,
+            cursor=request.GET.get('cursor'),
+            limit=limit,
+            unread_only=request.GET.get('unread') in ('1', 'true'),
+        )
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Curseur invalide.'}, status=400)
+    return JsonResponse({
+        'ok': True,
+        'results': [notifications.as_json(n) for n in notifs],
+        'next': next_cursor,
+        'unread': notifications.unread_count(request.user),
+    })
+
+
+@login_required
+@require_POST
+def notifications_api_mark_read(request):
+    """POST {"ids": [...]} ou {"up_to": id} : marque comme lues en un UPDATE."""
+    selection, error = _bulk_selection(request)
+    if error:
+        return JsonResponse({'ok': False, 'error': error}, status=400)
+    if selection.pop('from_id') is not None:
+        return JsonResponse({'ok': False, 'error': '"from_id" non pris en charge ici.'}, status=400)
+    updated = notifications.mark_read(request.user, **selection)
+    return JsonResponse({'ok': True, 'updated': updated, 'unread': notifications.unread_count(request.user)})
+
+
+@login_required
+@require_POST
+def notifications_api_delete(request):
+    """POST {"ids": [...]} et/ou plage {"from_id": a, "up_to": b} : supprime en un DELETE."""
+    selection, error = _bulk_selection(request)
+    if error:
+        return JsonResponse({'ok': False, 'error': error}, status=400)
+    deleted = notifications.delete(request.user, **selection)
+    return JsonResponse({'ok': True, 'deleted': deleted, 'unread': notifications.unread_count(request.user)})
@@ -0,0 +1,216 @@
+"""
+API JSON en lecture seule du catalogue (v1), pensée pour le client mobile.
+
+Routes (sous /examens/) :
+- api/v1/version/          -> {"v": 12} : à interroger pour savoir s'il faut resynchroniser.
+- api/v1/catalog/          -> tout le catalogue en une seule réponse compacte.
+- api/v1/<ressource>/      -> exams | packs | subjects, paginés par curseur
+                              (?limit=, ?cursor=) avec sélection de champs (?fields=).
+
+Clés compactes (faciles à compresser en gzip) :
+  exams    : i=id, n=name, s=slug, l=level, lm=is_long_model (0/1), p=ids des packs
+  packs    : i=id, e=exam, t=pack_type, su=subject, y=years_range, pr=price, lb=label
+  subjects : i=id, n=name, c=code
+  enveloppe: v=version du catalogue, d=données, n=curseur suivant (null à la fin)
+
+Les réponses ne sont pas sérialisées à chaque requête : pour chaque version du
+catalogue, chaque enregistrement est encodé une fois en JSON (et une fois par
+sélection de champs demandée), puis les pages sont assemblées par concaténation
+d'octets. Un ETag fort basé sur la version permet des 304.
+"""
+import base64
+import bisect
+import hashlib
+import json
+import threading
+from functools import wraps
+
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
+
+from . import catalog
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+# nom public du champ -> clé compacte, par ressource
+FIELDS = {
+    'exams': {'id': 'i', 'name': 'n', 'slug': 's', 'level': 'l', 'is_long_model': 'lm', 'packs': 'p'},
+    'packs': {
+        'id': 'i', 'exam': 'e', 'pack_type': 't', 'subject': 'su',
+        'years_range': 'y', 'price': 'pr', 'label': 'lb',
+    },
+    'subjects': {'id': 'i', 'name': 'n', 'code': 'c'},
+}
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _compact_records(snapshot):
+    """Enregistrements compacts par ressource, triés par id (ordre des curseurs)."""
+    exams, packs = [], []
+    for exam in snapshot['exams']:
+        exams.append({
+            'i': exam['id'], 'n': exam['name'], 's': exam['slug'], 'l': exam['level'],
+            'lm': int(exam['is_long_model']), 'p': [p['id'] for p in exam['packs']],
+        })
+        for pack in exam['packs']:
+            packs.append({
+                'i': pack['id'], 'e': exam['id'], 't': pack['pack_type'],
+                'su': pack['subject']['id'] if pack['subject'] else None,
+                'y': pack['years_range'], 'pr': pack['price'], 'lb': pack['label'],
+            })
+    subjects = [{'i': s['id'], 'n': s['name'], 'c': s['code']} for s in snapshot['subjects']]
+    records = {'exams': exams, 'packs': packs, 'subjects': subjects}
+    for rows in records.values():
+        rows.sort(key=lambda r: r['i'])
+    return records
+
+
+class _Blobs:
+    """Blobs JSON précalculés pour une version du catalogue."""
+
+    def __init__(self, snapshot):
+        self.version = snapshot['version']
+        self.records = _compact_records(snapshot)
+        self.ids = {name: [r['i'] for r in rows] for name, rows in self.records.items()}
+        self.full = _dumps({
+            'v': self.version,
+            'e': self.records['exams'],
+            'p': self.records['packs'],
+            's': self.records['subjects'],
+        })
+        self._projections = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, resource, keys):
+        """Liste des enregistrements encodés, pour une sélection de clés (None = toutes)."""
+        cache_key = (resource, keys)
+        blobs = self._projections.get(cache_key)
+        if blobs is None:
+            with self._lock:
+                blobs = self._projections.get(cache_key)
+                if blobs is None:
+                    rows = self.records[resource]
+                    if keys is not None:
+                        rows = [{k: r[k] for k in keys} for r in rows]
+                    blobs = [_dumps(r) for r in rows]
+                    self._projections[cache_key] = blobs
+        return blobs
+
+
+_current = {'blobs': None}
+_build_lock = threading.Lock()
+
+
+def get_blobs():
+    snapshot = catalog.get_snapshot()
+    blobs = _current['blobs']
+    if blobs is None or blobs.version != snapshot['version']:
+        with _build_lock:
+            blobs = _current['blobs']
+            if blobs is None or blobs.version != snapshot['version']:
+                blobs = _current['blobs'] = _Blobs(snapshot)
+    return blobs
+
+
+# --- Curseurs / paramètres ------------------------------------------------------
+
+def _encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
+
+def _parse_fields(resource, raw):
+    """?fields=id,name -> tuple de clés compactes (None = tous les champs)."""
+    if not raw:
+        return None
+    mapping = FIELDS[resource]
+    names = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in names if f not in mapping]
+    if unknown:
+        raise ValueError(f"Champ(s) inconnu(s) : {', '.join(unknown)}")
+    keys = {'i'} | {mapping[f] for f in names}
+    return tuple(k for k in mapping.values() if k in keys)
+
+
+def _json_bytes(body, status=200):
+    return HttpResponse(body, status=status, content_type='application/json; charset=utf-8')
+
+
+def _api_etag(request, *args, **kwargs):
+    key = f"{catalog.get_version()}|{request.get_full_path()}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _api_view(view_func):
+    """GET seulement, 304 sur ETag (version du catalogue), toujours revalidé."""
+    view = require_GET(condition(etag_func=_api_etag)(view_func))
+
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        # max-age=0 : ni le navigateur ni UpdateCacheMiddleware ne gardent une version périmée
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+        return response
+
+    return _wrapped
+
+
+# --- Vues -----------------------------------------------------------------------
+
+@_api_view
+def catalog_version(request):
+    """Version courante du catalogue."""
+    return JsonResponse({'v': catalog.get_version()})
+
+
+@_api_view
+def catalog_full(request):
+    """Catalogue complet (examens, packs, matières) en une réponse."""
+    return _json_bytes(get_blobs().full)
+
+
+@_api_view
+def resource_list(request, resource):
+    """Liste paginée par curseur d'une ressource, avec ?fields= optionnel."""
+    if resource not in FIELDS:
+        return JsonResponse({'ok': False, 'error': 'Ressource inconnue'}, status=404)
+
+    try:
+        limit = max(1, min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except (TypeError, ValueError):
+        limit = DEFAULT_LIMIT
+
+    try:
+        keys = _parse_fields(resource, request.GET.get('fields'))
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+
+    blobs = get_blobs()
+    ids = blobs.ids[resource]
+    start = 0
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            start = bisect.bisect_right(ids, _decode_cursor(cursor))
+        except (ValueError, TypeError):
+            return JsonResponse({'ok': False, 'error': 'Curseur invalide'}, status=400)
+
+    end = min(start + limit, len(ids))
+    page = blobs.encoded(resource, keys)[start:end]
+    next_cursor = _encode_cursor(ids[end - 1]) if end < len(ids) else None
+
+    body = b''.join([
+        b'{"v":', str(blobs.version).encode(),
+        b',"d":[', b','.join(page), b'],"n":',
+        _dumps(next_cursor), b'}',
+    ])
+    return _json_bytes(body)
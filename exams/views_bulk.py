@@ -0,0 +1,90 @@
+"""
+Commandes groupées (établissements) : API de création (staff) et export CSV
+des liens de téléchargement (staff ou acheteur). Logique dans exams.bulk_orders.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET, require_POST
+
+from . import bulk_orders
+from .models import Order, Pack
+
+User = get_user_model()
+
+
+def _link_prefix(request):
+    url = reverse('exams:download_file', args=['TOKEN'])
+    return request.build_absolute_uri(url[:url.index('TOKEN')])
+
+
+def _parse(data):
+    """Corps JSON -> (acheteur, [(pack, places)], email, phone) ; BulkOrderError si invalide."""
+    if not isinstance(data, dict):
+        raise bulk_orders.BulkOrderError('JSON invalide.')
+    buyer_ref = str(data.get('buyer') or '').strip()
+    buyer = User.objects.filter(Q(username=buyer_ref) | Q(email__iexact=buyer_ref)).first() if buyer_ref else None
+    if buyer is None:
+        raise bulk_orders.BulkOrderError('"buyer" : compte acheteur introuvable (identifiant ou e-mail).')
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        raise bulk_orders.BulkOrderError('"items" doit être une liste de {"pack_id", "seats"}.')
+    try:
+        wanted = [(int(it['pack_id']), int(it['seats'])) for it in items]
+    except (TypeError, KeyError, ValueError):
+        raise bulk_orders.BulkOrderError('"items" doit être une liste de {"pack_id", "seats"}.')
+    packs = Pack.objects.select_related('exam', 'subject').in_bulk([pk for pk, _ in wanted])
+    unknown = [pk for pk, _ in wanted if pk not in packs or not packs[pk].is_active]
+    if unknown:
+        raise bulk_orders.BulkOrderError(f"Pack(s) introuvable(s) ou inactif(s) : {unknown}")
+    lines = [(packs[pk], seats) for pk, seats in wanted]
+    return buyer, lines, str(data.get('email') or ''), str(data.get('phone') or '')
+
+
+@login_required
+@require_POST
+def bulk_order_create_api(request):
+    """
+    POST {"buyer": "identifiant ou e-mail", "items": [{"pack_id": 3, "seats": 250}],
+          "email": "...", "phone": "..."}
+    Crée la commande groupée (réglée sur facture), payée et livrée. Staff uniquement.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'ok': False, 'error': 'Réservé au staff.'}, status=403)
+    try:
+        data = json.loads(request.body.decode('utf-8') or '{}')
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'ok': False, 'error': 'JSON invalide.'}, status=400)
+    try:
+        buyer, lines, email, phone = _parse(data)
+        order = bulk_orders.create_bulk_order(buyer, lines, email=email, phone=phone)
+    except bulk_orders.BulkOrderError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    return JsonResponse({
+        'ok': True,
+        'order_id': order.pk,
+        'seats': sum(seats for _, seats in lines),
+        'total_amount': order.total_amount,
+        'links_url': request.build_absolute_uri(reverse('exams:bulk_order_links', args=[order.pk])),
+    }, status=201)
+
+
+@login_required
+@require_GET
+@never_cache
+def bulk_order_links(request, order_id):
+    """Liens de téléchargement de chaque place, en CSV produit au fil de l'eau."""
+    order = get_object_or_404(Order, pk=order_id, bulk=True, status='PAID')
+    if order.user_id != request.user.pk and not request.user.is_staff:
+        raise Http404
+    response = StreamingHttpResponse(
+        bulk_orders.csv_lines(order, _link_prefix(request)), content_type='text/csv; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="commande-{order.pk}-liens.csv"'
+    return response
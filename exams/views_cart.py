@@ -1,23 +1,26 @@
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.cache import never_cache
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
 from django.urls import reverse
-from django.utils import timezone
-from datetime import timedelta
 from django.contrib import messages
-from .models import Cart, CartItem, Pack, Order, OrderItem, DownloadToken, PurchasedPack, Notification
+from .models import Cart, CartItem, Pack, Order, OrderItem
+from . import cart_summary, fulfillment, order_states, payments, reconciliation, webhook_inbox
 from django.conf import settings
+from django.db import transaction
 from decimal import Decimal
 
+import logging
 import stripe
-import requests
 import uuid
 import json
 
 from .models import Cart, CartItem, Pack, Order, OrderItem
 
+logger = logging.getLogger(__name__)
+
 # --- Stripe ---
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
@@ -57,7 +60,7 @@ def add_to_cart(request):
             return JsonResponse({
                 'ok': False,
                 'already_in_cart': True,
-                'cart_count': cart.items.count(),
+                'cart_count': cart.item_count,
                 'pack_name': str(pack),
                 'message': msg,
             }, status=200)
@@ -69,13 +72,129 @@ def add_to_cart(request):
         return JsonResponse({
             'ok': True,
             'already_in_cart': False,
-            'cart_count': cart.items.count(),
+            'cart_count': cart_summary.get_summary(request.user)['count'],
             'pack_name': str(pack),
             'item_id': item.id,
         })
     messages.success(request, f"Le pack « {pack} » a été ajouté à votre panier.")
     return redirect('exams:cart_detail')
 
+def _parse_ids(values):
+    """Liste d'identifiants (str/int) -> (ids valides sans doublon, ordre conservé ; invalides)."""
+    ids, invalid, seen = [], [], set()
+    for v in values or []:
+        try:
+            pid = int(v)
+        except (TypeError, ValueError):
+            invalid.append(v)
+            continue
+        if pid not in seen:
+            seen.add(pid)
+            ids.append(pid)
+    return ids, invalid
+
+
+def _apply_cart_batch(user, add_ids=(), remove_ids=()):
+    """
+    Applique un lot d'ajouts / retraits au panier avec une sémantique d'ensemble
+    (un pack est présent ou non, quantité 1), dans une seule transaction et en un
+    nombre constant de requêtes quel que soit la taille du lot :
+    panier, packs (pk__in), contenu actuel, bulk_create, delete, puis un seul
+    recalcul du résumé dénormalisé (voir exams.cart_summary).
+
+    Renvoie (cart, outcomes, count, total) ; outcomes = une entrée par pack demandé :
+    added / already_in_cart / removed / not_in_cart / unavailable / conflict.
+    """
+    add_ids, remove_ids = list(add_ids), list(remove_ids)
+    conflicts = set(add_ids) & set(remove_ids)
+
+    with transaction.atomic(), cart_summary.deferred() as dirty:
+        cart = _get_or_create_cart(user)
+        wanted = set(add_ids) | set(remove_ids)
+        packs = {
+            p.pk: p for p in
+            Pack.objects.filter(pk__in=wanted).select_related('exam', 'subject')
+        } if wanted else {}
+        in_cart = set(cart.items.filter(pack_id__in=wanted).values_list('pack_id', flat=True)) if wanted else set()
+
+        outcomes = []
+        to_create, to_delete = [], []
+        for pid in add_ids:
+            pack = packs.get(pid)
+            if pid in conflicts:
+                status = 'conflict'
+            elif pack is None or not pack.is_active:
+                status = 'unavailable'
+            elif pid in in_cart:
+                status = 'already_in_cart'
+            else:
+                status = 'added'
+                to_create.append(CartItem(cart=cart, pack=pack, quantity=1))
+            outcomes.append({'op': 'add', 'pack_id': pid, 'status': status, 'name': str(pack) if pack else None})
+        for pid in remove_ids:
+            pack = packs.get(pid)
+            if pid in conflicts:
+                status = 'conflict'
+            elif pid in in_cart:
+                status = 'removed'
+                to_delete.append(pid)
+            else:
+                status = 'not_in_cart'
+            outcomes.append({'op': 'remove', 'pack_id': pid, 'status': status, 'name': str(pack) if pack else None})
+
+        if to_create:
+            # bulk_create n'émet pas post_save : on marque le panier nous-mêmes
+            CartItem.objects.bulk_create(to_create, ignore_conflicts=True)
+        if to_create or to_delete:
+            dirty.add(cart.pk)
+        if to_delete:
+            cart.items.filter(pack_id__in=to_delete).delete()
+
+    summary = cart_summary.get_summary(user)
+    return cart, outcomes, summary['count'], summary['total']
+
+
+@login_required
+@require_POST
+def cart_batch(request):
+    """
+    Mutation groupée du panier (JSON) :
+        {"add": [pack_id, ...], "remove": [pack_id, ...]}
+    (ou champs de formulaire add[] / remove[]).
+    Répond avec le nouveau nombre d'articles, le total et le résultat par pack.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body.decode('utf-8') or '{}')
+        except (ValueError, UnicodeDecodeError):
+            return JsonResponse({'ok': False, 'error': 'JSON invalide.'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'ok': False, 'error': 'JSON invalide.'}, status=400)
+        raw_add, raw_remove = data.get('add') or [], data.get('remove') or []
+    else:
+        raw_add = request.POST.getlist('add[]') or request.POST.getlist('add')
+        raw_remove = request.POST.getlist('remove[]') or request.POST.getlist('remove')
+
+    if not isinstance(raw_add, list) or not isinstance(raw_remove, list):
+        return JsonResponse({'ok': False, 'error': '"add" et "remove" doivent être des listes.'}, status=400)
+
+    add_ids, invalid_add = _parse_ids(raw_add)
+    remove_ids, invalid_remove = _parse_ids(raw_remove)
+    if not add_ids and not remove_ids:
+        return JsonResponse({'ok': False, 'error': 'Aucune opération.'}, status=400)
+
+    cart, outcomes, count, total = _apply_cart_batch(request.user, add_ids, remove_ids)
+    outcomes += [{'op': 'add', 'pack_id': v, 'status': 'invalid', 'name': None} for v in invalid_add]
+    outcomes += [{'op': 'remove', 'pack_id': v, 'status': 'invalid', 'name': None} for v in invalid_remove]
+
+    return JsonResponse({
+        'ok': True,
+        'cart_count': count,
+        'total': total,
+        'results': outcomes,
+    })
+
+
 @login_required
 @require_POST
 def add_multiple_to_cart(request):
@@ -86,19 +205,10 @@ def add_multiple_to_cart(request):
     if not pack_ids:
         return JsonResponse({'ok': False, 'error': 'Aucun pack sélectionné.'}, status=400)
 
-    cart = _get_or_create_cart(request.user)
-    added = 0
-    skipped = []
-    for pid in pack_ids:
-        try:
-            pack = Pack.objects.get(pk=pid, is_active=True)
-        except Pack.DoesNotExist:
-            continue
-        obj, created = CartItem.objects.get_or_create(cart=cart, pack=pack, defaults={'quantity': 1})
-        if created:
-            added += 1
-        else:
-            skipped.append(str(pack))
+    add_ids, _ = _parse_ids(pack_ids)
+    cart, outcomes, count, _ = _apply_cart_batch(request.user, add_ids=add_ids)
+    added = sum(1 for o in outcomes if o['status'] == 'added')
+    skipped = [o['name'] for o in outcomes if o['status'] == 'already_in_cart']
 
     msg = f"{added} pack(s) ajouté(s) au panier."
     if skipped:
@@ -108,7 +218,7 @@ def add_multiple_to_cart(request):
         'ok': True,
         'added': added,
         'skipped': skipped,
-        'cart_count': cart.items.count(),
+        'cart_count': count,
         'message': msg,
     }, status=200)
 
@@ -116,7 +226,7 @@ def add_multiple_to_cart(request):
 def cart_detail(request):
     cart = _get_or_create_cart(request.user)
     items = cart.items.select_related('pack', 'pack__exam', 'pack__subject')
-    total = cart.total_amount
+    total = cart.total
     all_packs = (
         Pack.objects.filter(is_active=True)
         .select_related('exam', 'subject')
@@ -141,7 +251,7 @@ def remove_from_cart(request, item_id):
     item = get_object_or_404(CartItem, id=item_id, cart=cart)
     item.delete()
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        return JsonResponse({'ok': True, 'cart_count': cart.items.count()})
+        return JsonResponse({'ok': True, 'cart_count': cart_summary.get_summary(request.user)['count']})
     return redirect('exams:cart_detail')
 
 
@@ -149,161 +259,168 @@ def remove_from_cart(request, item_id):
 @require_POST
 def cart_checkout(request):
     """
-    Crée une Order et lance le paiement (Stripe ou CinetPay).
+    Crée une Order et lance l'initialisation du paiement (Stripe ou CinetPay)
+    en arrière-plan (exams.payments) : le worker ne bloque pas sur le
+    prestataire. Réponse immédiate « paiement en préparation » : JSON 202 en
+    AJAX, sinon redirection vers la page d'attente (checkout_status) qui
+    renvoie vers le prestataire dès que l'URL de paiement est connue.
     """
     cart = _get_or_create_cart(request.user)
     items = list(cart.items.select_related('pack'))
     if not items:
         return redirect('exams:cart_detail')
 
-    # 1) Créer Order
-    order = Order.objects.create(
-        user=request.user,
-        status='PENDING',
-        total_amount=0,
-        payment_method=request.POST.get("payment_method", "MOMO")  # MOMO par défaut
-    )
+    try:
+        with transaction.atomic():
+            # 1) Créer Order
+            order = Order.objects.create(
+                user=request.user,
+                status='PENDING',
+                total_amount=0,
+                payment_method=request.POST.get("payment_method", "MOMO")  # MOMO par défaut
+            )
 
-    total = 0
-    stripe_line_items = []
-    order_items_bulk = []
-
-    for it in items:
-        oi = OrderItem(order=order, pack=it.pack, unit_price=it.unit_price, quantity=it.quantity)
-        order_items_bulk.append(oi)
-        total += it.subtotal
-
-        stripe_line_items.append({
-            "price_data": {
-                "currency": "xof",
-                "product_data": {"name": str(it.pack)},
-                "unit_amount": int(it.unit_price),
-            },
-            "quantity": it.quantity,
-        })
+            total = 0
+            stripe_line_items = []
+            order_items_bulk = []
+
+            for it in items:
+                oi = OrderItem(order=order, pack=it.pack, unit_price=it.unit_price, quantity=it.quantity)
+                order_items_bulk.append(oi)
+                total += it.subtotal
+
+                stripe_line_items.append({
+                    "price_data": {
+                        "currency": "xof",
+                        "product_data": {"name": str(it.pack)},
+                        "unit_amount": int(it.unit_price),
+                    },
+                    "quantity": it.quantity,
+                })
+
+            OrderItem.objects.bulk_create(order_items_bulk)
+            order.total_amount = total
+            order.save(update_fields=['total_amount', 'payment_method'])
+
+            # 2) Paramètres du prestataire (STRIPE ou MOBILE MONEY via CINETPAY)
+            if order.payment_method.upper() == "STRIPE":
+                method = "STRIPE"
+                success_url = request.build_absolute_uri(reverse('exams:payment_success')) + "?session_id={CHECKOUT_SESSION_ID}"
+                params = {
+                    "mode": "payment",
+                    "payment_method_types": ["card"],
+                    "line_items": stripe_line_items,
+                    "success_url": success_url,
+                    "cancel_url": request.build_absolute_uri(reverse('exams:payment_cancel')),
+                    "metadata": {"order_id": str(order.id), "user_id": str(request.user.id)},
+                }
+            else:
+                method = "CINETPAY"
+                params = {
+                    "apikey": settings.CINETPAY_API_KEY,
+                    "site_id": settings.CINETPAY_SITE_ID,
+                    "transaction_id": f"order{order.id}-{uuid.uuid4().hex[:12]}",
+                    "amount": int(total),  # entier
+                    "currency": "XOF",
+                    "description": f"Paiement commande #{order.id}",
+                    "notify_url": request.build_absolute_uri(reverse("exams:momo_webhook")),
+                    "return_url": request.build_absolute_uri(reverse("exams:payment_success")),
+                    "metadata": json.dumps({"order_id": str(order.id)}),
+                }
+
+            # 3) Appel au prestataire en arrière-plan (après commit)
+            state = payments.start_checkout(order, method, params)
+    except payments.CheckoutBusy:
+        # commande annulée avec la transaction
+        msg = "Le service de paiement est très sollicité. Merci de réessayer dans quelques instants."
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'ok': False, 'error': msg}, status=503, headers={'Retry-After': '5'})
+        messages.warning(request, msg)
+        return redirect('exams:cart_detail')
+
+    status_url = reverse('exams:checkout_status', args=[order.id])
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'ok': True, 'order_id': order.id, 'status_url': status_url, **state}, status=202)
+    return redirect(status_url)
 
-    OrderItem.objects.bulk_create(order_items_bulk)
-    order.total_amount = total
-    order.save(update_fields=['total_amount', 'payment_method'])
-
-    # 2) Paiement STRIPE
-    if order.payment_method.upper() == "STRIPE":
-        success_url = request.build_absolute_uri(reverse('exams:payment_success')) + "?session_id={CHECKOUT_SESSION_ID}"
-        cancel_url = request.build_absolute_uri(reverse('exams:payment_cancel'))
-
-        session = stripe.checkout.Session.create(
-            mode="payment",
-            payment_method_types=["card"],
-            line_items=stripe_line_items,
-            success_url=success_url,
-            cancel_url=cancel_url,
-            metadata={"order_id": str(order.id), "user_id": str(request.user.id)},
-        )
 
-        order.stripe_session_id = session.id
-        order.save(update_fields=['stripe_session_id'])
-        return redirect(session.url, permanent=False)
-
-    # 3) Paiement MOBILE MONEY via CINETPAY
-    transaction_id = f"order{order.id}-{uuid.uuid4().hex[:12]}"
-    notify_url = request.build_absolute_uri(reverse("exams:momo_webhook"))
-    return_url = request.build_absolute_uri(reverse("exams:payment_success"))
-
-    payload = {
-        "apikey": settings.CINETPAY_API_KEY,
-        "site_id": settings.CINETPAY_SITE_ID,
-        "transaction_id": transaction_id,
-        "amount": int(total),  # entier
-        "currency": "XOF",
-        "description": f"Paiement commande #{order.id}",
-        "notify_url": notify_url,
-        "return_url": return_url,
-        "metadata": json.dumps({"order_id": str(order.id)}),
+@login_required
+@never_cache
+def checkout_status(request, order_id):
+    """
+    État de l'initialisation du paiement d'une commande.
+    JSON pour les requêtes AJAX ; sinon redirection vers le prestataire quand
+    l'URL est prête, page d'échec, ou page d'attente (qui s'actualise seule).
+    """
+    order = get_object_or_404(Order, pk=order_id, user=request.user)
+    state = payments.get_state(order.id) or {
+        'state': payments.FAILED, 'redirect_url': None,
+        'error': "Session de paiement expirée, veuillez relancer le paiement.",
     }
 
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'ok': True, 'order_id': order.id, **state})
+    if state['state'] == payments.READY:
+        return redirect(state['redirect_url'])
+    if state['state'] == payments.FAILED:
+        return render(request, "payment_failed.html", {"error_message": state['error']})
+    return render(request, "payment_preparing.html", {"order": order})
+
+def _confirmed_by_provider(order):
+    """
+    Retour du prestataire sans webhook encore traité : on lui demande le statut
+    (exams.reconciliation.check_status) et on ne passe la commande à PAID que
+    s'il le confirme. L'URL de retour seule ne prouve rien.
+    """
+    if not (order.stripe_session_id or order.transaction_id):
+        return False
     try:
-        response = requests.post(
-            "https://api-checkout.cinetpay.com/v2/payment",
-            json=payload,
-            timeout=15
-        )
-        response_data = response.json()
+        status = reconciliation.check_status({
+            'pk': order.pk, 'stripe_session_id': order.stripe_session_id, 'transaction_id': order.transaction_id,
+        })
     except Exception as e:
-        return render(request, "payment_failed.html", {"error": str(e)})
+        logger.warning("Commande #%s : statut du paiement indisponible au retour (%s)", order.pk, e)
+        return False
+    if status != 'PAID':
+        return False
+    order_states.transition(order, "PAID")
+    return True
 
-    print("Payload envoyé à CinetPay:", payload)
-    print("Réponse CinetPay:", response_data)
-
-    if response_data.get("code") == "201":
-        payment_url = response_data["data"]["payment_url"]
-        return redirect(payment_url)
-    else:
-        return render(request, "payment_failed.html", {
-            "error": response_data.get("description", "Erreur inconnue"),
-            "details": response_data
-        })
 
 @login_required
+@never_cache
 def payment_success(request):
     """
     1) Récupère la dernière commande de l'utilisateur.
-    2) Garantit la création des DownloadToken pour chaque item payé.
-    3) Crée la notification post-paiement avec la liste des packs.
-    4) Envoie à la page de succès les données pour la modale.
+    2) Si elle n'est pas encore PAID (webhook pas encore traité), demande son
+       statut au prestataire ; sinon la page indique que la confirmation est
+       en cours (et se recharge).
+    3) Commande payée : la livre (exams.fulfillment) — jetons, possession et
+       notification, de façon idempotente — et envoie à la page de succès
+       les données pour la modale.
     """
     order = (
         Order.objects.filter(user=request.user)
-        .order_by('-created_at')
+        .order_by('-created_at', '-id')  # index order_user_created_idx
         .first()
     )
 
     packs_info = []
     total_paid = 0
+    paid = bool(order) and (order.status == "PAID" or _confirmed_by_provider(order))
 
-    if order:
-        # Si pour une raison quelconque le statut n'est pas déjà PAID (ex: simulateur),
-        # on le force ici après retour succès.
-        if order.status != "PAID":
-            order.status = "PAID"
-            order.save()
-
+    if paid:
         total_paid = int(order.total_amount or 0)
 
-        # Créer/assurer les tokens + PurchasedPack
-        for item in order.items.all():
-            # Token de téléchargement (si absent)
-            tok, _ = DownloadToken.objects.get_or_create(
-                item=item,
-                defaults={
-                    'expires_at': timezone.now() + timedelta(hours=settings.DOWNLOAD_TOKEN_TTL_HOURS),
-                    'remaining_downloads': settings.DOWNLOAD_MAX_TIMES,
-                }
-            )
-            # Possession (historique)
-            PurchasedPack.objects.get_or_create(user=request.user, pack=item.pack)
-
-            packs_info.append({
-                'name': str(item.pack),
-                'download_url': reverse('exams:download_file', args=[tok.token]),
-            })
-
-        # Créer une notification (message + payload (packs + total))
-        notif_message = (
-            f"Paiement de la somme de {total_paid} F effectué avec succès. "
-            "Pour obtenir les packs que vous venez d’acheter sur votre appareil, "
-            "cliquez sur le bouton « Télécharger ZIP » présent sur chacun de ces packs."
-        )
-        Notification.objects.create(
-            user=request.user,
-            message=notif_message,
-            payload={'total': total_paid, 'packs': packs_info},
-        )
+        # Jetons + possession + notification, sans doublon si la page est rechargée
+        packs_info = fulfillment.fulfill_order(order)
 
     return render(
         request,
         'payment_success.html',
         {
-            'show_modal': True,
+            'show_modal': paid,
+            'pending': bool(order) and not paid,
             'total_paid': total_paid,
             'packs_info': packs_info,
         }
@@ -324,12 +441,14 @@ def payment_simulator(request):
         messages.warning(request, "Votre panier est vide : ajoutez d'abord un/des packs pour tester.")
         return redirect('exams:cart_detail')
 
-    order = Order.objects.create(user=request.user, total_amount=sum(i.unit_price for i in items))
-    for it in items:
-        OrderItem.objects.create(order=order, pack=it.pack, unit_price=it.unit_price, quantity=it.quantity)
-
-    order.status = "PAID"
-    order.save()
+    # payée dès sa création : pas de transition à arbitrer
+    order = Order.objects.create(
+        user=request.user, status="PAID", total_amount=sum(i.unit_price for i in items),
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, pack=it.pack, unit_price=it.unit_price, quantity=it.quantity)
+        for it in items
+    ])
 
     # Optionnel : vider le panier après commande
     cart.items.all().delete()
@@ -346,52 +465,31 @@ def payment_cancel(request):
     return redirect('exams:cart_detail')
 
 @csrf_exempt
+@require_POST
 def stripe_webhook(request):
     """
-    Webhook Stripe simulé.
-    Pour l’instant, on ne traite rien car le paiement réel n’est pas testé.
-    On renvoie juste 200 OK pour que Django ait la vue.
+    Webhook Stripe : l'événement est enregistré dans l'inbox (dédoublonné sur
+    son id) et acquitté tout de suite ; process_webhooks l'applique ensuite.
     """
+    try:
+        reference, payload = webhook_inbox.parse_stripe(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    webhook_inbox.record("STRIPE", reference, payload)
     return HttpResponse(status=200)
 
 @csrf_exempt
 def momo_webhook(request):
     """
-    Webhook CinetPay → met à jour la commande.
+    Webhook CinetPay : enregistré dans l'inbox (clé transaction + statut) et
+    acquitté tout de suite ; process_webhooks met à jour la commande.
     """
     if request.method == "POST":
         try:
-            data = json.loads(request.body.decode("utf-8"))
-            print("Webhook MoMo reçu:", data)
-
-            order_id = None
-            if "metadata" in data:
-                try:
-                    metadata = json.loads(data.get("metadata"))
-                    order_id = metadata.get("order_id")
-                except Exception:
-                    pass
-
-            if not order_id:
-                return JsonResponse({"error": "order_id manquant"}, status=400)
-
-            try:
-                order = Order.objects.get(pk=order_id)
-            except Order.DoesNotExist:
-                return JsonResponse({"error": "Commande introuvable"}, status=404)
-
-            payment_status = data.get("status")
-            if payment_status == "ACCEPTED":
-                order.status = "PAID"
-            elif payment_status in ["REFUSED", "CANCELLED"]:
-                order.status = "CANCELLED"
-            else:
-                order.status = "PENDING"
-            order.save()
-
-            return JsonResponse({"message": "Commande mise à jour", "order_status": order.status}, status=200)
-
-        except Exception as e:
-            return JsonResponse({"error": str(e)}, status=500)
+            reference, payload = webhook_inbox.parse_cinetpay(request)
+        except (ValueError, UnicodeDecodeError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        webhook_inbox.record("CINETPAY", reference, payload)
+        return JsonResponse({"message": "Notification reçue"}, status=200)
 
     return JsonResponse({"error": "Méthode non autorisée"}, status=405)
@@ -0,0 +1,301 @@
+"""
+Boîte de réception des webhooks de paiement.
+
+Réception (vues) : la notification est analysée a minima, enregistrée dans
+WebhookEvent avec une clé (prestataire, référence) unique, et acquittée tout
+de suite. Un renvoi du prestataire retombe sur la même clé et est ignoré par
+l'INSERT (ignore_conflicts) : latence constante, aucun travail en double.
+
+Traitement (``python manage.py process_webhooks``) : ``drain()`` prend les
+événements reçus par lots (SELECT ... FOR UPDATE SKIP LOCKED là où la base le
+permet, donc plusieurs workers possibles), les traduit en transitions de
+commande et les applique via exams.order_states (compare-and-swap sur la
+version, sans verrou de ligne) : une transition déjà faite ne s'applique pas
+deux fois, et une commande payée ne redevient jamais « en attente ».
+Un événement en échec est réessayé plus tard (``next_attempt_at``, délai
+doublé à chaque essai), puis marqué FAILED après MAX_ATTEMPTS essais.
+
+Confiance : seuls les événements Stripe sont signés. Une notification CinetPay
+n'est qu'une indication : le statut appliqué est celui que renvoie CinetPay
+(/v2/payment/check, exams.reconciliation.check_status) pour la transaction
+enregistrée sur la commande, jamais celui du corps reçu. Les événements du
+simulateur ne sont acceptés qu'avec PAYMENT_PROVIDER = 'SIMULATOR'.
+
+Références retenues :
+- SIMULATOR : "<référence du paiement>:<statut>"
+- CINETPAY  : "<transaction_id>:<order_id>:<statut>"  (un changement de statut est un nouvel événement)
+- STRIPE    : id de l'événement (evt_...)
+"""
+import json
+import logging
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import fulfillment, order_states
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30  # s ; doublé à chaque échec (30 s, 1 min, 2 min, 4 min)
+
+# --- Réception -----------------------------------------------------------------------
+
+def record(provider, reference, payload):
+    """Enregistre l'événement (sans effet s'il a déjà été reçu). Une requête INSERT."""
+    from .models import WebhookEvent
+
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(provider=provider, reference=str(reference)[:255], payload=payload)],
+        ignore_conflicts=True,
+    )
+
+
+def simulator_enabled():
+    return getattr(settings, 'PAYMENT_PROVIDER', '') == 'SIMULATOR'
+
+
+def parse_simulator(request):
+    """Formulaire {reference, status} du simulateur historique (mode SIMULATOR seulement)."""
+    if not simulator_enabled():
+        raise ValueError("Simulateur de paiement désactivé")
+    ref = request.POST.get('reference')
+    status = request.POST.get('status')
+    if not ref or not status:
+        raise ValueError("reference / status manquant")
+    return f"{ref}:{status}", {'reference': ref, 'status': status}
+
+
+def parse_cinetpay(request):
+    """Notification CinetPay (JSON ou formulaire), order_id dans metadata."""
+    if request.content_type == 'application/json':
+        data = json.loads(request.body.decode('utf-8') or '{}')
+    else:
+        data = request.POST.dict()
+    if not isinstance(data, dict):
+        raise ValueError("JSON invalide")
+    transaction_id = data.get('transaction_id') or data.get('cpm_trans_id')
+    metadata = data.get('metadata')
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = {}
+    order_id = (metadata or {}).get('order_id')
+    if not order_id:
+        raise ValueError("order_id manquant")
+    status = data.get('status') or ''
+    # la commande fait partie de la clé : une notification forgée ne masque pas la vraie
+    return f"{transaction_id or 'order'}:{order_id}:{status}", data
+
+
+def parse_stripe(request):
+    """
+    Événement Stripe à signature vérifiée (STRIPE_WEBHOOK_SECRET). Sans secret
+    configuré, tout événement est refusé : un corps non signé pourrait marquer
+    n'importe quelle commande payée.
+    """
+    secret = getattr(settings, 'STRIPE_WEBHOOK_SECRET', None)
+    if not secret:
+        logger.error("Webhook Stripe refusé : STRIPE_WEBHOOK_SECRET n'est pas configuré")
+        raise ValueError("Webhook Stripe non configuré")
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body, request.headers.get('Stripe-Signature', ''), secret,
+        )
+    except stripe.error.SignatureVerificationError as e:
+        raise ValueError("Signature Stripe invalide") from e
+    data = event.to_dict()
+    if not isinstance(data, dict) or not data.get('id'):
+        raise ValueError("Événement Stripe invalide")
+    return data['id'], data
+
+
+# --- Interprétation ------------------------------------------------------------------
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def interpret(event, payments_by_ref):
+    """Événement -> (order_id, statut cible) ; (None, None) si rien à faire."""
+    payload = event.payload
+    if event.provider == 'SIMULATOR':
+        if not simulator_enabled():
+            return None, None
+        payment = payments_by_ref.get(payload.get('reference'))
+        if payment is None:
+            return None, None
+        return payment.order_id, 'PAID' if payload.get('status') == 'SUCCESS' else None
+
+    if event.provider == 'CINETPAY':
+        # statut annoncé, à confirmer auprès de CinetPay (_confirmed_by_provider)
+        metadata = payload.get('metadata')
+        if isinstance(metadata, str):
+            try:
+                metadata = json.loads(metadata)
+            except ValueError:
+                metadata = {}
+        order_id = _as_int((metadata or {}).get('order_id'))
+        status = payload.get('status')
+        if status == 'ACCEPTED':
+            return order_id, 'PAID'
+        if status in ('REFUSED', 'CANCELLED'):
+            return order_id, 'CANCELLED'
+        return order_id, None  # statut intermédiaire : la commande reste en l'état
+
+    if event.provider == 'STRIPE':
+        obj = (payload.get('data') or {}).get('object') or {}
+        order_id = _as_int((obj.get('metadata') or {}).get('order_id'))
+        kind = payload.get('type')
+        if kind in ('checkout.session.completed', 'checkout.session.async_payment_succeeded'):
+            if obj.get('payment_status', 'paid') == 'paid':
+                return order_id, 'PAID'
+        if kind in ('checkout.session.expired', 'checkout.session.async_payment_failed'):
+            return order_id, 'CANCELLED'
+        return order_id, None
+
+    return None, None
+
+
+# --- Application ---------------------------------------------------------------------
+
+def _confirmed_by_provider(order_ids):
+    """
+    Statut définitif ('PAID' / 'CANCELLED') chez le prestataire des commandes
+    signalées par un webhook non signé ; absentes : en attente, inconnues ou
+    sans transaction enregistrée (la réconciliation reprendra). Une erreur du
+    prestataire est propagée : l'événement sera réessayé.
+    """
+    from .models import Order
+    from . import reconciliation
+
+    statuses = {}
+    orders = Order.objects.filter(pk__in=order_ids).filter(
+        Q(transaction_id__isnull=False) | Q(stripe_session_id__isnull=False)
+    ).values('pk', 'stripe_session_id', 'transaction_id')
+    for order in orders:
+        status = reconciliation.check_status(order)
+        if status:
+            statuses[order['pk']] = status
+    return statuses
+
+
+def _process(events):
+    """Applique un lot d'événements (dans la transaction de l'appelant)."""
+    from .models import Payment
+
+    refs = [e.payload.get('reference') for e in events if e.provider == 'SIMULATOR']
+    payments_by_ref = {p.reference: p for p in Payment.objects.filter(reference__in=refs)} if refs else {}
+
+    targets = {}  # order_id -> statut cible ; PAID l'emporte dans un même lot
+    hinted = set()  # commandes signalées par CinetPay : statut relu chez le prestataire
+    done, ignored = [], []
+    for event in events:
+        order_id, target = interpret(event, payments_by_ref)
+        if order_id and target:
+            if event.provider == 'CINETPAY':
+                hinted.add(order_id)
+            elif targets.get(order_id) != 'PAID':
+                targets[order_id] = target
+            done.append(event.pk)
+        else:
+            ignored.append(event.pk)
+    hinted -= {o for o, t in targets.items() if t == 'PAID'}
+    if hinted:
+        targets.update(_confirmed_by_provider(hinted))
+
+    paid = order_states.transition_many([o for o, t in targets.items() if t == 'PAID'], 'PAID')
+    cancelled = order_states.transition_many([o for o, t in targets.items() if t == 'CANCELLED'], 'CANCELLED')
+
+    # Statut des paiements du simulateur (historique Payment ; la charge utile reste dans l'inbox)
+    refs_by_status = {}
+    for event in events:
+        if event.provider == 'SIMULATOR' and event.payload.get('reference') in payments_by_ref:
+            refs_by_status.setdefault(event.payload.get('status'), []).append(event.payload['reference'])
+    for status, status_refs in refs_by_status.items():
+        order_states.set_payment_status(status_refs, status)
+
+    if paid:
+        fulfillment.fulfill_orders(paid)
+    return done, ignored, paid, cancelled
+
+
+def _mark(ids, state, error=''):
+    from .models import WebhookEvent
+
+    if ids:
+        WebhookEvent.objects.filter(pk__in=ids).update(
+            state=state, error=error, attempts=F('attempts') + 1, processed_at=timezone.now(),
+        )
+
+
+def _fail(event, error):
+    """Échec d'un événement : nouvel essai différé (backoff exponentiel), puis FAILED."""
+    from .models import WebhookEvent
+
+    attempts = event.attempts + 1
+    if attempts >= MAX_ATTEMPTS:
+        _mark([event.pk], 'FAILED', error=str(error)[:1000])
+        return
+    WebhookEvent.objects.filter(pk=event.pk).update(
+        state='RECEIVED', error=str(error)[:1000], attempts=F('attempts') + 1,
+        next_attempt_at=timezone.now() + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (attempts - 1)),
+    )
+
+
+def drain(batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """
+    Traite les événements reçus, lot par lot, jusqu'à épuisement.
+    Renvoie des compteurs {processed, ignored, failed, paid, cancelled}.
+    """
+    from .models import WebhookEvent
+
+    stats = {'processed': 0, 'ignored': 0, 'failed': 0, 'paid': 0, 'cancelled': 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        with transaction.atomic():
+            events = list(
+                WebhookEvent.objects.filter(state='RECEIVED')
+                .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now()))
+                .order_by('id')
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not events:
+                break
+            try:
+                with transaction.atomic():
+                    done, ignored, paid, cancelled = _process(events)
+            except Exception:
+                logger.exception("Lot de webhooks en échec, traitement un par un")
+                done, ignored, paid, cancelled = [], [], [], []
+                for event in events:
+                    try:
+                        with transaction.atomic():
+                            d, i, p, c = _process([event])
+                        done += d
+                        ignored += i
+                        paid += p
+                        cancelled += c
+                    except Exception as e:
+                        _fail(event, e)
+                        stats['failed'] += 1
+            _mark(done, 'PROCESSED')
+            _mark(ignored, 'IGNORED')
+
+        stats['processed'] += len(done)
+        stats['ignored'] += len(ignored)
+        stats['paid'] += len(paid)
+        stats['cancelled'] += len(cancelled)
+        if len(events) < batch_size:
+            break
+    return stats
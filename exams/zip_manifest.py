@@ -0,0 +1,224 @@
+"""
+Index (manifeste) des archives ZIP stockées : packs, extraits, pièces jointes du forum.
+
+Le répertoire central d'un ZIP est lu une seule fois, quand le fichier est
+stocké (exams.storages.ZipManifestMixin). Le manifeste est écrit à côté du
+fichier, dans ``<nom>.manifest.json`` :
+    {"version": 1, "size": <taille de l'archive>, "entries": [
+        {"name", "size", "compressed_size", "crc", "offset", "data_offset",
+         "method", "is_dir", "encrypted"}, ...]}
+``offset`` est la position de l'en-tête local du membre, ``data_offset``
+celle de ses données. Un membre s'extrait donc par un seek suivi d'une
+lecture, sans relire l'archive : ``iter_member()``.
+
+Les lectures passent par ``load()`` / ``get()`` :
+- validate_zip contrôle les fichiers déjà stockés ;
+- le forum s'en sert pour lister et extraire les membres d'une archive.
+Les fichiers stockés avant cet index sont indexés à leur première lecture.
+Un manifeste dont la taille ne correspond plus au fichier est recalculé.
+
+Pour un envoi, ``for_validation()`` calcule le manifeste pendant la
+validation et le garde sur le fichier reçu (``zip_manifest``). Le stockage
+le réutilise sans relire l'archive.
+"""
+import json
+import logging
+import os
+import struct
+import uuid
+import zipfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+SUFFIX = '.manifest.json'
+CHUNK_SIZE = 64 * 1024
+_LOCAL_HEADER = struct.Struct('<4s22xHH')  # signature … longueur du nom, longueur du champ extra
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+
+
+class UnsupportedMember(Exception):
+    """Membre chiffré ou compressé autrement que stocké / deflate."""
+
+
+# --- Construction --------------------------------------------------------------------
+
+def build(fileobj):
+    """Manifeste d'une archive ouverte (position restaurée) ; BadZipFile si invalide."""
+    try:
+        pos = fileobj.tell()
+    except Exception:
+        pos = None
+    try:
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        with zipfile.ZipFile(fileobj) as zf:
+            infos = zf.infolist()
+        entries = []
+        for info in infos:
+            fileobj.seek(info.header_offset)
+            header = fileobj.read(_LOCAL_HEADER.size)
+            if len(header) < _LOCAL_HEADER.size:
+                raise zipfile.BadZipFile(f"En-tête local tronqué : {info.filename}")
+            signature, name_length, extra_length = _LOCAL_HEADER.unpack(header)
+            if signature != _LOCAL_SIGNATURE:
+                raise zipfile.BadZipFile(f"En-tête local invalide : {info.filename}")
+            entries.append({
+                'name': info.filename,
+                'size': info.file_size,
+                'compressed_size': info.compress_size,
+                'crc': info.CRC,
+                'offset': info.header_offset,
+                'data_offset': info.header_offset + _LOCAL_HEADER.size + name_length + extra_length,
+                'method': info.compress_type,
+                'is_dir': info.is_dir(),
+                'encrypted': bool(info.flag_bits & 0x1),
+            })
+    finally:
+        if pos is not None:
+            fileobj.seek(pos)
+    return {'version': VERSION, 'size': size, 'entries': entries}
+
+
+def for_validation(value):
+    """
+    Manifeste pour validate_zip : celui du fichier stocké, ou calculé sur
+    l'envoi et gardé sur l'objet reçu (le stockage le réutilise).
+    """
+    from django.db.models.fields.files import FieldFile
+
+    if isinstance(value, FieldFile):
+        if value._committed:
+            manifest = get(value)
+            if manifest is None:
+                raise zipfile.BadZipFile("Fichier introuvable.")
+            return manifest
+        value = value.file
+    manifest = getattr(value, 'zip_manifest', None)
+    if manifest is None:
+        manifest = build(value)
+        try:
+            value.zip_manifest = manifest
+        except AttributeError:
+            pass
+    return manifest
+
+
+# --- Stockage à côté du fichier --------------------------------------------------------
+
+def _write(path, manifest):
+    tmp = f"{path}{SUFFIX}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp, path + SUFFIX)
+
+
+def save(storage, name, manifest=None):
+    """Écrit le manifeste de ``name`` (calculé depuis le fichier si absent)."""
+    path = storage.path(name)
+    if manifest is None:
+        try:
+            with open(path, 'rb') as f:
+                manifest = build(f)
+        except (zipfile.BadZipFile, OSError) as e:
+            logger.warning("ZIP non indexé (%s) : %s", e, name)
+            return None
+    _write(path, manifest)
+    return manifest
+
+
+def load(storage, name):
+    """
+    Manifeste de ``name`` ; None si le fichier n'existe pas. Absent ou
+    périmé : recalculé une fois et réécrit. BadZipFile si l'archive est invalide.
+    """
+    path = storage.path(name)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    try:
+        with open(path + SUFFIX, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == VERSION and manifest.get('size') == size:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    with open(path, 'rb') as f:
+        manifest = build(f)
+    _write(path, manifest)
+    return manifest
+
+
+def get(fieldfile):
+    return load(fieldfile.storage, fieldfile.name)
+
+
+def discard(storage, name):
+    try:
+        os.remove(storage.path(name) + SUFFIX)
+    except OSError:
+        pass
+
+
+def is_sidecar(name):
+    return name.endswith(SUFFIX)
+
+
+# --- Lecture des membres ---------------------------------------------------------------
+
+def find(manifest, name):
+    """Entrée du membre ``name`` (fichier, pas dossier), ou None."""
+    for entry in manifest['entries']:
+        if entry['name'] == name and not entry['is_dir']:
+            return entry
+    return None
+
+
+def _raw_chunks(f, remaining):
+    while remaining > 0:
+        raw = f.read(min(CHUNK_SIZE, remaining))
+        if not raw:
+            raise zipfile.BadZipFile("Membre tronqué.")
+        remaining -= len(raw)
+        yield raw
+
+
+def _inflated(raw_chunks):
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    for raw in raw_chunks:
+        while raw:
+            # sortie bornée par appel : un bloc très compressé ne gonfle pas la mémoire
+            yield inflater.decompress(raw, CHUNK_SIZE * 4)
+            raw = inflater.unconsumed_tail
+    yield inflater.flush()
+
+
+def iter_member(path, entry):
+    """
+    Contenu décompressé du membre, par blocs, lu directement à ``data_offset``.
+    Taille et CRC vérifiés à la lecture (BadZipFile si l'archive a changé).
+    UnsupportedMember (tout de suite) pour un membre chiffré ou bzip2/lzma.
+    """
+    if entry['encrypted'] or entry['method'] not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        raise UnsupportedMember(entry['name'])
+    return _member_chunks(path, entry)
+
+
+def _member_chunks(path, entry):
+    crc, produced = 0, 0
+    with open(path, 'rb') as f:
+        f.seek(entry['data_offset'])
+        chunks = _raw_chunks(f, entry['compressed_size'])
+        if entry['method'] == zipfile.ZIP_DEFLATED:
+            chunks = _inflated(chunks)
+        for data in chunks:
+            produced += len(data)
+            if produced > entry['size']:
+                raise zipfile.BadZipFile(f"Membre plus grand qu'annoncé : {entry['name']}")
+            crc = zlib.crc32(data, crc)
+            if data:
+                yield data
+    if produced != entry['size'] or crc != entry['crc']:
+        raise zipfile.BadZipFile(f"CRC ou taille incorrects : {entry['name']}")
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:15
+
+import django.core.validators
+from django.db import migrations, models
+import exams.storages
+import forum.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0005_alter_attachment_file"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="attachment",
+            name="file",
+            field=models.FileField(
+                storage=exams.storages.ZipManifestStorage(),
+                upload_to=forum.models.forum_attachment_path,
+                validators=[
+                    django.core.validators.FileExtensionValidator(
+                        [
+                            "jpg",
+                            "jpeg",
+                            "png",
+                            "gif",
+                            "webp",
+                            "bmp",
+                            "svg",
+                            "mp4",
+                            "webm",
+                            "ogg",
+                            "mov",
+                            "mkv",
+                            "pdf",
+                            "doc",
+                            "docx",
+                            "xls",
+                            "xlsx",
+                            "ppt",
+                            "pptx",
+                            "txt",
+                            "zip",
+                            "rar",
+                            "7z",
+                        ]
+                    )
+                ],
+            ),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from django.core.validators import FileExtensionValidator
+from exams.storages import ZipManifestStorage
 import os
 
 def forum_attachment_path(instance, filename):
@@ -59,6 +60,7 @@ class Attachment(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='attachments')
     file = models.FileField(
         upload_to=forum_attachment_path,
+        storage=ZipManifestStorage(),  # ZIP indexés au stockage (exams.zip_manifest)
         validators=[FileExtensionValidator([
             # images
             'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'svg',
@@ -78,6 +80,26 @@ class Attachment(models.Model):
     def __str__(self):
         return os.path.basename(self.file.name)
 
+    IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'svg'}
+    VIDEO_EXTENSIONS = {'mp4', 'webm', 'ogg', 'mov', 'mkv'}
+
     @property
     def name(self):
-        return os.path.basename(self.file.name)
\ No newline at end of file
+        return os.path.basename(self.file.name)
+
+    @property
+    def filename(self):
+        return self.name
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.file.name)[1].lstrip('.').lower()
+
+    def is_image(self):
+        return self.extension in self.IMAGE_EXTENSIONS
+
+    def is_video(self):
+        return self.extension in self.VIDEO_EXTENSIONS
+
+    def is_zip(self):
+        return self.extension == 'zip'
\ No newline at end of file
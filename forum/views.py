@@ -12,15 +12,18 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.db.models import Prefetch, Q
-from django.http import JsonResponse, HttpResponse, Http404, FileResponse, HttpResponseNotAllowed, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponse, Http404, FileResponse, HttpResponseNotAllowed, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import content_disposition_header
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_http_methods, require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from .models import Message, Attachment
+from exams import file_delivery, zip_manifest
 from exams.models import Profile
 
 logger = logging.getLogger(__name__)
@@ -456,21 +459,23 @@ def attachment_delete(request, attachment_id):
 
 def _serve_attachment(attachment, request, content_type=None, as_attachment=True):
     """
-    Utilitaire pour servir un fichier avec le bon type MIME.
+    Utilitaire pour servir un fichier avec le bon type MIME, par plages
+    (lecture des vidéos à une position donnée) : exams.file_delivery.
     """
     if not content_type:
         content_type, _ = mimetypes.guess_type(attachment.filename)
         if not content_type:
             content_type = 'application/octet-stream'
-    
-    response = FileResponse(attachment.file, content_type=content_type)
-    
-    if as_attachment:
-        response['Content-Disposition'] = f'attachment; filename=\"{attachment.filename}\"'
-    else:
-        response['Content-Disposition'] = f'inline; filename=\"{attachment.filename}"'
-    
-    return response
+    try:
+        path = attachment.file.path
+    except (NotImplementedError, ValueError):
+        raise Http404("Pièce jointe non trouvée")
+    if not os.path.exists(path):
+        raise Http404("Pièce jointe non trouvée")
+    return file_delivery.serve(
+        request, path, filename=attachment.filename, content_type=content_type,
+        as_attachment=as_attachment, private=True,
+    )
 
 @require_GET
 def attachment_thumb(request, attachment_id):
@@ -483,7 +488,7 @@ def attachment_thumb(request, attachment_id):
         raise Http404("Pièce jointe non trouvée")
     
     # Vérifier les permissions
-    if attachment.message.deleted_for_all or (request.user.is_authenticated and attachment.message.deleted_for_users.filter(id=request.user.id).exists()):
+    if attachment.message.deleted or (request.user.is_authenticated and attachment.message.hidden_for.filter(id=request.user.id).exists()):
         return HttpResponseForbidden("Accès refusé à ce message")
     
     # Vérifier si c'est une image
@@ -504,7 +509,7 @@ def attachment_videothumb(request, attachment_id):
         raise Http404("Pièce jointe non trouvée")
     
     # Vérifier les permissions
-    if attachment.message.deleted_for_all or (request.user.is_authenticated and attachment.message.deleted_for_users.filter(id=request.user.id).exists()):
+    if attachment.message.deleted or (request.user.is_authenticated and attachment.message.hidden_for.filter(id=request.user.id).exists()):
         return HttpResponseForbidden("Accès refusé à ce message")
     
     # Vérifier si c'est une vidéo
@@ -515,77 +520,83 @@ def attachment_videothumb(request, attachment_id):
     # Dans une version ultérieure, on pourrait générer une miniature
     return _serve_attachment(attachment, request, as_attachment=False)
 
-@require_GET
-def attachment_zip_list(request, attachment_id):
-    """
-    Affiche la liste des fichiers contenus dans une archive ZIP.
-    """
+def _zip_attachment(request, attachment_id):
+    """Pièce jointe ZIP lisible par l'utilisateur et son manifeste (exams.zip_manifest)."""
     try:
-        attachment = Attachment.objects.get(id=attachment_id)
+        attachment = Attachment.objects.select_related('message').get(id=attachment_id)
     except Attachment.DoesNotExist:
         raise Http404("Pièce jointe non trouvée")
-    
+
     # Vérifier les permissions
-    if attachment.message.deleted_for_all or (request.user.is_authenticated and attachment.message.deleted_for_users.filter(id=request.user.id).exists()):
-        return HttpResponseForbidden("Accès refusé à ce message")
-    
+    if attachment.message.deleted or (request.user.is_authenticated and attachment.message.hidden_for.filter(id=request.user.id).exists()):
+        return attachment, HttpResponseForbidden("Accès refusé à ce message")
+
     # Vérifier si c'est une archive ZIP
     if not attachment.is_zip():
-        return JsonResponse({'ok': False, 'error': 'Ce fichier n\'est pas une archive ZIP'}, status=400)
-    
-    # Lire la liste des fichiers dans l'archive
+        return attachment, JsonResponse({'ok': False, 'error': 'Ce fichier n\'est pas une archive ZIP'}, status=400)
+    return attachment, None
+
+@require_GET
+def attachment_zip_list(request, attachment_id):
+    """
+    Affiche la liste des fichiers contenus dans une archive ZIP
+    (lue dans le manifeste calculé au stockage, sans rouvrir l'archive).
+    """
+    attachment, error = _zip_attachment(request, attachment_id)
+    if error is not None:
+        return error
+
     try:
-        with zipfile.ZipFile(attachment.file.path, 'r') as zf:
-            file_list = [{
-                'name': info.filename,
-                'size': info.file_size,
-                'compressed_size': info.compress_size,
-                'is_dir': info.is_dir()
-            } for info in zf.infolist()]
-        
-        return JsonResponse({'ok': True, 'files': file_list})
+        manifest = zip_manifest.get(attachment.file)
     except (zipfile.BadZipFile, IOError) as e:
         logger.error(f"Erreur lors de la lecture de l'archive ZIP {attachment_id}: {str(e)}")
         return JsonResponse({'ok': False, 'error': 'Erreur lors de la lecture de l\'archive'}, status=500)
+    if manifest is None:
+        raise Http404("Pièce jointe non trouvée")
+
+    file_list = [{
+        'name': entry['name'],
+        'size': entry['size'],
+        'compressed_size': entry['compressed_size'],
+        'is_dir': entry['is_dir'],
+    } for entry in manifest['entries']]
+    return JsonResponse({'ok': True, 'files': file_list})
 
 @require_GET
 def attachment_zip_file(request, attachment_id):
     """
-    Extrait et sert un fichier spécifique d'une archive ZIP.
+    Extrait et sert un fichier spécifique d'une archive ZIP : position et
+    taille lues dans le manifeste, contenu lu et décompressé au fil de l'envoi.
     """
     file_path = request.GET.get('file')
     if not file_path:
         return JsonResponse({'ok': False, 'error': 'Paramètre file manquant'}, status=400)
-    
-    try:
-        attachment = Attachment.objects.get(id=attachment_id)
-    except Attachment.DoesNotExist:
-        raise Http404("Pièce jointe non trouvée")
-    
-    # Vérifier les permissions
-    if attachment.message.deleted_for_all or (request.user.is_authenticated and attachment.message.deleted_for_users.filter(id=request.user.id).exists()):
-        return HttpResponseForbidden("Accès refusé à ce message")
-    
-    # Vérifier si c'est une archive ZIP
-    if not attachment.is_zip():
-        return JsonResponse({'ok': False, 'error': 'Ce fichier n\'est pas une archive ZIP'}, status=400)
-    
-    # Extraire le fichier demandé
+
+    attachment, error = _zip_attachment(request, attachment_id)
+    if error is not None:
+        return error
+
     try:
-        with zipfile.ZipFile(attachment.file.path, 'r') as zf:
-            try:
-                file_info = zf.getinfo(file_path)
-            except KeyError:
-                return JsonResponse({'ok': False, 'error': 'Fichier non trouvé dans l\'archive'}, status=404)
-            
-            # Créer une réponse avec le contenu du fichier
-            response = HttpResponse(zf.read(file_info), content_type='application/octet-stream')
-            response['Content-Disposition'] = f'attachment; filename=\"{os.path.basename(file_path)}\"'
-            return response
+        manifest = zip_manifest.get(attachment.file)
+        if manifest is None:
+            raise Http404("Pièce jointe non trouvée")
+        entry = zip_manifest.find(manifest, file_path)
+        if entry is None:
+            return JsonResponse({'ok': False, 'error': 'Fichier non trouvé dans l\'archive'}, status=404)
+        content = zip_manifest.iter_member(attachment.file.path, entry)
+    except zip_manifest.UnsupportedMember:
+        return JsonResponse({'ok': False, 'error': 'Fichier chiffré ou compression non prise en charge'}, status=415)
     except (zipfile.BadZipFile, IOError) as e:
         logger.error(f"Erreur lors de l'extraction du fichier {file_path} de l'archive {attachment_id}: {str(e)}")
         return JsonResponse({'ok': False, 'error': 'Erreur lors de l\'extraction du fichier'}, status=500)
 
+    response = StreamingHttpResponse(content, content_type='application/octet-stream')
+    response['Content-Length'] = entry['size']
+    response['Content-Disposition'] = content_disposition_header(True, os.path.basename(file_path))
+    response['X-Content-Type-Options'] = 'nosniff'
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 @require_GET
 def assets_categories(request):
     """